@@ -0,0 +1,112 @@
+'''Parse many files at once, spread over a pool of worker processes'''
+
+import collections
+import cPickle
+import functools
+import heapq
+import multiprocessing
+import os
+
+import lexer
+import parse_cache
+import serialize
+import zypy_parser
+
+ParseResult = collections.namedtuple('ParseResult', 'path tree error')
+
+class result_error(Exception):
+	'''Stands in for the result of a file that a worker couldn't send back'''
+	pass
+
+# one per process, so the counters and running size stay consistent within a worker
+caches = {}
+
+def parse_file(path, cache_dir=None):
+	'''Parse the file at path; errors are returned in the result instead of raised.
+	With cache_dir, trees are looked up in and stored to a ParseCache there.'''
+	try:
+		source = lexer.open_source(path)
+		if cache_dir is None:
+			return ParseResult(path, zypy_parser.parse(source), None)
+		if cache_dir not in caches:
+			caches[cache_dir] = parse_cache.ParseCache(cache_dir)
+		return ParseResult(path, caches[cache_dir].parse(source), None)
+	except Exception as e:
+		# parse_error and lexer_error, but also the assertions that fail for constructs
+		# the parser doesn't handle yet
+		return ParseResult(path, None, e)
+
+def pack_result(result):
+	'''result as a worker sends it back. Pickling recurses once per level of the tree, so
+	the tree goes as serialize.dumps(), which doesn't. A result that can't be sent at all
+	becomes a result_error, so the other files' results still arrive.'''
+	try:
+		if result.tree is not None:
+			return result._replace(tree=serialize.dumps(result.tree))
+		cPickle.dumps(result.error, 2)
+		return result
+	except Exception as e:
+		return ParseResult(result.path, None, result_error("Can't send back the result: %s: %s" % (e.__class__.__name__, e)))
+
+def unpack_result(result):
+	'''The ParseResult a worker's pack_result() stands for'''
+	if result.tree is None:
+		return result
+	return result._replace(tree=serialize.loads(result.tree, lazy=False))
+
+def parse_packed(path, cache_dir=None):
+	'''parse_file() in a worker'''
+	return pack_result(parse_file(path, cache_dir))
+
+def parse_chunk(chunk, cache_dir=None):
+	return [(index, parse_packed(path, cache_dir)) for index, path in chunk]
+
+def file_size(path):
+	try:
+		return os.path.getsize(path)
+	except OSError:
+		# parse_file will report it
+		return 0
+
+def balance(paths, count):
+	'''Split paths into at most count chunks of about the same total size, by handing each
+	file, largest first, to the chunk that is smallest so far. Chunks hold (index, path).'''
+	sized = sorted(((file_size(path), index, path) for index, path in enumerate(paths)), reverse=True)
+	chunks = [(0, i, []) for i in range(min(count, len(paths)))]
+	for size, index, path in sized:
+		total, i, chunk = heapq.heappop(chunks)
+		chunk.append((index, path))
+		heapq.heappush(chunks, (total + size, i, chunk))
+	return [chunk for total, i, chunk in sorted(chunks, reverse=True)]
+
+def parse_files(paths, workers=None, chunks_per_worker=4, cache_dir=None):
+	'''Parse each of paths and return a ParseResult for each, in the same order as paths.
+
+	workers defaults to the number of CPUs; with workers=1 everything happens in this process.
+	Each worker gets several chunks, so a worker that finishes early can take over work.
+	cache_dir enables the on-disk parse cache, shared between the workers.'''
+	paths = list(paths)
+	if workers is None:
+		workers = multiprocessing.cpu_count()
+	if workers <= 1 or len(paths) <= 1:
+		return [parse_file(path, cache_dir) for path in paths]
+
+	results = [None] * len(paths)
+	pool = multiprocessing.Pool(workers)
+	try:
+		for chunk_results in pool.imap_unordered(functools.partial(parse_chunk, cache_dir=cache_dir), balance(paths, workers * chunks_per_worker)):
+			for index, result in chunk_results:
+				results[index] = unpack_result(result)
+	finally:
+		pool.terminate()
+	return results
+
+def find_files(directory, extension='.py'):
+	'''All files under directory with the given extension, in a stable order'''
+	out = []
+	for root, dirs, files in os.walk(directory):
+		dirs.sort()
+		for name in sorted(files):
+			if name.endswith(extension):
+				out.append(os.path.join(root, name))
+	return out
@@ -0,0 +1,4 @@
+'''Throughput benchmarks for the lexer and parser.
+
+python -m bench.run writes a JSON file of measurements over a generated corpus, and
+python -m bench.compare compares two of them, e.g. from before and after a change.'''
@@ -0,0 +1,60 @@
+'''Compare two result files from bench.run.
+
+	python -m bench.compare BEFORE.json AFTER.json [--threshold PERCENT]
+
+Prints each measurement side by side with the change. Exits with status 1 if any phase got
+slower or used more memory by more than the threshold (default 5%).'''
+
+import json
+import optparse
+import sys
+
+# (key, True if bigger is better, or None if the change shouldn't count as a regression)
+METRICS = [
+	('seconds', False),
+	# a difference of two timings, so too noisy to judge by
+	('parse_only_seconds', None),
+	('tokens_per_second', True),
+	('statements_per_second', True),
+	('peak_memory_kb', False),
+]
+
+def compare(before, after, threshold=5.0):
+	'''Returns a list of (phase, metric, before, after, percent change, regressed) tuples'''
+	rows = []
+	for phase in sorted(set(before['phases']) & set(after['phases'])):
+		old, new = before['phases'][phase], after['phases'][phase]
+		for metric, bigger_is_better in METRICS:
+			if metric not in old or metric not in new:
+				continue
+			change = (new[metric] - old[metric]) * 100.0 / old[metric] if old[metric] else 0.0
+			if bigger_is_better is None:
+				regressed = False
+			else:
+				regressed = (-change if bigger_is_better else change) > threshold
+			rows.append((phase, metric, old[metric], new[metric], change, regressed))
+	return rows
+
+def main(argv):
+	parser = optparse.OptionParser(usage=__doc__.split('\n\n')[1].strip())
+	parser.add_option('--threshold', type='float', default=5.0, help='percent change that counts as a regression')
+	options, args = parser.parse_args(argv)
+	if len(args) != 2:
+		parser.error('expected two result files')
+
+	with open(args[0]) as f:
+		before = json.load(f)
+	with open(args[1]) as f:
+		after = json.load(f)
+
+	if before['corpus'] != after['corpus']:
+		print 'warning: the corpora differ; the numbers are not comparable'
+	print '%s -> %s' % (before.get('revision'), after.get('revision'))
+	regressed = False
+	for phase, metric, old, new, change, worse in compare(before, after, options.threshold):
+		print '%-9s %-22s %14.3f %14.3f %+7.1f%%%s' % (phase, metric, old, new, change, '  <-- regression' if worse else '')
+		regressed = regressed or worse
+	sys.exit(1 if regressed else 0)
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,144 @@
+'''Seeded generator of source code the parser can handle.
+
+The same seed and size always give the same text, so runs on different commits measure
+the same input. The output sticks to what the parser supports today: defs, classes, for,
+while and with blocks, imports, return/pass/break/continue and operator expressions over
+names, strings and numbers. Blocks have no blank lines in them, since the parser ends a
+block at a blank line.'''
+
+import random
+
+NAMES = ['x', 'y', 'i', 'self', 'data', 'value', 'result', 'items', 'count', 'node',
+	'first_name', 'parse_error', 'MAX_DEPTH', 'cache', 'key', 'options']
+MODULES = ['os', 'sys', 'os.path', 'collections', 'itertools', 'lexer', 'zypy_parser']
+STRINGS = ["'str'", '"double"', "'with \\\\ escape'", "'tab\\tnewline\\n'", "r'raw\\d+'",
+	"'''triple\nquoted'''", '""', "'%s: %d'"]
+NUMBERS = ['0', '1', '42', '100000', '0x1f', '1e3', '2j', '12345678901234567890']
+BINARY = ['+', '-', '*', '/', '//', '%', '**', '|', '&', '^', '<<', '>>', 'and', 'or',
+	'==', '!=', '<', '>', '<=', '>=', 'in', 'not in', 'is', 'is not']
+UNARY = ['-', '+', '~', 'not ']
+
+class Generator(object):
+	def __init__(self, seed):
+		self.random = random.Random(seed)
+		self.functions = 0
+
+	def name(self):
+		return self.random.choice(NAMES)
+
+	def atom(self):
+		r = self.random.random()
+		if r < 0.5:
+			return self.name()
+		elif r < 0.7:
+			return self.random.choice(NUMBERS)
+		elif r < 0.9:
+			return self.random.choice(STRINGS)
+		else:
+			# a float with a space after it; the lexer swallows the character following a
+			# decimal point literal
+			return '%d.%d ' % (self.random.randrange(10), self.random.randrange(10))
+
+	def primary(self, depth):
+		out = self.atom()
+		if out in NAMES:
+			for i in range(self.random.randrange(3)):
+				r = self.random.random()
+				if r < 0.4:
+					out += '.' + self.name()
+				elif r < 0.8:
+					args = [self.expression(depth + 1) for j in range(self.random.randrange(3))]
+					if self.random.random() < 0.2:
+						args.append('%s=%s' % (self.name(), self.expression(depth + 1)))
+					out += '(' + ', '.join(args) + ')'
+				else:
+					out += '[' + self.expression(depth + 1) + ']'
+		return out
+
+	def expression(self, depth=0):
+		if depth > 2 or self.random.random() < 0.3:
+			out = self.primary(depth)
+		elif self.random.random() < 0.1:
+			out = '(%s for %s in %s)' % (self.expression(depth + 1), self.name(), self.expression(depth + 1))
+		elif self.random.random() < 0.1:
+			out = '(%s, %s)' % (self.expression(depth + 1), self.expression(depth + 1))
+		else:
+			out = self.primary(depth)
+			for i in range(self.random.randrange(1, 4)):
+				out += ' %s %s' % (self.random.choice(BINARY), self.primary(depth + 1))
+		if self.random.random() < 0.05:
+			out = self.random.choice(UNARY) + '(' + out + ')'
+		return out
+
+	def simple_statement(self, in_loop):
+		r = self.random.random()
+		if r < 0.4:
+			return 'return ' + self.expression()
+		elif r < 0.55:
+			module = self.random.choice(MODULES)
+			if self.random.random() < 0.5:
+				return 'import %s as %s' % (module, self.name())
+			return 'from %s import %s' % (module, self.name())
+		elif r < 0.7 and in_loop:
+			return self.random.choice(['break', 'continue'])
+		else:
+			return 'pass'
+
+	def block(self, indent, depth, in_loop=False):
+		'''Lines of an indented block'''
+		lines = []
+		for i in range(self.random.randrange(1, 6)):
+			r = self.random.random()
+			if depth >= 3 or r < 0.5:
+				lines.append(indent + self.simple_statement(in_loop))
+			elif r < 0.65:
+				lines.append('%sfor %s in %s:' % (indent, self.name(), self.expression()))
+				lines.extend(self.block(indent + '\t', depth + 1, True))
+			elif r < 0.8:
+				lines.append('%swhile %s:' % (indent, self.expression()))
+				lines.extend(self.block(indent + '\t', depth + 1, True))
+			elif r < 0.9:
+				lines.append('%swith %s as %s:' % (indent, self.expression(), self.name()))
+				lines.extend(self.block(indent + '\t', depth + 1, in_loop))
+			else:
+				lines.extend(self.function(indent, depth + 1))
+		return lines
+
+	def function(self, indent='', depth=0):
+		self.functions += 1
+		args = ['arg%d' % i for i in range(self.random.randrange(4))]
+		args += ['%s=%s' % (name, self.random.choice(NUMBERS + STRINGS[:3]))
+			for name in ('key', 'default')[:self.random.randrange(3)]]
+		if self.random.random() < 0.2:
+			args.append('*args')
+		if self.random.random() < 0.2:
+			args.append('**kwargs')
+		lines = ['%sdef f%d(%s):' % (indent, self.functions, ', '.join(args))]
+		lines.extend(self.block(indent + '\t', depth))
+		return lines
+
+	def klass(self):
+		bases = ', '.join(self.random.choice(['object', 'Base', 'mixins.Mixin']) for i in range(self.random.randrange(1, 3)))
+		lines = ['class C%d(%s):' % (self.functions, bases)]
+		for i in range(self.random.randrange(1, 5)):
+			lines.extend(self.function('\t', 1))
+		return lines
+
+	def module(self, size):
+		'''size top-level statements, separated by blank lines'''
+		chunks = []
+		for i in range(size):
+			r = self.random.random()
+			if r < 0.15:
+				chunks.append([self.simple_statement(False)])
+			elif r < 0.4:
+				chunks.append(self.klass())
+			elif r < 0.5:
+				chunks.append(['for %s in %s:' % (self.name(), self.expression())] + self.block('\t', 1, True))
+			else:
+				chunks.append(self.function())
+		return '\n\n'.join('\n'.join(lines) for lines in chunks) + '\n'
+
+def generate(size, seed=0):
+	'''Source text with size top-level statements, about 1.2 kB each'''
+	return Generator(seed).module(size)
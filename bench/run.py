@@ -0,0 +1,141 @@
+'''Measure lexer and parser throughput on a generated corpus.
+
+	python -m bench.run [--size N] [--seed S] [--engine ENGINE] [--repeat R] [--output FILE]
+
+Each phase runs in a fresh interpreter, so its peak memory isn't hidden by an earlier
+phase's. Times are the best of --repeat runs. The results are written as JSON (to stdout
+without --output) and can be compared with python -m bench.compare.'''
+
+import hashlib
+import json
+import optparse
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import corpus
+
+PHASES = ('tokenize', 'parse')
+
+def count_statements(tree):
+	'''Number of statements in tree, at any depth'''
+	from tokens import Statement
+	import visitor
+	return sum(1 for node in visitor.walk(tree) if isinstance(node, Statement))
+
+def peak_memory_kb():
+	# kilobytes on Linux, bytes on OS X
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak // 1024 if sys.platform == 'darwin' else peak
+
+def measure_phase(phase, source, engine=None, repeat=3):
+	'''Run one phase repeat times in this process; returns a dict of measurements'''
+	import lexer
+	import zypy_parser
+
+	baseline = peak_memory_kb()
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		if phase == 'tokenize':
+			result = list(lexer.tokenize(source, engine=engine))
+		else:
+			result = zypy_parser.parse(source, engine=engine)
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+		if i < repeat - 1:
+			del result
+
+	out = {
+		'seconds': best,
+		'peak_memory_kb': peak_memory_kb(),
+		'baseline_memory_kb': baseline,
+	}
+	if phase == 'tokenize':
+		out['tokens'] = len(result)
+		out['tokens_per_second'] = len(result) / max(best, 1e-9)
+	else:
+		out['statements'] = count_statements(result)
+		out['statements_per_second'] = out['statements'] / max(best, 1e-9)
+	return out
+
+def run_phase(phase, path, engine=None, repeat=3):
+	'''measure_phase in a child interpreter'''
+	command = [sys.executable, '-m', 'bench.run', '--phase', phase, '--corpus', path, '--repeat', str(repeat)]
+	if engine is not None:
+		command += ['--engine', engine]
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	output = subprocess.check_output(command, cwd=root)
+	return json.loads(output)
+
+def git_revision():
+	try:
+		with open(os.devnull, 'w') as devnull:
+			return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull,
+				cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def run(size=200, seed=0, engine=None, repeat=3):
+	'''Generate the corpus and measure every phase; returns the results as a dict'''
+	source = corpus.generate(size, seed)
+	fd, path = tempfile.mkstemp(suffix='.py')
+	try:
+		with os.fdopen(fd, 'w') as f:
+			f.write(source)
+		phases = dict((phase, run_phase(phase, path, engine, repeat)) for phase in PHASES)
+	finally:
+		os.unlink(path)
+
+	tokenize, parse = phases['tokenize'], phases['parse']
+	# the parser pulls tokens as it goes, so its own share is the difference
+	parse['parse_only_seconds'] = max(parse['seconds'] - tokenize['seconds'], 0)
+	parse['tokens_per_second'] = tokenize['tokens'] / max(parse['seconds'], 1e-9)
+	return {
+		'revision': git_revision(),
+		'python': platform.python_version(),
+		'engine': engine or 'default',
+		'repeat': repeat,
+		'corpus': {
+			'size': size,
+			'seed': seed,
+			'bytes': len(source),
+			'lines': source.count('\n'),
+			'sha1': hashlib.sha1(source).hexdigest(),
+		},
+		'phases': phases,
+	}
+
+def main(argv):
+	parser = optparse.OptionParser(usage=__doc__.split('\n\n')[1].strip())
+	parser.add_option('--size', type='int', default=200, help='number of top-level statements')
+	parser.add_option('--seed', type='int', default=0)
+	parser.add_option('--engine', help='lexer engine (default: the lexer\'s default)')
+	parser.add_option('--repeat', type='int', default=3)
+	parser.add_option('--output', help='file to write the JSON results to')
+	# used by run_phase
+	parser.add_option('--phase', help=optparse.SUPPRESS_HELP)
+	parser.add_option('--corpus', help=optparse.SUPPRESS_HELP)
+	options, args = parser.parse_args(argv)
+
+	if options.phase:
+		with open(options.corpus) as f:
+			source = f.read()
+		json.dump(measure_phase(options.phase, source, options.engine, options.repeat), sys.stdout)
+		return
+
+	results = run(options.size, options.seed, options.engine, options.repeat)
+	if options.output:
+		with open(options.output, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+	else:
+		json.dump(results, sys.stdout, indent=2, sort_keys=True)
+		print
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,142 @@
+'''Lexing and parsing in small steps, for programs that can't block for a whole file, such
+as servers running an event loop
+
+	parser = cooperative.FeedParser()
+	for data in chunks_from_the_network:
+		for statement in parser.feed(data):
+			...
+	for statement in parser.close():
+		...
+
+The work done by each feed() is in proportion to the text passed in (plus the statement
+it completes), so a large file doesn't hold up the loop. tokenize_steps() and
+parse_steps() do the same for a file-like object: each step of the generator reads a
+chunk and hands out at most a given number of tokens or statements, which suits
+scheduling with e.g. Twisted's task.cooperate() or Tornado's gen.moment between steps.
+For files big enough that parsing them at all costs too much time in the loop's
+process, offload() parses them in a multiprocessing pool instead.'''
+
+from tokens import *
+import batch
+import incremental
+import lexer
+
+CHUNK_SIZE = 16 * 1024
+
+class FeedParser(object):
+	'''Parser that is fed text in pieces and hands out each top-level statement once the
+	text that follows shows that the statement is complete'''
+	def __init__(self):
+		self.tokenizer = lexer.StreamTokenizer()
+		# tokens of the statements that are not complete yet
+		self.tokens = []
+		# how far self.tokens has been searched for the start of a statement
+		self.searched = 0
+
+	def feed(self, text):
+		'''Add the next piece of source; returns the list of statements completed by it'''
+		self.tokens.extend(self.tokenizer.feed(text))
+		return self.parse_complete()
+
+	def close(self):
+		'''Signal the end of the source; returns the remaining statements'''
+		self.tokens.extend(self.tokenizer.close())
+		# without EOFToken, the parser would report a confusing error of its own
+		self.tokenizer.raise_error()
+		tokens, self.tokens = self.tokens, []
+		if len(tokens) == 1:
+			# only EOF
+			return []
+		return incremental.parse_statement_tokens(tokens)
+
+	def parse_complete(self):
+		# a top-level statement starts after indentation 0, as in split_statements(), so
+		# everything before the last such start is complete; the token after the
+		# indentation needs to be known
+		tokens = self.tokens
+		start = None
+		for i in xrange(max(self.searched, 1), len(tokens) - 1):
+			token = tokens[i]
+			if isinstance(token, IndentationToken) and token.value == 0:
+				next = tokens[i + 1]
+				if next is not NewlineToken and next is not EOFToken and next not in incremental.continuation_keywords:
+					start = i
+		self.searched = max(len(tokens) - 1, 1)
+		if start is None:
+			return []
+		self.tokens = tokens[start:]
+		self.searched -= start
+		return incremental.parse_statement_tokens(tokens[:start])
+
+def read_chunks(fp, chunk_size=CHUNK_SIZE):
+	'''Generate the chunks read from file-like object fp'''
+	while True:
+		chunk = fp.read(chunk_size)
+		if not chunk:
+			return
+		yield chunk
+
+def batches(items, size):
+	while len(items) >= size:
+		yield items[:size]
+		del items[:size]
+
+def tokenize_steps(fp, tokens_per_step=1000, chunk_size=CHUNK_SIZE):
+	'''Generate lists of at most tokens_per_step tokens of the source read from fp; each step
+	reads at most a chunk. The last list ends with EOFToken. Steps may give empty lists.'''
+	tokenizer = lexer.StreamTokenizer()
+	pending = []
+	for chunk in read_chunks(fp, chunk_size):
+		pending.extend(tokenizer.feed(chunk))
+		if len(pending) < tokens_per_step:
+			yield []
+		for step in batches(pending, tokens_per_step):
+			yield step
+	pending.extend(tokenizer.close())
+	for step in batches(pending, tokens_per_step):
+		yield step
+	if pending:
+		yield pending
+	tokenizer.raise_error()
+
+def parse_steps(fp, statements_per_step=100, chunk_size=CHUNK_SIZE):
+	'''Generate lists of at most statements_per_step top-level statements of the source read
+	from fp; each step reads at most a chunk. Steps may give empty lists.'''
+	parser = FeedParser()
+	pending = []
+	for chunk in read_chunks(fp, chunk_size):
+		pending.extend(parser.feed(chunk))
+		if len(pending) < statements_per_step:
+			yield []
+		for step in batches(pending, statements_per_step):
+			yield step
+	pending.extend(parser.close())
+	for step in batches(pending, statements_per_step):
+		yield step
+	if pending:
+		yield pending
+
+class offloaded(object):
+	'''What offload() returns: the pool's AsyncResult, with the result it gets unpacked'''
+	def __init__(self, result):
+		self.result = result
+
+	def ready(self):
+		return self.result.ready()
+
+	def wait(self, timeout=None):
+		self.result.wait(timeout)
+
+	def get(self, timeout=None):
+		return batch.unpack_result(self.result.get(timeout))
+
+def offload(pool, path, callback=None):
+	'''Parse the file at path in pool, a multiprocessing.Pool. The returned object's get(),
+	or callback, which the pool calls in one of its threads, gets the file's
+	batch.ParseResult. The tree comes back serialized, as in batch.parse_files(), so
+	trees too deep to pickle arrive too.'''
+	if callback is not None:
+		packed_callback = lambda result: callback(batch.unpack_result(result))
+	else:
+		packed_callback = None
+	return offloaded(pool.apply_async(batch.parse_packed, (path,), callback=packed_callback))
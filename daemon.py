@@ -0,0 +1,237 @@
+'''A long-lived parse server on a Unix domain socket, and its client
+
+	python test.py serve /tmp/zypy.sock &
+	python test.py remote /tmp/zypy.sock parsefile foo.py
+
+The server keeps the lexer and parser imported and the trees of the files it has parsed
+in memory, so a request only costs the parsing that actually has to happen. A file is
+parsed again only when its mtime or size has changed and the hash of its contents has
+too; the output of each format is kept until then as well.
+
+Requests and responses are JSON objects, each sent as a 4-byte big-endian length followed
+by that many bytes. Strings from sources and trees are bytes, so they are put into the JSON
+as Latin-1, which gives each byte back unchanged. A request has a "command":
+
+	{"command": "parse", "path": PATH, "format": "text" or "json"}
+		-> {"output": ...}, the dump of the tree of the file
+	{"command": "check", "path": PATH}
+		-> {"diagnostics": [[line, column, kind, message], ...]}
+	{"command": "stats"}
+		-> {"files": ..., "parses": ..., "hits": ..., "requests": ...}
+	{"command": "shutdown"}
+		-> {}, and the server stops
+
+A request that fails gets {"error": message} instead. A connection can carry any number
+of requests, one after the other. Paths are taken relative to the server's working
+directory, so clients should send absolute ones.'''
+
+import collections
+import hashlib
+import json
+import os
+import socket
+import SocketServer
+import StringIO
+import struct
+
+import dumper
+import recovery
+import zypy_parser
+
+HEADER = struct.Struct('>I')
+# larger messages are refused, so a stray connection can't make the server allocate
+# without bound
+MAX_MESSAGE = 256 * 1024 * 1024
+
+class protocol_error(Exception):
+	pass
+
+def send_message(sock, message):
+	data = json.dumps(message, encoding='latin-1')
+	sock.sendall(HEADER.pack(len(data)) + data)
+
+def recv_exactly(sock, size):
+	'''size bytes from sock, or None if the connection is closed before any arrive'''
+	chunks = []
+	remaining = size
+	while remaining:
+		chunk = sock.recv(min(remaining, 1024 * 1024))
+		if not chunk:
+			if chunks or size == 0:
+				raise protocol_error('Connection closed in the middle of a message')
+			return None
+		chunks.append(chunk)
+		remaining -= len(chunk)
+	return ''.join(chunks)
+
+def recv_message(sock):
+	'''The next message from sock, or None at the end of the connection. A message that
+	isn't a JSON object raises ValueError; its length was right, so the next message can
+	still be read.'''
+	header = recv_exactly(sock, HEADER.size)
+	if header is None:
+		return None
+	size, = HEADER.unpack(header)
+	if size > MAX_MESSAGE:
+		raise protocol_error('Message of %d bytes is too large' % size)
+	data = recv_exactly(sock, size) if size else ''
+	if data is None:
+		raise protocol_error('Connection closed in the middle of a message')
+	message = json.loads(data)
+	if not isinstance(message, dict):
+		raise ValueError('Messages must be JSON objects, not %s' % type(message).__name__)
+	return message
+
+class file_entry(object):
+	'''What the server knows about one file: the stat it was last checked with, the hash
+	of its contents and the tree (or error) and outputs for them'''
+	def __init__(self):
+		self.stat = None
+		self.digest = None
+		self.source = None
+		self.tree = None
+		self.error = None
+		self.outputs = {}
+
+class ParseServer(SocketServer.UnixStreamServer):
+	'''Serves requests on the socket at path, one connection at a time; parsing is CPU
+	work, so threads wouldn't answer any sooner. At most max_files trees are kept; the
+	least recently requested go first.'''
+	def __init__(self, path, max_files=1000):
+		self.files = collections.OrderedDict()
+		self.max_files = max_files
+		self.parses = 0
+		self.hits = 0
+		self.requests = 0
+		self.stopping = False
+		SocketServer.UnixStreamServer.__init__(self, path, request_handler)
+
+	def serve(self):
+		'''Handle requests until one asks for a shutdown'''
+		try:
+			while not self.stopping:
+				self.handle_request()
+		finally:
+			self.server_close()
+			try:
+				os.unlink(self.server_address)
+			except OSError:
+				pass
+
+	def entry(self, path):
+		'''The file_entry for path, brought up to date with the file'''
+		path = os.path.abspath(path)
+		entry = self.files.pop(path, None)
+		# a file that can't be read drops out of the cache and takes no room in it
+		st = os.stat(path)
+		stat = st.st_mtime, st.st_size
+		if entry is not None and stat == entry.stat:
+			self.hits += 1
+			self.files[path] = entry
+			return entry
+		with open(path, 'rb') as f:
+			source = f.read()
+		if entry is None:
+			entry = file_entry()
+		self.files[path] = entry
+		if len(self.files) > self.max_files:
+			self.files.popitem(last=False)
+		digest = hashlib.sha1(source).digest()
+		entry.stat = stat
+		if digest == entry.digest:
+			# touched, but not changed
+			self.hits += 1
+			return entry
+		self.parses += 1
+		entry.digest = digest
+		entry.source = source
+		entry.outputs = {}
+		try:
+			entry.tree, entry.error = zypy_parser.parse(source), None
+		except Exception as e:
+			# parse_error, lexer_error and the assertions that fail for what the parser
+			# doesn't handle yet; kept, so a broken file isn't parsed over and over either
+			entry.tree, entry.error = None, '%s: %s' % (e.__class__.__name__, e)
+		return entry
+
+	def output(self, entry, format):
+		if format not in entry.outputs:
+			if entry.error is not None:
+				raise protocol_error(entry.error)
+			out = StringIO.StringIO()
+			dumper.dump(entry.tree, out, format)
+			entry.outputs[format] = out.getvalue()
+		return entry.outputs[format]
+
+	def handle(self, request):
+		'''The response to a request'''
+		self.requests += 1
+		command = request.get('command')
+		if command == 'parse':
+			entry = self.entry(request['path'])
+			return {'output': self.output(entry, request.get('format', 'text'))}
+		elif command == 'check':
+			entry = self.entry(request['path'])
+			if 'check' not in entry.outputs:
+				tree, diagnostics = recovery.parse_with_recovery(entry.source)
+				entry.outputs['check'] = [list(diagnostic) for diagnostic in diagnostics]
+			return {'diagnostics': entry.outputs['check']}
+		elif command == 'stats':
+			return {'files': len(self.files), 'parses': self.parses, 'hits': self.hits,
+				'requests': self.requests}
+		elif command == 'shutdown':
+			self.stopping = True
+			return {}
+		else:
+			raise protocol_error('Unknown command: %r' % command)
+
+class request_handler(SocketServer.BaseRequestHandler):
+	def handle(self):
+		while not self.server.stopping:
+			try:
+				request = recv_message(self.request)
+			except ValueError as e:
+				send_message(self.request, {'error': str(e)})
+				continue
+			except protocol_error as e:
+				# can't tell where the next message would start
+				send_message(self.request, {'error': str(e)})
+				return
+			if request is None:
+				return
+			try:
+				response = self.server.handle(request)
+			except (protocol_error, EnvironmentError, KeyError, ValueError) as e:
+				response = {'error': str(e)}
+			send_message(self.request, response)
+
+def serve(path, max_files=1000):
+	'''Run a ParseServer on the socket at path until it is asked to shut down'''
+	ParseServer(path, max_files).serve()
+
+class Client(object):
+	'''A connection to a ParseServer'''
+	def __init__(self, path):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.connect(path)
+
+	def request(self, command, **arguments):
+		'''Send a request and return the response; an error response is raised as a
+		protocol_error'''
+		arguments['command'] = command
+		send_message(self.sock, arguments)
+		response = recv_message(self.sock)
+		if response is None:
+			raise protocol_error('Connection closed by the server')
+		if 'error' in response:
+			raise protocol_error(response['error'])
+		return response
+
+	def close(self):
+		self.sock.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
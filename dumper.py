@@ -0,0 +1,199 @@
+'''Write trees out as text or JSON, a piece at a time
+
+	dumper.dump(tree, sys.stdout)            # what print tree shows
+	dumper.dump(tree, sys.stdout, 'json')    # JSON, a line per top-level statement
+
+The tree is walked with an explicit stack and the output goes to the file as it is
+produced, so the time and memory needed stay in proportion to the size of the tree,
+however deep it is. Strings from the source are bytes, so the JSON format writes them as
+Latin-1, which gives each byte back unchanged, as the daemon does.'''
+
+import json
+
+from tokens import *
+
+# ASTNode.__str__ itself, which the text format writes out field by field
+ast_str = ASTNode.__dict__['__str__']
+
+# how text_pieces() writes each type of value: with str() or repr(), or piece by piece
+# as an ASTNode, list, tuple or dict
+SCALAR, AST, LIST, TUPLE, DICT = range(5)
+kinds = {list: LIST, tuple: TUPLE, dict: DICT}
+
+def kind_of(cls):
+	try:
+		return kinds[cls]
+	except KeyError:
+		if issubclass(cls, Node) and getattr(cls.__str__, 'im_func', None) is ast_str:
+			kind = AST
+		elif issubclass(cls, list):
+			kind = LIST
+		elif issubclass(cls, tuple):
+			kind = TUPLE
+		elif issubclass(cls, dict):
+			kind = DICT
+		else:
+			kind = SCALAR
+		kinds[cls] = kind
+		return kind
+
+def text_pieces(tree, pieces_per_chunk=1024):
+	'''Generate str(tree) in chunks'''
+	if kind_of(type(tree)) == SCALAR:
+		yield str(tree)
+		return
+	out = []
+	# text to write, and values to write out in its place; for those, str() and repr()
+	# are the same: a node's repr() is its str(), and the str() of a container is its repr()
+	stack = [tree]
+	while stack:
+		value = stack.pop()
+		kind = kinds.get(type(value))
+		if kind is None:
+			kind = kind_of(type(value))
+		if kind == SCALAR:
+			# only text is pushed as a scalar
+			out.append(value)
+			if len(out) >= pieces_per_chunk:
+				yield ''.join(out)
+				out = []
+			continue
+
+		parts = []
+		if kind == AST:
+			text = [value.__class__.__name__, '(']
+			separator = ''
+			for field in value._fields:
+				item = getattr(value, field, missing)
+				if item is missing:
+					continue
+				text.append(separator + field + '=')
+				separator = ', '
+				item_kind = kinds.get(type(item))
+				if item_kind is None:
+					item_kind = kind_of(type(item))
+				if item_kind == SCALAR:
+					text.append(str(item))
+				else:
+					parts.append(''.join(text))
+					parts.append(item)
+					text = []
+			text.append(')')
+		else:
+			# (text before the item, item)
+			if kind == DICT:
+				text = ['{']
+				items = [(repr(key) + ': ', item) for key, item in value.iteritems()]
+				closing = '}'
+			else:
+				text = ['[' if kind == LIST else '(']
+				items = [('', item) for item in value]
+				closing = ']' if kind == LIST else ',)' if len(value) == 1 else ')'
+			separator = ''
+			for prefix, item in items:
+				text.append(separator + prefix)
+				separator = ', '
+				item_kind = kinds.get(type(item))
+				if item_kind is None:
+					item_kind = kind_of(type(item))
+				if item_kind == SCALAR:
+					text.append(repr(item))
+				else:
+					parts.append(''.join(text))
+					parts.append(item)
+					text = []
+			text.append(closing)
+		parts.append(''.join(text))
+		parts.reverse()
+		stack.extend(parts)
+	yield ''.join(out)
+
+# what is on json_pieces' stack: text to write as it is, or a value to write as JSON
+TEXT, VALUE = range(2)
+
+def json_pieces(tree):
+	'''Generate the pieces of tree as JSON. A node becomes an object with its class name
+	under "_type" and its fields that are set; tuples become lists.'''
+	stack = [(VALUE, tree)]
+	while stack:
+		kind, value = stack.pop()
+		if kind == TEXT:
+			yield value
+			continue
+		if isinstance(value, Node):
+			if isinstance(value, SpanToken):
+				# like the token it stands for; its source is the whole file
+				fields = [('value', value.value)]
+				name = value.kind.__name__
+			else:
+				fields = value.iter_fields()
+				name = value.__class__.__name__
+			yield '{"_type": ' + json.dumps(name)
+			closing = '}'
+			parts = []
+			for field, item in fields:
+				parts.append((TEXT, ', ' + json.dumps(field) + ': '))
+				parts.append((VALUE, item))
+		elif isinstance(value, (list, tuple)):
+			yield '['
+			closing = ']'
+			parts = []
+			for i, item in enumerate(value):
+				if i:
+					parts.append((TEXT, ', '))
+				parts.append((VALUE, item))
+		elif isinstance(value, dict):
+			yield '{'
+			closing = '}'
+			parts = []
+			first = True
+			for key in sorted(value):
+				if not first:
+					parts.append((TEXT, ', '))
+				parts.append((TEXT, json.dumps(str(key), encoding='latin-1') + ': '))
+				parts.append((VALUE, value[key]))
+				first = False
+		else:
+			yield json.dumps(value, encoding='latin-1')
+			continue
+		stack.append((TEXT, closing))
+		stack.extend(reversed(parts))
+
+def write_pieces(pieces, fp, buffer_size=1024):
+	'''Write the strings from pieces to fp, a few at a time'''
+	buffer = []
+	for piece in pieces:
+		buffer.append(piece)
+		if len(buffer) >= buffer_size:
+			fp.write(''.join(buffer))
+			buffer = []
+	if buffer:
+		fp.write(''.join(buffer))
+
+def dump_text(tree, fp):
+	write_pieces(text_pieces(tree), fp)
+	fp.write('\n')
+
+def dump_json(tree, fp):
+	'''One line of JSON per statement of a StatementList, or one line for anything else'''
+	values = tree.value if isinstance(tree, StatementList) else [tree]
+	for value in values:
+		write_pieces(json_pieces(value), fp)
+		fp.write('\n')
+
+FORMATS = {
+	'text': dump_text,
+	'json': dump_json,
+}
+
+def dump(tree, fp, format='text'):
+	'''Write tree to file object fp in format ('text' or 'json'), followed by a newline'''
+	try:
+		dumper = FORMATS[format]
+	except KeyError:
+		raise ValueError("Unknown dump format: %s" % format)
+	dumper(tree, fp)
+
+def dumps(tree):
+	'''str(tree), built without recursion, so also for trees too deep for str()'''
+	return ''.join(text_pieces(tree))
@@ -0,0 +1,124 @@
+'''Hash-consing: make structurally identical subtrees of a tree share one instance
+
+	table = hash_consing.HashConser()
+	tree = hash_consing.parse(source, table)
+	print table.report()
+
+Generated code repeats the same names, literals, expressions and imports many times over;
+sharing them can take a fraction of the memory. Blocks (nodes with a statements field, and
+StatementLists) are never shared themselves, so each def, class and loop is still its own
+object, but everything under them is. As with any hashed node, shared nodes must not be
+changed. A HashConser can be used for several trees, which then share with each other too.'''
+
+import sys
+
+from tokens import *
+import zypy_parser
+
+class HashConser(object):
+	def __init__(self):
+		# canonical instance of each distinct subtree
+		self.table = {}
+		self.nodes = 0
+		self.shared = 0
+		self.bytes_saved = 0
+
+	def share(self, value):
+		'''Return value with its subtrees replaced by their canonical instances. Lists and
+		dicts are changed in place; a node may be replaced by an equal one. Like
+		NodeTransformer.transform, this walks the tree with an explicit stack, so deep trees
+		don't run out of recursion.'''
+		# entries are (value, None) for a value still to be shared, and (value, keys) once
+		# its parts are on the stack; keys are the fields, indices or dict keys of the parts
+		stack = [(value, None)]
+		# the shared version of each finished value
+		results = []
+		while stack:
+			value, keys = stack.pop()
+			if keys is None:
+				if isinstance(value, (list, tuple)):
+					keys = range(len(value))
+					parts = value
+				elif isinstance(value, dict):
+					keys = value.keys()
+					parts = [value[key] for key in keys]
+				elif not isinstance(value, Node) or isinstance(value, (Keyword, Operator)):
+					results.append(value)
+					continue
+				elif isinstance(value, (DefStatement, ClassStatement)) and not is_loaded(value):
+					# sharing would mean parsing the body now
+					results.append(value)
+					continue
+				else:
+					keys = []
+					parts = []
+					for field, child in value.iter_fields():
+						keys.append(field)
+						parts.append(child)
+				stack.append((value, keys))
+				for part in reversed(parts):
+					stack.append((part, None))
+				continue
+
+			start = len(results) - len(keys)
+			parts = results[start:]
+			del results[start:]
+			if isinstance(value, list):
+				value[:] = parts
+			elif isinstance(value, tuple):
+				value = tuple(parts)
+			elif isinstance(value, dict):
+				for key, part in zip(keys, parts):
+					value[key] = part
+			else:
+				for field, part in zip(keys, parts):
+					if part is not getattr(value, field):
+						setattr(value, field, part)
+				self.nodes += 1
+				if not ('statements' in value._fields or isinstance(value, StatementList)):
+					canonical = self.table.setdefault(value, value)
+					if canonical is not value:
+						self.shared += 1
+						self.bytes_saved += self.own_size(value, canonical)
+						value = canonical
+			results.append(value)
+		return results[0]
+
+	def own_size(self, node, canonical):
+		'''Bytes freed when node goes away in favor of canonical: the node itself, its lists,
+		tuples and dicts, and the field values that are not the same objects as canonical's.
+		Its child nodes are already shared, so they stay.'''
+		size = sys.getsizeof(node)
+		if isinstance(node, SpanToken):
+			# its text is part of the source, which stays
+			return size
+		for field, value in node.iter_fields():
+			if value is not getattr(canonical, field, missing):
+				size += container_size(value)
+		return size
+
+	def report(self):
+		percent = self.shared * 100.0 / self.nodes if self.nodes else 0.0
+		return '%d nodes, %d shared (%.1f%%), %d distinct, %.1f kB saved' % (
+			self.nodes, self.shared, percent, len(self.table), self.bytes_saved / 1024.0)
+
+def container_size(value):
+	'''Size of value and the containers in it, without the nodes in it'''
+	if isinstance(value, Node):
+		return 0
+	size = sys.getsizeof(value)
+	if isinstance(value, (list, tuple)):
+		for item in value:
+			size += container_size(item)
+	elif isinstance(value, dict):
+		for key, item in value.iteritems():
+			size += container_size(key) + container_size(item)
+	return size
+
+def parse(source, table=None, engine=None):
+	'''Parse source with its subtrees shared through table (a new HashConser by default).
+	Each top-level statement is shared as soon as it is parsed, so the copies it would
+	duplicate are freed right away.'''
+	if table is None:
+		table = HashConser()
+	return StatementList([table.share(statement) for statement in zypy_parser.iter_parse(source, engine=engine)])
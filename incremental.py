@@ -0,0 +1,388 @@
+'''Incremental lexing and parsing: after an edit, redo only the work for the part of the source that changed'''
+
+import bisect
+
+from tokens import *
+from peeking_iterator import peeking_iterator
+import lexer
+import zypy_parser
+
+# tokens per run of a PositionedTokens
+RUN_SIZE = 256
+
+class PositionedTokens(object):
+	'''The (token, start, end) triples of a source, like a list. They are kept in runs whose
+	offsets are relative to the start of the run, so an edit only has to shift the start of
+	each run after it, not every token. Runs are never changed, so a PositionedTokens made
+	by replace() shares the runs it didn't touch with the one it came from.'''
+	def __init__(self, runs, bases):
+		# lists of (token, start, end), with start and end relative to the base of the run
+		self.runs = runs
+		self.bases = bases
+		# index of the first token of each run
+		self.firsts = []
+		count = 0
+		for run in runs:
+			self.firsts.append(count)
+			count += len(run)
+		self.length = count
+
+	@classmethod
+	def from_triples(cls, triples):
+		'''A PositionedTokens of triples with absolute offsets'''
+		runs, bases = [], []
+		for i in xrange(0, len(triples), RUN_SIZE):
+			chunk = triples[i:i + RUN_SIZE]
+			base = chunk[0][1]
+			runs.append([(token, start - base, end - base) for token, start, end in chunk])
+			bases.append(base)
+		return cls(runs, bases)
+
+	def __len__(self):
+		return self.length
+
+	def locate(self, index):
+		'''(run number, index in the run) of the token at index'''
+		if index < 0:
+			index += self.length
+		if not 0 <= index < self.length:
+			raise IndexError(index)
+		run = bisect.bisect_right(self.firsts, index) - 1
+		return run, index - self.firsts[run]
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			start, stop, step = index.indices(self.length)
+			if step != 1:
+				return [self[i] for i in xrange(start, stop, step)]
+			return list(self.iter_range(start, stop))
+		run, i = self.locate(index)
+		base = self.bases[run]
+		token, start, end = self.runs[run][i]
+		return token, start + base, end + base
+
+	def __iter__(self):
+		return self.iter_range(0, self.length)
+
+	def iter_range(self, start, stop):
+		'''Generate the triples from index start up to stop'''
+		if start >= stop:
+			return
+		run, i = self.locate(start)
+		count = stop - start
+		while count > 0:
+			base = self.bases[run]
+			for token, token_start, token_end in self.runs[run][i:i + count]:
+				yield token, token_start + base, token_end + base
+			count -= len(self.runs[run]) - i
+			run += 1
+			i = 0
+
+	def tokens(self, start=0, stop=None):
+		'''The tokens from index start to stop, without their positions'''
+		if stop is None:
+			stop = self.length
+		return [triple[0] for triple in self.iter_range(start, stop)]
+
+	def find_token(self, offset):
+		'''Index of the last token that starts before offset, or -1'''
+		run = bisect.bisect_left(self.bases, offset) - 1
+		if run < 0:
+			return -1
+		tokens = self.runs[run]
+		offset -= self.bases[run]
+		lo, hi = 0, len(tokens)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if tokens[mid][1] < offset:
+				lo = mid + 1
+			else:
+				hi = mid
+		return self.firsts[run] + lo - 1
+
+	def replace(self, first, stop, triples, delta):
+		'''A new PositionedTokens with the tokens from index first to stop replaced by triples
+		(with absolute offsets) and the tokens after them moved by delta'''
+		if first < self.length:
+			first_run, i = self.locate(first)
+		else:
+			first_run, i = len(self.runs), 0
+		if stop < self.length:
+			stop_run, j = self.locate(stop)
+		else:
+			stop_run, j = len(self.runs) - 1, None
+		# the rest of the runs the replaced tokens start and end in
+		head = self[self.firsts[first_run]:first] if first_run < len(self.runs) else []
+		tail = []
+		if j is not None:
+			base = self.bases[stop_run] + delta
+			tail = [(token, start + base, end + base) for token, start, end in self.runs[stop_run][j:]]
+		middle = PositionedTokens.from_triples(head + list(triples) + tail)
+		runs = self.runs[:first_run] + middle.runs + self.runs[stop_run + 1:]
+		bases = self.bases[:first_run] + middle.bases + [base + delta for base in self.bases[stop_run + 1:]]
+		return PositionedTokens(runs, bases)
+
+def lex_positions(source):
+	'''Lex source into a PositionedTokens, the form relex() works on'''
+	return PositionedTokens.from_triples(list(lexer.scan(source)))
+
+def relex(source, tokens, offset, removed_length, inserted_text):
+	'''Apply the edit (offset, removed_length, inserted_text) to source and update tokens,
+	which must be the lex_positions() of source.
+
+	Lexing restarts at the beginning of the line containing the edit. A multi-line string
+	is a single token, so the restart point always lies before the string's opening quotes.
+	Lexing stops as soon as it reaches a newline past the edit that was also a newline token
+	in the old stream; from there on the old tokens are reused, shifted by the change in length.
+	That takes time in proportion to the lines lexed again plus the number of runs, not the
+	number of tokens.
+
+	Returns (new_source, new_tokens, first, old_stop, new_stop): tokens[first:old_stop] were
+	replaced by new_tokens[first:new_stop]. tokens itself is left as it was.'''
+	if offset < 0 or removed_length < 0 or offset + removed_length > len(source):
+		raise ValueError("Edit out of range: %d, %d" % (offset, removed_length))
+	new_source = source[:offset] + inserted_text + source[offset + removed_length:]
+	delta = len(inserted_text) - removed_length
+	edit_end = offset + len(inserted_text)
+
+	# restart at the newline token that begins the line the edit is on
+	first = tokens.find_token(offset)
+	while first >= 0 and tokens[first][0] is not NewlineToken:
+		first -= 1
+	if first < 0:
+		first = 0
+		restart = 0
+	else:
+		restart = tokens[first][1]
+
+	relexed = []
+	for triple in lexer.scan(new_source, restart):
+		token, start, end = triple
+		if token is NewlineToken and start >= edit_end:
+			# the text from here on is unchanged; see if the old stream had a line break here too
+			old_stop = tokens.find_token(start - delta + 1)
+			if old_stop > first and tokens[old_stop][0] is NewlineToken and tokens[old_stop][1] == start - delta:
+				new_tokens = tokens.replace(first, old_stop, relexed, delta)
+				return new_source, new_tokens, first, old_stop, first + len(relexed)
+		relexed.append(triple)
+
+	return new_source, tokens.replace(first, len(tokens), relexed, delta), first, len(tokens), first + len(relexed)
+
+# keywords that continue the statement on the previous line at the same indentation
+continuation_keywords = set([ElseKeyword, ElifKeyword, ExceptKeyword, FinallyKeyword])
+
+def token_key(token):
+	'''Hashable stand-in for token that compares by value'''
+	if isinstance(token, (Keyword, Operator)) or token is NewlineToken or token is EOFToken:
+		return token
+	elif isinstance(token, ImaginaryToken):
+		return ImaginaryToken, token.a, token.b
+	else:
+		return token.__class__, token.value
+
+def split_statements(tokens):
+	'''Split a list of tokens into the runs that make up each top-level statement.
+
+	A top-level statement starts on a line with no indentation, unless that line starts
+	with else (or another continuation keyword), so a block and its else stay together.'''
+	start = 0
+	for i in xrange(1, len(tokens) - 1):
+		token = tokens[i]
+		if isinstance(token, IndentationToken) and token.value == 0:
+			next = tokens[i + 1]
+			if next is not NewlineToken and next is not EOFToken and next not in continuation_keywords:
+				yield tokens[start:i]
+				start = i
+	yield tokens[start:]
+
+def parse_statement_tokens(tokens):
+	'''Parse one run of tokens from split_statements() on its own; returns a list of statements'''
+	if tokens[-1] is not EOFToken:
+		# this is how the parser would see the start of the next statement
+		tokens = tokens + [IndentationToken.of(0), EOFToken]
+	return zypy_parser.parse_program(peeking_iterator(tokens)).value
+
+class reusing_cursor(object):
+	'''Cursor over a list of tokens for the parser, which reuses defs and classes from an
+	earlier parse. blocks maps the key of each def or class (its level and the token_keys
+	of its tokens) to (node, inner), where inner holds the same for the defs and classes
+	inside it. The parser calls reuse_statement() at the start of each statement (see
+	try_parse_statement); a block whose key is in blocks is skipped and its node returned.
+	Each node is taken out of blocks when it is used, so no two places share it, and the
+	keys of the blocks of this parse are collected in self.found.'''
+	def __init__(self, tokens, blocks):
+		self.tokens = tokens
+		self.keys = [token_key(token) for token in tokens]
+		self.pos = 0
+		self.pushed = []
+		self.blocks = blocks
+		# the blocks found so far, and those inside the blocks being parsed
+		self.found = {}
+		self.stack = []
+		self.reused = 0
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		if self.pushed:
+			return self.pushed.pop()
+		if self.pos > len(self.tokens):
+			raise StopIteration()
+		self.pos += 1
+		return self.tokens[self.pos - 1] if self.pos <= len(self.tokens) else None
+
+	def peek(self):
+		if self.pushed:
+			return self.pushed[-1]
+		return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+	def has_next(self):
+		return bool(self.pushed) or self.pos <= len(self.tokens)
+
+	def push_back(self, token):
+		self.pushed.append(token)
+
+	def block_end(self, start, level):
+		'''Index of the newline (or EOFToken) that ends the block of the statement at start'''
+		tokens = self.tokens
+		for i in xrange(start, len(tokens)):
+			token = tokens[i]
+			if token is EOFToken:
+				return i
+			if token is NewlineToken:
+				next = tokens[i + 1]
+				if not isinstance(next, IndentationToken) or next.value <= level:
+					return i
+		return None
+
+	def reuse_statement(self, level, parse):
+		'''The statement at the cursor: from blocks, or else from parse()'''
+		if self.pushed:
+			return parse()
+		start = self.pos
+		if start < len(self.tokens) and isinstance(self.tokens[start], IndentationToken):
+			start += 1
+		if start >= len(self.tokens) or self.tokens[start] not in zypy_parser.lazy_keywords:
+			return parse()
+		end = self.block_end(start, level)
+		if end is None:
+			return parse()
+		# where the parser leaves the cursor after a block: past the newline that ends it,
+		# with a newline pushed back
+		stop = end + 1 if self.tokens[end] is NewlineToken else end
+		key = level, tuple(self.keys[start:end])
+
+		entry = self.blocks.pop(key, None)
+		if entry is not None:
+			node, inner = entry
+			self.reused += 1
+			self.pos = stop
+			self.pushed.append(NewlineToken)
+		else:
+			self.stack.append(self.found)
+			self.found = {}
+			try:
+				node = parse()
+			finally:
+				inner, self.found = self.found, self.stack.pop()
+			if self.pos != stop or self.pushed != [NewlineToken]:
+				# ended somewhere else, e.g. a body on the same line; don't keep it
+				return node
+		self.found.update(inner)
+		self.found[key] = node, inner
+		return node
+
+class statement_run(object):
+	'''A top-level statement in an IncrementalParser: the number of tokens it spans, their
+	keys, the statements they parse to and the defs and classes in those'''
+	def __init__(self, length, key, statements, blocks):
+		self.length = length
+		self.key = key
+		self.statements = statements
+		self.blocks = blocks
+
+class IncrementalParser(object):
+	'''Keeps the tree from the previous parse, and after an edit reparses only the top-level
+	statements whose tokens changed. The statement objects of the others are reused as they
+	are, and so are the defs and classes inside a changed statement whose own tokens did
+	not change, at any depth. self.reused counts the top-level statements kept by the last
+	edit and self.reused_blocks the defs and classes.'''
+	def __init__(self, source=''):
+		self.source = source
+		self.tokens = lex_positions(source)
+		self.runs = []
+		# the runs from before a parse that failed, so the next one can still reuse them
+		self.failed_runs = []
+		self.reused = 0
+		self.reused_blocks = 0
+		self.tree = self.reparse()
+
+	def edit(self, offset, removed_length, inserted_text):
+		self.source, self.tokens, first, old_stop, new_stop = relex(
+			self.source, self.tokens, offset, removed_length, inserted_text)
+		if self.runs is None:
+			# the last parse failed
+			return self.reparse()
+
+		starts = []
+		count = 0
+		for run in self.runs:
+			starts.append(count)
+			count += run.length
+		# the statements the changed tokens are in; and the one before, since a statement
+		# starts where its first two tokens say so (see split_statements)
+		a = max(bisect.bisect_right(starts, first - 2) - 1, 0)
+		b = bisect.bisect_left(starts, old_stop)
+		stop = (starts[b] if b < len(starts) else count) + new_stop - old_stop
+		return self.parse_runs(a, b, self.tokens.tokens(starts[a] if starts else 0, stop))
+
+	def update(self, source):
+		'''Replace the whole source, still reusing the statements that did not change'''
+		self.source = source
+		self.tokens = lex_positions(source)
+		return self.reparse()
+
+	def reparse(self):
+		if self.runs is None:
+			self.runs = self.failed_runs
+		return self.parse_runs(0, len(self.runs), self.tokens.tokens())
+
+	def parse_runs(self, a, b, tokens):
+		'''Replace self.runs[a:b] by the statements of tokens'''
+		old = self.runs[a:b]
+		by_key = dict((run.key, run) for run in old)
+		new = []
+		for tokens in split_statements(tokens):
+			key = tuple(token_key(token) for token in tokens)
+			new.append(by_key.pop(key, None) or (tokens, key))
+		# the blocks of the statements that are not kept whole
+		blocks = {}
+		for run in by_key.itervalues():
+			blocks.update(run.blocks)
+		self.reused = len(self.runs) - len(old)
+		self.reused_blocks = 0
+		# until the parse is through, runs doesn't match tokens
+		runs, self.runs, self.failed_runs = self.runs, None, self.runs
+
+		for i, run in enumerate(new):
+			if isinstance(run, statement_run):
+				self.reused += 1
+				continue
+			tokens, key = run
+			if tokens[-1] is not EOFToken:
+				# this is how the parser would see the start of the next statement
+				tokens = tokens + [IndentationToken.of(0), EOFToken]
+			cursor = reusing_cursor(tokens, blocks)
+			statements = zypy_parser.parse_program(cursor).value
+			self.reused_blocks += cursor.reused
+			new[i] = statement_run(len(key), key, statements, cursor.found)
+		runs[a:b] = new
+		self.runs = runs
+		self.failed_runs = None
+
+		out = StatementList()
+		for run in runs:
+			out.value.extend(run.statements)
+		self.tree = out
+		return out
@@ -1,6 +1,12 @@
 PUNCTUATION_CHARS = set("+-*/%&|^@=></,.!()[]{}~:;\"'\\")
 QUOTE_CHARS = set("'\"")
 
+import mmap
+import os
+import re
+from itertools import imap
+from operator import itemgetter
+
 from peeking_iterator import peeking_iterator
 from tokens import *
 
@@ -9,14 +15,14 @@ class lexer_error(Exception):
 
 def consume_while(it, pred):
 	"""Eat all characters out of the iterator while predicate pred holds true; returns their concatenation"""
-	out = ""
+	chars = []
 	while True:
 		c = it.peek()
 		if c is not EOFToken and pred(c):
-			out += c
+			chars.append(c)
 			it.next()
 		else:
-			return out
+			return ''.join(chars)
 
 def initialize_operators():
 	def add_to_tree(tree, op, obj):
@@ -37,6 +43,10 @@ def initialize_operators():
 		add_to_tree(tree, op, obj)
 	return tree
 
+# built once: the operators are all registered by the time tokens is imported, and
+# building the tree costs more than lexing a short snippet
+OPERATOR_TREE = initialize_operators()
+
 def get_operators(tree, c, it):
 	if c in tree:
 		next = it.peek()
@@ -47,9 +57,66 @@ def get_operators(tree, c, it):
 		else:
 			return obj
 
-def tokenize(string):
+def open_source(path):
+	"""Map the file at path into memory, so that it can be lexed straight from the page cache"""
+	with open(path, 'rb') as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			# empty files can't be mapped
+			return ''
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# sources that are lexed in memory; an mmap also has read(), but it isn't a stream
+BUFFER_TYPES = (basestring, mmap.mmap, bytearray, buffer, memoryview)
+
+def is_stream(source):
+	"""Whether source is a file-like object to be read in chunks, rather than text in memory"""
+	return hasattr(source, 'read') and not isinstance(source, BUFFER_TYPES)
+
+def source_buffer(source):
+	"""Return source in a form the engines can index, slice and match without copying it.
+	str, unicode, mmap and buffer objects are used as they are."""
+	if isinstance(source, bytearray):
+		return buffer(source)
+	elif isinstance(source, memoryview):
+		# Python 2's re module can't match against a memoryview
+		return source.tobytes()
+	return source
+
+def indentation_token(indentation):
+	if indentation == '':
+		return IndentationToken.of(0)
+	chars = set(indentation)
+	if chars == {' '}:
+		return IndentationToken.of(len(indentation))
+	elif chars == {'\t'}:
+		return IndentationToken.of(len(indentation) * 8)
+	else:
+		raise lexer_error("Invalid indentation: %s" % repr(indentation))
+
+def tokenize(string, engine=None, spans=False):
+	"""Tokenize string using the named engine ('loop' or 'regex'); both produce the same tokens.
+
+	string may also be an mmap, bytearray or memoryview. With spans=True, barewords, plain
+	strings and integers are produced as SpanTokens that point into string rather than
+	copying their text; only the regex engine supports this."""
+	string = source_buffer(string)
+	if engine is None:
+		engine = 'regex' if spans else DEFAULT_ENGINE
+	try:
+		tokenizer = ENGINES[engine]
+	except KeyError:
+		raise ValueError("Unknown lexer engine: %s" % engine)
+	if spans:
+		if engine != 'regex':
+			raise ValueError("Span tokens require the regex engine")
+		return tokenizer(string, spans=True)
+	return tokenizer(string)
+
+def tokenize_loop(string):
 	it = peeking_iterator(iter(string), end_default=EOFToken)
-	tree = initialize_operators()
+	tree = OPERATOR_TREE
+	# one token per distinct name in this source
+	names = {}
 
 	# yell about whitespace at beginning of file
 	c = it.peek()
@@ -66,16 +133,7 @@ def tokenize(string):
 			yield NewlineToken
 			# consume indentation on next line
 			indentation = consume_while(it, lambda c: c.isspace() and c != '\n')
-			if indentation == '':
-				yield IndentationToken(0)
-			else:
-				chars = set(indentation)
-				if chars == {' '}:
-					yield IndentationToken(len(indentation))
-				elif chars == {'\t'}:
-					yield IndentationToken(len(indentation) * 8)
-				else:
-					raise lexer_error("Invalid indentation: %s" % repr(indentation))
+			yield indentation_token(indentation)
 		# ignore whitespace
 		elif c.isspace():
 			continue
@@ -98,7 +156,10 @@ def tokenize(string):
 				if kwd:
 					yield kwd
 				else:
-					yield BarewordToken(brwd)
+					token = names.get(brwd)
+					if token is None:
+						token = names[brwd] = BarewordToken.of(brwd)
+					yield token
 		elif c.isdigit():
 			yield consume_number(c, it)
 		elif c == '#':
@@ -128,7 +189,7 @@ def consume_number(c, it, recursive=True):
 		it.next()
 		if digits == '0':
 			hexdigits = consume_while(it, lambda c: c.isdigit() or c in set('abcdefABCDEF'))
-			return IntegerToken(int(hexdigits, 16))
+			return IntegerToken.of(int(hexdigits, 16))
 		else:
 			raise lexer_error("x in numeric literal must be part of hexadecimal literal")
 	elif next in ('j', 'J') and recursive:
@@ -151,7 +212,7 @@ def consume_number(c, it, recursive=True):
 	elif next.isalpha() or next == '_':
 		raise lexer_error("invalid character following numberic literal")
 	else:
-		return IntegerToken(int(digits))
+		return IntegerToken.of(int(digits))
 
 
 def try_consume_string(q, it, raw=False):
@@ -170,13 +231,13 @@ def try_consume_string(q, it, raw=False):
 
 
 def consume_string(it, raw=False, multiline=False, closing="'", closing_count=1):
-	out = ''
+	out = []
 	in_escape = False
 	current_closing_count = 0
 	while True:
 		c = it.next()
 		if c is EOFToken:
-			raise lexer_error("EOF within string literal: %s" % out)
+			raise lexer_error("EOF within string literal: %s" % ''.join(out))
 		if c == closing and not in_escape:
 			current_closing_count += 1
 			if current_closing_count == closing_count:
@@ -190,38 +251,413 @@ def consume_string(it, raw=False, multiline=False, closing="'", closing_count=1)
 			# this is needed to reproduce real Python behavior
 			# r'a\'' gives a string containing a, \, '
 			if raw:
-				out += c
+				out.append(c)
 			continue
 		if c == '\n' and not multiline:
 			raise lexer_error("Unexpected newline within string literal")
 		if in_escape and raw:
-			out += c
+			out.append(c)
 			in_escape = False
 		elif in_escape:
 			if c == 'n':
-				out += '\n'
+				out.append('\n')
 			elif c == 'r':
-				out += '\r'
+				out.append('\r')
 			elif c == 't':
-				out += '\t'
+				out.append('\t')
 			elif c == 'a':
-				out += '\a'
+				out.append('\a')
 			elif c == 'u':
 				raise lexer_error("I'm too lazy to provide Unicode support")
 			elif c in PUNCTUATION_CHARS:
-				out += c
+				out.append(c)
 			else:
 				raise lexer_error("Unrecognized escape sequence: \\%s" % c)
 			in_escape = False
 		else:
-			out += c
+			out.append(c)
 
+	out = ''.join(out)
 	# reproduce bug in actual Python
 	if raw and len(out) > 0 and out[-1] == '\\' and not (len(out) > 1 and out[-2] == '\\'):
 		raise lexer_error("Can't have backslash at end of raw string: %s" % out)
 
 	return StringToken(out)
 
+#
+# Regex engine: one compiled master pattern handles the common tokens, and
+# anything it does not cover falls back to the character-level helpers above
+#
+
+def operator_pattern():
+	# longest first, so the alternation matches like the greedy walk down the operator tree
+	ops = sorted(Operator.operators, key=len, reverse=True)
+	return '|'.join(re.escape(op) for op in ops)
+
+# Names, numbers and indentation that run into a non-ASCII character are left to the
+# slow path, which uses the same str/unicode predicates as the loop engine.
+MASTER_PATTERN = re.compile(r"""
+	(?P<name>[A-Za-z_][A-Za-z0-9_]*)(?![A-Za-z0-9_]|[^\x00-\x7f])
+	|(?P<operator>%s)
+	|(?P<space>[ \t\r\f\v]+)
+	|(?P<newline>\n[ \t\r\f\v]*)(?![ \t\r\f\v]|[^\x00-\x7f])
+	|(?P<integer>[0-9]+)(?![0-9A-Za-z_.]|[^\x00-\x7f])
+	|(?P<string>'[^'\\\n]+'|"[^"\\\n]+")
+	|(?P<comment>\#[^\n]*)
+""" % operator_pattern(), re.VERBOSE)
+
+MAX_KEYWORD_LENGTH = max(len(kwd) for kwd in Keyword.keywords)
+
+class incomplete_input(Exception):
+	"""Raised by a partial scan() that needs text past the end of its string to finish a token"""
+	pass
+
+class string_cursor(object):
+	"""Cursor over a string with the peek()/next() behavior of peeking_iterator(end_default=EOFToken)
+
+	With partial=True, the string is the start of a longer text, so looking at its end
+	raises incomplete_input instead of giving EOFToken."""
+	def __init__(self, string, pos, partial=False):
+		self.string = string
+		self.pos = pos
+		self.end = len(string)
+		self.partial = partial
+
+	def peek(self):
+		if self.pos < self.end:
+			return self.string[self.pos]
+		elif self.pos == self.end:
+			if self.partial:
+				raise incomplete_input()
+			return EOFToken
+		else:
+			raise StopIteration()
+
+	def next(self):
+		c = self.peek()
+		self.pos += 1
+		return c
+
+def scan(string, pos=0, spans=False, partial=False):
+	"""Generate (token, start, end) triples for the tokens of string, starting at offset pos.
+
+	pos must be 0 or the offset of a newline character; the token stream only depends on
+	the text from there on. The end of a token may lie past the end of string when the
+	number scanner has consumed the end of input.
+
+	With partial=True, string is only the start of the text: the character scanners raise
+	incomplete_input where they would have seen the end of input, and tokens that reach
+	the end of string may still grow."""
+	end = len(string)
+	if pos == 0 and end and string[0].isspace() and string[0] != '\n':
+		raise lexer_error("Unexpected whitespace at beginning of file")
+
+	match = MASTER_PATTERN.match
+	keywords = Keyword.keywords
+	operators = Operator.operators
+	tree = OPERATOR_TREE
+	# one token per distinct name in this source
+	names = {}
+	while pos < end:
+		start = pos
+		m = match(string, pos)
+		if m is not None:
+			kind = m.lastgroup
+			pos = m.end()
+			if kind == 'name':
+				if spans and pos - start > MAX_KEYWORD_LENGTH:
+					# too long to be a keyword, so there is no need to look at the text
+					yield BarewordSpan(string, start, pos), start, pos
+					continue
+				text = m.group(kind)
+				if text == 'r' and pos < end and string[pos] in QUOTE_CHARS:
+					# raw string
+					it = string_cursor(string, pos + 1, partial)
+					yield try_consume_string(string[pos], it, raw=True), start, it.pos
+					pos = it.pos
+				else:
+					kwd = keywords.get(text)
+					if kwd:
+						yield kwd, start, pos
+					elif spans:
+						yield BarewordSpan(string, start, pos), start, pos
+					else:
+						token = names.get(text)
+						if token is None:
+							token = names[text] = BarewordToken.of(text)
+						yield token, start, pos
+			elif kind == 'operator':
+				yield operators[m.group(kind)], start, pos
+			elif kind == 'newline':
+				yield NewlineToken, start, start + 1
+				if partial and pos == end:
+					# the indentation may go on, and an error about it would be premature
+					raise incomplete_input()
+				yield indentation_token(m.group(kind)[1:]), start + 1, pos
+			elif kind == 'integer':
+				if spans:
+					yield IntegerSpan(string, start, pos), start, pos
+				else:
+					yield IntegerToken.of(int(m.group(kind))), start, pos
+			elif kind == 'string':
+				if spans:
+					yield StringSpan(string, start, pos), start, pos
+				else:
+					yield StringToken(m.group(kind)[1:-1]), start, pos
+			# whitespace and comments produce nothing
+		else:
+			# the same decisions as tokenize_loop, for everything the pattern leaves alone
+			c = string[pos]
+			it = string_cursor(string, pos + 1, partial)
+			if c == '\n':
+				yield NewlineToken, start, start + 1
+				indentation = consume_while(it, lambda c: c.isspace() and c != '\n')
+				yield indentation_token(indentation), start + 1, it.pos
+			elif c.isspace():
+				pass
+			elif c in QUOTE_CHARS:
+				yield try_consume_string(c, it), start, it.pos
+			elif c in PUNCTUATION_CHARS:
+				op = get_operators(tree, c, it)
+				if not op:
+					raise lexer_error("Unexpected character %s" % c)
+				yield op, start, it.pos
+			elif c.isalpha() or c == '_':
+				if c == 'r' and it.peek() in QUOTE_CHARS:
+					q = it.next()
+					token = try_consume_string(q, it, raw=True)
+				else:
+					brwd = c + consume_while(it, lambda c: c.isalnum() or c == '_')
+					token = Keyword.is_keyword(brwd) or names.get(brwd)
+					if token is None:
+						token = names[brwd] = BarewordToken.of(brwd)
+				yield token, start, it.pos
+			elif c.isdigit():
+				yield consume_number(c, it), start, it.pos
+			else:
+				raise lexer_error("Unexpected character %s" % c)
+			pos = it.pos
+
+	# the number scanner may already have consumed the end of input
+	if pos == end:
+		yield EOFToken, end, end
+
+def tokenize_regex(string, spans=False):
+	return imap(itemgetter(0), scan(string, spans=spans))
+
+#
+# Skipping blocks: the parser's lazy mode steps over indented blocks by looking at
+# the text, and only lexes them when they are needed
+#
+
+dedent_patterns = {}
+
+def block_end(string, pos, level):
+	"""Offset of the newline that ends the block starting with the newline at pos: the
+	first following newline whose line is indented by level columns or less (blank lines
+	count as unindented, as they do for the parser), or len(string).
+
+	Returns None when the text alone can't tell, because a triple-quoted string might
+	contain newlines, or when the first line isn't indented enough to start a block."""
+	pattern = dedent_patterns.get(level)
+	if pattern is None:
+		pattern = dedent_patterns[level] = re.compile(
+			r"\n(?:\t{0,%d}| {0,%d})(?![ \t\r\f\v])" % (level // 8, level))
+	if pattern.match(string, pos):
+		return None
+	m = pattern.search(string, pos + 1)
+	stop = m.start() if m is not None else len(string)
+	if string.find("'''", pos, stop) != -1 or string.find('"""', pos, stop) != -1:
+		return None
+	return stop
+
+def scan_block(string, start, stop):
+	"""scan() the tokens between the newlines at start and stop, then the newline and
+	indentation at stop and EOF, like a source that ends after the block"""
+	for triple in scan(string, start):
+		if triple[1] >= stop:
+			break
+		yield triple
+	for token, token_start, token_end in scan(string, stop):
+		if token is EOFToken:
+			break
+		yield token, token_start, token_end
+		if isinstance(token, IndentationToken):
+			break
+	yield EOFToken, stop, stop
+
+class scan_cursor(object):
+	"""peeking_iterator over the triples from scan() or scan_block(), which can also skip
+	an indented block without lexing it"""
+	def __init__(self, string, triples=None, stop=None):
+		self.string = string
+		self.triples = scan(string) if triples is None else triples
+		# end of the scan_block() this cursor reads, if any
+		self.stop = stop
+		self.pushed = []
+		self.has_ended = False
+
+	def __iter__(self):
+		return self
+
+	def next_triple(self):
+		if self.pushed:
+			return self.pushed.pop()
+		try:
+			return self.triples.next()
+		except StopIteration:
+			if self.has_ended:
+				raise
+			self.has_ended = True
+			return None, None, None
+
+	def next(self):
+		return self.next_triple()[0]
+
+	def peek(self):
+		triple = self.next_triple()
+		self.pushed.append(triple)
+		return triple[0]
+
+	def has_next(self):
+		return bool(self.pushed) or not self.has_ended
+
+	def push_back(self, token):
+		self.pushed.append((token, None, None))
+
+	def skip_block(self, level):
+		"""If the next token is a newline that starts a block indented more than level, skip
+		the block and return the offsets of the newlines at its start and end. Returns None
+		and leaves the cursor alone when it can't skip the block."""
+		if len(self.pushed) != 1:
+			return None
+		token, start, end = self.pushed[0]
+		if token is not NewlineToken or start is None:
+			return None
+		stop = block_end(self.string, start, level)
+		if stop is None:
+			return None
+		self.pushed = []
+		if self.stop is None:
+			self.triples = scan(self.string, stop)
+		else:
+			self.triples = scan_block(self.string, stop, self.stop)
+		return start, stop
+
+#
+# Streaming: lexing text that arrives in pieces, e.g. from a pipe
+#
+
+class StreamTokenizer(object):
+	"""Tokenizes text fed to it in pieces, giving the tokens tokenize() gives for the whole
+	text as soon as they are complete.
+
+	Only the text from the end of the last token handed out is kept, so memory is bounded
+	by the size of the pieces plus the current token. A token that isn't complete at the
+	end of what has been fed (a name or operator that may go on, a string without its
+	closing quotes, a number without its exponent, a run of indentation) is lexed again
+	once more text has come in.
+
+	A lexer_error is raised once the tokens before it have been handed out: by the next
+	call to feed(), or by raise_error() after close()."""
+	def __init__(self):
+		# text from where the next scan starts, or from one character before it: scan()
+		# takes offset 0 as the start of the file
+		self.buffer = ''
+		self.pos = 0
+		# text fed since the last scan
+		self.pending = []
+		self.pending_length = 0
+		# number of tokens at pos that have already been handed out: a newline and its
+		# indentation come from the same match, so a scan can't start between them
+		self.skip = 0
+		self.closed = False
+		# lexer_error to raise on the next call
+		self.error = None
+
+	def feed(self, text):
+		"""Add the next piece of text; returns the list of tokens completed by it"""
+		if self.closed:
+			raise ValueError("StreamTokenizer is closed")
+		self.raise_error()
+		self.pending.append(text)
+		self.pending_length += len(text)
+		# rescanning an unfinished token only once it has grown by half keeps a long
+		# token fed in small pieces from being lexed over and over
+		if self.pending_length * 2 < len(self.buffer) - self.pos:
+			return []
+		return self.scan(partial=True)
+
+	def close(self):
+		"""Signal the end of the text; returns the remaining tokens, ending with EOFToken
+		unless there is a lexer error after them"""
+		self.closed = True
+		return self.scan(partial=False)
+
+	def raise_error(self):
+		"""Raise the lexer_error found after the tokens the last call returned, if any"""
+		if self.error is not None:
+			raise self.error
+
+	def scan(self, partial):
+		self.raise_error()
+		if self.pending:
+			self.buffer += ''.join(self.pending)
+			self.pending = []
+			self.pending_length = 0
+		buffer = self.buffer
+		end = len(buffer)
+		tokens = []
+		skip = self.skip
+		# where the scan after the last token handed out would go on
+		restart, restart_skip = self.pos, skip
+		try:
+			for token, start, stop in scan(buffer, self.pos, partial=partial):
+				if skip:
+					skip -= 1
+					continue
+				if partial and (stop >= end or token is EOFToken):
+					break
+				tokens.append(token)
+				if token is NewlineToken:
+					restart, restart_skip = start, 1
+				else:
+					restart, restart_skip = stop, 0
+		except incomplete_input:
+			pass
+		except lexer_error as e:
+			if not tokens:
+				raise
+			# hand out the tokens before the error first
+			self.error = e
+			return tokens
+		if restart > 1:
+			self.buffer = buffer[restart - 1:]
+			self.pos = 1
+		else:
+			self.pos = restart
+		self.skip = restart_skip
+		return tokens
+
+def tokenize_stream(fp, chunk_size=64 * 1024):
+	"""Generate the tokens of the text read from file-like object fp, chunk_size bytes at a time"""
+	tokenizer = StreamTokenizer()
+	while True:
+		chunk = fp.read(chunk_size)
+		if not chunk:
+			break
+		for token in tokenizer.feed(chunk):
+			yield token
+	for token in tokenizer.close():
+		yield token
+	tokenizer.raise_error()
+
+DEFAULT_ENGINE = 'loop'
+ENGINES = {
+	'loop': tokenize_loop,
+	'regex': tokenize_regex,
+}
+
 def print_tokens(string):
 	for tkn in tokenize(string):
 		print tkn, repr(tkn)
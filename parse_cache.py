@@ -0,0 +1,156 @@
+'''On-disk cache of parse trees, in the spirit of .pyc files.
+
+Entries are keyed by a hash of the source together with a fingerprint of the parser: the
+cache format version, the node classes and their fields, the keyword and operator tables
+in tokens.py, and the source of the lexer and parser modules. Changing any of those gives
+every file a new key, so stale trees are never loaded; the old entries just age out.
+
+Each entry is the StatementList from zypy_parser.parse in the serialize format, compressed
+with zlib; the bodies of defs and classes are only decoded when they are used. Writes
+go to a temporary file that is renamed into place, so readers (including other processes)
+never see half an entry. When the directory grows past max_bytes, the least recently used
+entries are removed.'''
+
+import hashlib
+import os
+import tempfile
+import zlib
+
+import lexer
+import serialize
+import tokens
+import zypy_parser
+
+# bump when the layout of an entry changes
+CACHE_VERSION = 2
+SUFFIX = '.zpc'
+
+def module_source(module):
+	path = module.__file__
+	if path.endswith(('.pyc', '.pyo')):
+		path = path[:-1]
+	try:
+		with open(path, 'rb') as f:
+			return f.read()
+	except IOError:
+		return ''
+
+def grammar_fingerprint():
+	'''Hash of everything that determines what tree a source parses to'''
+	h = hashlib.sha1()
+	h.update('version %d %d\n' % (CACHE_VERSION, serialize.FORMAT_VERSION))
+	for name, value in sorted(vars(tokens).items()):
+		if isinstance(value, type) and issubclass(value, tokens.Node):
+			bases = ','.join(base.__name__ for base in value.__bases__)
+			h.update('%s(%s) %s\n' % (name, bases, ','.join(value._fields)))
+	h.update(' '.join(sorted(tokens.Keyword.keywords)) + '\n')
+	h.update(' '.join(sorted(tokens.Operator.operators)) + '\n')
+	for module in (lexer, zypy_parser):
+		h.update(hashlib.sha1(module_source(module)).hexdigest() + '\n')
+	return h.hexdigest()
+
+class ParseCache(object):
+	def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.fingerprint = grammar_fingerprint()
+		self.hits = 0
+		self.misses = 0
+		if not os.path.isdir(directory):
+			try:
+				os.makedirs(directory)
+			except OSError:
+				# somebody else created it first
+				if not os.path.isdir(directory):
+					raise
+		self.size = sum(size for path, size, mtime in self.entries())
+
+	def key(self, source):
+		h = hashlib.sha1(self.fingerprint)
+		h.update(source)
+		return h.hexdigest()
+
+	def path(self, source):
+		return os.path.join(self.directory, self.key(source) + SUFFIX)
+
+	def entries(self):
+		'''(path, size, mtime) for each entry in the cache directory'''
+		out = []
+		for name in os.listdir(self.directory):
+			if name.endswith(SUFFIX):
+				path = os.path.join(self.directory, name)
+				try:
+					st = os.stat(path)
+				except OSError:
+					# evicted by another process
+					continue
+				out.append((path, st.st_size, st.st_mtime))
+		return out
+
+	def get(self, source):
+		'''The cached tree for source, or None'''
+		path = self.path(source)
+		try:
+			with open(path, 'rb') as f:
+				data = f.read()
+		except IOError:
+			self.misses += 1
+			return None
+		try:
+			tree = serialize.loads(zlib.decompress(data))
+		except Exception:
+			# truncated or written by something else; drop it
+			self.remove(path)
+			self.misses += 1
+			return None
+		try:
+			# mark as recently used for eviction
+			os.utime(path, None)
+		except OSError:
+			pass
+		self.hits += 1
+		return tree
+
+	def put(self, source, tree):
+		data = zlib.compress(serialize.dumps(tree))
+		fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				f.write(data)
+			os.rename(tmp, self.path(source))
+		except:
+			self.remove(tmp)
+			raise
+		self.size += len(data)
+		if self.size > self.max_bytes:
+			self.evict()
+
+	def parse(self, source, engine=None):
+		'''Like zypy_parser.parse, but goes through the cache'''
+		tree = self.get(source)
+		if tree is None:
+			tree = zypy_parser.parse(source, engine=engine)
+			self.put(source, tree)
+		return tree
+
+	def evict(self):
+		'''Remove the least recently used entries until the cache fits in 3/4 of max_bytes'''
+		entries = sorted(self.entries(), key=lambda entry: entry[2])
+		self.size = sum(size for path, size, mtime in entries)
+		target = self.max_bytes * 3 // 4
+		for path, size, mtime in entries:
+			if self.size <= target:
+				break
+			self.remove(path)
+			self.size -= size
+
+	def clear(self):
+		for path, size, mtime in self.entries():
+			self.remove(path)
+		self.size = 0
+
+	def remove(self, path):
+		try:
+			os.unlink(path)
+		except OSError:
+			pass
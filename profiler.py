@@ -0,0 +1,137 @@
+'''Per-rule profiling of the parser and lexer.
+
+	prof = profiler.Profiler()
+	with prof:
+		zypy_parser.parse(source)
+	print prof.report()
+
+While a Profiler is enabled, every parse_* function in zypy_parser (also where the
+statement and operator tables refer to them) and the lexer's character-level scanners
+are replaced by wrappers that record, per function:
+
+	calls       number of calls
+	cumulative  time spent in the function and everything it called; for recursive rules,
+	            only the outermost call counts, so nothing is counted twice
+	own         time spent in the function itself, not in other wrapped functions
+	tokens      tokens the lexer produced while the function ran, which for a grammar rule
+	            is the tokens it consumed (plus at most a token of lookahead); not shown
+	            for the lexer's scanners, which run before their token is handed out
+
+Disabling puts the original functions back, so there is no cost when profiling is off.
+Only work in this process is seen; parse_files() with several workers is not profiled.'''
+
+import time
+
+import lexer
+import zypy_parser
+
+# character-level scanners the lexer falls back to
+LEXER_SCANNERS = ('consume_string', 'try_consume_string', 'consume_number', 'consume_while', 'get_operators')
+# tables in zypy_parser that refer to parse functions directly
+DISPATCH_TABLES = ('keyworded_statements', 'one_line_keyworded_statements')
+
+class Stats(object):
+	__slots__ = ('name', 'calls', 'cumulative', 'own', 'tokens', 'depth')
+
+	def __init__(self, name):
+		self.name = name
+		self.calls = 0
+		self.cumulative = 0.0
+		self.own = 0.0
+		self.tokens = 0
+		self.depth = 0
+
+class Profiler(object):
+	def __init__(self):
+		self.stats = {}
+		self.tokens = 0
+		# time spent in wrapped callees, one entry per active wrapped call
+		self.children = []
+		# (namespace, key, original value) for everything that was replaced
+		self.patched = []
+
+	def wrap(self, name, function):
+		stats = self.stats.get(name)
+		if stats is None:
+			stats = self.stats[name] = Stats(name)
+		children = self.children
+		timer = time.time
+
+		def wrapper(*args, **kwargs):
+			stats.calls += 1
+			stats.depth += 1
+			tokens = self.tokens
+			children.append(0.0)
+			start = timer()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				elapsed = timer() - start
+				stats.own += elapsed - children.pop()
+				if children:
+					children[-1] += elapsed
+				stats.depth -= 1
+				if stats.depth == 0:
+					stats.cumulative += elapsed
+					stats.tokens += self.tokens - tokens
+		wrapper.__name__ = function.__name__
+		wrapper.__doc__ = function.__doc__
+		return wrapper
+
+	def counting(self, generator_function):
+		'''Wrap a function returning a token iterator so that the tokens are counted'''
+		def wrapper(*args, **kwargs):
+			for token in generator_function(*args, **kwargs):
+				self.tokens += 1
+				yield token
+		return wrapper
+
+	def patch(self, namespace, key, value):
+		self.patched.append((namespace, key, namespace[key]))
+		namespace[key] = value
+
+	def enable(self):
+		if self.patched:
+			return
+		parser_namespace = vars(zypy_parser)
+		wrapped = {}
+		for name, value in sorted(parser_namespace.items()):
+			if name.startswith('parse_') and callable(value) and not isinstance(value, type):
+				wrapped[value] = self.wrap(name, value)
+				self.patch(parser_namespace, name, wrapped[value])
+		for table in DISPATCH_TABLES:
+			table = parser_namespace[table]
+			for key, value in table.items():
+				self.patch(table, key, wrapped[value])
+		infix_operators = parser_namespace['infix_operators']
+		for key, (precedence, value) in infix_operators.items():
+			self.patch(infix_operators, key, (precedence, wrapped[value]))
+
+		lexer_namespace = vars(lexer)
+		for name in LEXER_SCANNERS:
+			self.patch(lexer_namespace, name, self.wrap(name, lexer_namespace[name]))
+		# every engine gets its tokens from one of these
+		self.patch(lexer_namespace, 'scan', self.counting(lexer_namespace['scan']))
+		self.patch(lexer.ENGINES, 'loop', self.counting(lexer.ENGINES['loop']))
+
+	def disable(self):
+		while self.patched:
+			namespace, key, value = self.patched.pop()
+			namespace[key] = value
+
+	def __enter__(self):
+		self.enable()
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.disable()
+
+	def report(self, limit=None):
+		'''Table of the functions that were called, by cumulative time'''
+		stats = sorted((s for s in self.stats.values() if s.calls), key=lambda s: s.cumulative, reverse=True)
+		lines = ['%-32s %9s %11s %11s %9s' % ('function', 'calls', 'cumulative', 'own', 'tokens')]
+		for s in stats[:limit]:
+			tokens = '-' if s.name in LEXER_SCANNERS else s.tokens
+			lines.append('%-32s %9d %10.4fs %10.4fs %9s' % (s.name, s.calls, s.cumulative, s.own, tokens))
+		lines.append('%d tokens lexed' % self.tokens)
+		return '\n'.join(lines)
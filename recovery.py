@@ -0,0 +1,115 @@
+'''Recovery mode: parse a broken source all the way through and report every error in it
+
+	tree, diagnostics = recovery.parse_with_recovery(source)
+
+A lexer error skips the rest of its line; lexing starts again at the next newline. A
+statement that fails to parse is skipped up to the end of its line, together with the
+block under it, and parsing goes on with the next statement at the same indentation or
+less. The tree holds the statements that did parse. To keep one mistake from being
+reported over and over, only the first error on each line is recorded.'''
+
+import collections
+
+from tokens import *
+import lexer
+import zypy_parser
+
+Diagnostic = collections.namedtuple('Diagnostic', 'line column kind message')
+
+def scan_with_recovery(source, record):
+	'''scan() source, calling record(error, offset) for each lexer error and going on at the
+	next newline after it'''
+	pos = restart = 0
+	while True:
+		try:
+			for triple in lexer.scan(source, restart):
+				pos = triple[2]
+				yield triple
+			return
+		except lexer.lexer_error as e:
+			record(e, pos)
+			restart = source.find('\n', max(pos, restart + 1))
+			if restart == -1:
+				yield EOFToken, len(source), len(source)
+				return
+
+class recovering_cursor(object):
+	'''Cursor over the tokens of source for the parser. It collects diagnostics instead of
+	raising, which makes the parser recover from its errors too (see try_parse_statement).'''
+	def __init__(self, source):
+		self.source = source
+		self.diagnostics = []
+		# the line number of the last offset recorded, so that each diagnostic only has to
+		# count the newlines since the one before
+		self.line_offset = 0
+		self.line = 1
+		self.triples = scan_with_recovery(source, self.record_at)
+		self.pushed = []
+		self.has_ended = False
+		# the last token next() handed out and where it started
+		self.last = None
+		self.position = 0
+
+	def __iter__(self):
+		return self
+
+	def next_triple(self):
+		if self.pushed:
+			return self.pushed.pop()
+		try:
+			return self.triples.next()
+		except StopIteration:
+			if self.has_ended:
+				raise
+			self.has_ended = True
+			return None, None, None
+
+	def next(self):
+		token, start, end = self.next_triple()
+		self.last = token
+		if start is not None:
+			self.position = start
+		return token
+
+	def peek(self):
+		triple = self.next_triple()
+		self.pushed.append(triple)
+		return triple[0]
+
+	def has_next(self):
+		return bool(self.pushed) or not self.has_ended
+
+	def push_back(self, token):
+		self.pushed.append((token, None, None))
+
+	def record(self, error):
+		'''Record a parse error, at the last token handed out'''
+		self.record_at(error, self.position)
+
+	def record_at(self, error, offset):
+		source = self.source
+		# skip to the start of the token that failed to lex
+		while offset < len(source) and source[offset] in ' \t\r\f\v':
+			offset += 1
+		if offset < self.line_offset:
+			self.line_offset, self.line = 0, 1
+		line = self.line = self.line + source.count('\n', self.line_offset, offset)
+		self.line_offset = offset
+		column = offset - source.rfind('\n', 0, offset)
+		if self.diagnostics and self.diagnostics[-1].line == line:
+			return
+		kind = 'lexer' if isinstance(error, lexer.lexer_error) else 'parser'
+		message = str(error) or error.__class__.__name__
+		self.diagnostics.append(Diagnostic(line, column, kind, message))
+
+def parse_with_recovery(source):
+	'''Parse source, going on after errors. Returns the StatementList of the statements that
+	parsed and a list of Diagnostics, in the order of the source; it is empty when the
+	whole source parsed.'''
+	source = lexer.source_buffer(source)
+	if not isinstance(source, basestring):
+		# an mmap or buffer; the line numbers need str methods
+		source = source[:]
+	it = recovering_cursor(source)
+	tree = zypy_parser.parse_program(it)
+	return tree, it.diagnostics
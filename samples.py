@@ -0,0 +1,33 @@
+'''Source shared by the tests. It uses most of what the lexer and parser handle, including
+the parts that tend to go wrong: a string that spans lines and has a line that isn't indented,
+nested and one-line defs, a for with an else at the top level, big and imaginary numbers
+and bytes that aren't ASCII.'''
+
+SOURCE = '''import os.path as p
+from . import b as c
+
+def foo(x, y=3, *args, **kwargs):
+	for a in b(x, key='caf\xc3\xa9'):
+		return a.d + e[1:2] - 3e2 * 4j # comment
+	else:
+		pass
+	def inner(z):
+		while z:
+			break
+	while (g for h in i if not j):
+		import os.path as p
+		break
+
+class C(object, 42, 1e3, 2j, 12345678901234567890):
+	def method(self):
+		return """docstring
+with a line that isn't indented""" + 1.5e10 ** -3
+		pass
+	def other(self): pass
+
+for x in y:
+	pass
+else:
+	pass
+def bar(): pass
+'''
@@ -0,0 +1,362 @@
+'''Compact binary encoding of parse trees.
+
+A file starts with MAGIC and the format version, followed by a string table, a table of the
+node classes used (by name, with their fields) and then the encoded tree. Every value starts
+with a one-byte tag; integers and lengths are varints and strings are indices into the
+string table. A node is its index in the class table, a bitmap of the fields that are set
+and then those fields in order.
+
+The bodies of defs and classes are stored with their length in front, so a reader can skip
+them. With loads(data, lazy=True) each body is decoded the first time its statements are
+accessed, and a tool that only looks at a few functions in a module only pays for those.'''
+
+import struct
+
+from tokens import *
+import lexer
+import tokens
+
+MAGIC = 'ZYAST'
+FORMAT_VERSION = 1
+
+NONE_TAG = 0
+FALSE_TAG = 1
+TRUE_TAG = 2
+INT_TAG = 3
+FLOAT_TAG = 4
+STR_TAG = 5
+UNICODE_TAG = 6
+LIST_TAG = 7
+TUPLE_TAG = 8
+DICT_TAG = 9
+NODE_TAG = 10
+SINGLETON_TAG = 11
+KEYWORD_TAG = 12
+OPERATOR_TAG = 13
+LAZY_TAG = 14
+
+# fields stored so that they can be decoded on demand
+lazy_fields = {
+	DefStatement: 'statements',
+	ClassStatement: 'statements',
+}
+
+# classes whose nodes are rebuilt through their shared-instance constructor
+flyweights = (BarewordToken, IntegerToken, IndentationToken)
+
+float_struct = struct.Struct('<d')
+
+class format_error(Exception):
+	pass
+
+def write_varint(out, n):
+	while n > 0x7f:
+		out.append((n & 0x7f) | 0x80)
+		n >>= 7
+	out.append(n)
+
+def zigzag(n):
+	return n * 2 if n >= 0 else -n * 2 - 1
+
+def unzigzag(n):
+	return n // 2 if not n & 1 else -(n + 1) // 2
+
+def singleton_name(value):
+	'''Name of value if it is an instance made by @singleton, else None'''
+	name = value.__class__.__name__
+	if getattr(tokens, name, None) is value:
+		return name
+	return None
+
+class lazy_value(object):
+	'''A field value to write with its length in front'''
+	__slots__ = ('value',)
+
+	def __init__(self, value):
+		self.value = value
+
+class Writer(object):
+	def __init__(self):
+		self.strings = []
+		self.string_indices = {}
+		self.classes = []
+		self.class_indices = {}
+
+	def string(self, s):
+		try:
+			return self.string_indices[s]
+		except KeyError:
+			index = self.string_indices[s] = len(self.strings)
+			self.strings.append(s)
+			return index
+
+	def node_class(self, cls):
+		try:
+			return self.class_indices[cls]
+		except KeyError:
+			index = self.class_indices[cls] = len(self.classes)
+			self.classes.append(cls)
+			return index
+
+	def value(self, out, value):
+		'''Append the encoding of value to out. The values inside it are written from an
+		explicit stack, so a long chain of operations doesn't run out of recursion; only
+		the bodies of nested defs and classes recurse, once per level of nesting.'''
+		stack = [value]
+		while stack:
+			value = stack.pop()
+			if value is None:
+				out.append(NONE_TAG)
+			elif value is True:
+				out.append(TRUE_TAG)
+			elif value is False:
+				out.append(FALSE_TAG)
+			elif isinstance(value, (int, long)):
+				out.append(INT_TAG)
+				write_varint(out, zigzag(value))
+			elif isinstance(value, float):
+				out.append(FLOAT_TAG)
+				out.extend(float_struct.pack(value))
+			elif isinstance(value, str):
+				out.append(STR_TAG)
+				write_varint(out, self.string(value))
+			elif isinstance(value, unicode):
+				out.append(UNICODE_TAG)
+				write_varint(out, self.string(value.encode('utf-8')))
+			elif isinstance(value, (list, tuple)):
+				out.append(LIST_TAG if isinstance(value, list) else TUPLE_TAG)
+				write_varint(out, len(value))
+				stack.extend(reversed(value))
+			elif isinstance(value, dict):
+				out.append(DICT_TAG)
+				write_varint(out, len(value))
+				for key, item in reversed(sorted(value.items())):
+					stack.append(item)
+					stack.append(key)
+			elif isinstance(value, Keyword):
+				out.append(KEYWORD_TAG)
+				write_varint(out, self.string(value.value))
+			elif isinstance(value, Operator):
+				out.append(OPERATOR_TAG)
+				write_varint(out, self.string(value.value))
+			elif isinstance(value, SpanToken):
+				stack.append(value.kind(value.value))
+			elif isinstance(value, lazy_value):
+				body = bytearray()
+				self.value(body, value.value)
+				out.append(LAZY_TAG)
+				write_varint(out, len(body))
+				out.extend(body)
+			elif isinstance(value, Node):
+				name = singleton_name(value)
+				if name is not None:
+					out.append(SINGLETON_TAG)
+					write_varint(out, self.string(name))
+				else:
+					self.node(out, value, stack)
+			else:
+				raise format_error("Can't serialize %r" % (value,))
+
+	def node(self, out, node, stack):
+		'''Write the start of node to out and push its fields onto stack, first field last'''
+		cls = node.__class__
+		out.append(NODE_TAG)
+		write_varint(out, self.node_class(cls))
+		present = 0
+		values = []
+		for i, field in enumerate(cls._fields):
+			value = getattr(node, field, missing)
+			if value is not missing:
+				present |= 1 << i
+				values.append((field, value))
+		write_varint(out, present)
+		lazy_field = lazy_fields.get(cls)
+		for field, value in reversed(values):
+			stack.append(lazy_value(value) if field == lazy_field else value)
+
+	def header(self):
+		out = bytearray(MAGIC)
+		write_varint(out, FORMAT_VERSION)
+		# the class table refers to the string table, so fill it in first
+		class_table = bytearray()
+		write_varint(class_table, len(self.classes))
+		for cls in self.classes:
+			write_varint(class_table, self.string(cls.__name__))
+			write_varint(class_table, len(cls._fields))
+			for field in cls._fields:
+				write_varint(class_table, self.string(field))
+		write_varint(out, len(self.strings))
+		for s in self.strings:
+			write_varint(out, len(s))
+			out.extend(s)
+		out.extend(class_table)
+		return out
+
+def dumps(tree):
+	'''Encode tree (usually the StatementList from zypy_parser.parse) as a string'''
+	writer = Writer()
+	body = bytearray()
+	writer.value(body, tree)
+	return str(writer.header() + body)
+
+def dump(tree, path):
+	with open(path, 'wb') as f:
+		f.write(dumps(tree))
+
+class Reader(object):
+	def __init__(self, data, lazy=True):
+		self.data = data
+		self.lazy = lazy
+		if data[:len(MAGIC)] != MAGIC:
+			raise format_error("Not a serialized tree")
+		version, pos = self.varint(len(MAGIC))
+		if version != FORMAT_VERSION:
+			raise format_error("Unsupported format version %d" % version)
+
+		count, pos = self.varint(pos)
+		self.strings = []
+		for i in xrange(count):
+			length, pos = self.varint(pos)
+			self.strings.append(data[pos:pos + length])
+			pos += length
+
+		count, pos = self.varint(pos)
+		self.classes = []
+		for i in xrange(count):
+			name, pos = self.varint(pos)
+			cls = getattr(tokens, self.strings[name], None)
+			if not (isinstance(cls, type) and issubclass(cls, Node)):
+				raise format_error("Unknown node class %s" % self.strings[name])
+			nfields, pos = self.varint(pos)
+			fields = []
+			for j in xrange(nfields):
+				field, pos = self.varint(pos)
+				fields.append(self.strings[field])
+			if tuple(fields) != cls._fields:
+				raise format_error("Fields of %s have changed" % cls.__name__)
+			self.classes.append(cls)
+		self.start = pos
+
+	def varint(self, pos):
+		data = self.data
+		result = 0
+		shift = 0
+		while True:
+			byte = ord(data[pos])
+			pos += 1
+			result |= (byte & 0x7f) << shift
+			if byte < 0x80:
+				return result, pos
+			shift += 7
+
+	def value(self, pos):
+		'''Decode the value at pos; returns it and the position after it. The values inside
+		lists, tuples, dicts and nodes are decoded from an explicit stack, so deep trees
+		don't run out of recursion.'''
+		data = self.data
+		# [tag, items decoded so far, number of items, (node class, fields, bitmap)] for each
+		# value whose items are still being decoded
+		frames = []
+		while True:
+			tag = ord(data[pos])
+			pos += 1
+			if tag == NODE_TAG:
+				index, pos = self.varint(pos)
+				cls = self.classes[index]
+				present, pos = self.varint(pos)
+				fields = [field for i, field in enumerate(cls._fields) if present & (1 << i)]
+				if fields:
+					frames.append([tag, [], len(fields), (cls, fields, present)])
+					continue
+				value = cls.__new__(cls)
+			elif tag == STR_TAG:
+				index, pos = self.varint(pos)
+				value = self.strings[index]
+			elif tag == LIST_TAG or tag == TUPLE_TAG:
+				length, pos = self.varint(pos)
+				if length:
+					frames.append([tag, [], length, None])
+					continue
+				value = [] if tag == LIST_TAG else ()
+			elif tag == INT_TAG:
+				n, pos = self.varint(pos)
+				value = unzigzag(n)
+			elif tag == NONE_TAG:
+				value = None
+			elif tag == SINGLETON_TAG:
+				index, pos = self.varint(pos)
+				value = getattr(tokens, self.strings[index])
+			elif tag == KEYWORD_TAG:
+				index, pos = self.varint(pos)
+				value = lookup_keyword(self.strings[index])
+			elif tag == OPERATOR_TAG:
+				index, pos = self.varint(pos)
+				value = lookup_operator(self.strings[index])
+			elif tag == LAZY_TAG:
+				length, pos = self.varint(pos)
+				if not self.lazy:
+					# the value itself follows
+					continue
+				value = LazyBody(self.thunk(pos))
+				pos += length
+			elif tag == DICT_TAG:
+				length, pos = self.varint(pos)
+				if length:
+					frames.append([tag, [], 2 * length, None])
+					continue
+				value = {}
+			elif tag == FLOAT_TAG:
+				value = float_struct.unpack(data[pos:pos + 8])[0]
+				pos += 8
+			elif tag == UNICODE_TAG:
+				index, pos = self.varint(pos)
+				value = self.strings[index].decode('utf-8')
+			elif tag == TRUE_TAG:
+				value = True
+			elif tag == FALSE_TAG:
+				value = False
+			else:
+				raise format_error("Unknown tag %d at offset %d" % (tag, pos - 1))
+
+			# value is complete; add it to the values waiting for it, and finish those
+			# that it completes
+			while frames:
+				frame = frames[-1]
+				items = frame[1]
+				items.append(value)
+				if len(items) < frame[2]:
+					break
+				frames.pop()
+				tag = frame[0]
+				if tag == NODE_TAG:
+					value = self.node(items, *frame[3])
+				elif tag == LIST_TAG:
+					value = items
+				elif tag == TUPLE_TAG:
+					value = tuple(items)
+				else:
+					value = dict(zip(items[::2], items[1::2]))
+			else:
+				return value, pos
+
+	def node(self, values, cls, fields, present):
+		if cls in flyweights and present == 1:
+			return cls.of(values[0])
+		node = cls.__new__(cls)
+		for field, value in zip(fields, values):
+			setattr(node, field, value)
+		return node
+
+	def thunk(self, pos):
+		return lambda: self.value(pos)[0]
+
+def loads(data, lazy=True):
+	'''Decode a tree written by dumps. With lazy, def and class bodies are decoded on first use.'''
+	reader = Reader(data, lazy=lazy)
+	value, pos = reader.value(reader.start)
+	return value
+
+def load(path, lazy=True):
+	'''Decode the tree in the file at path. The file is mapped into memory, so bodies that
+	are never accessed are never read.'''
+	return loads(lexer.open_source(path), lazy=lazy)
@@ -1,18 +1,110 @@
+import os
 import sys
+import time
 
+import batch
+import daemon
+import dumper
+import hash_consing
 import lexer
+import profiler
+import recovery
 import zypy_parser
 
-if __name__ == '__main__':
+def benchmark_lexer(source):
+	'''Time each lexer engine on source and check that they produce the same tokens'''
+	results = {}
+	for engine in sorted(lexer.ENGINES):
+		start = time.time()
+		tokens = list(lexer.tokenize(source, engine=engine))
+		results[engine] = tokens, time.time() - start
+
+	baseline_tokens, baseline_time = results['loop']
+	for engine, (tokens, elapsed) in sorted(results.items()):
+		assert tokens == baseline_tokens, "%s engine disagrees with loop engine" % engine
+		print "%-6s %8d tokens  %8.3fs  %10.0f tokens/s  %5.2fx" % (engine, len(tokens), elapsed,
+			len(tokens) / max(elapsed, 1e-9), baseline_time / max(elapsed, 1e-9))
+
+def main():
+	# --format text|json for the commands that print trees
+	format = 'text'
+	if '--format' in sys.argv:
+		i = sys.argv.index('--format')
+		format = sys.argv[i + 1]
+		del sys.argv[i:i + 2]
 	cmd = sys.argv[1]
 	input = ' '.join(sys.argv[2:])
 	if cmd == 'lex':
 		lexer.print_tokens(input)
 	elif cmd == 'parse':
-		print zypy_parser.parse(input)
+		dumper.dump(zypy_parser.parse(input), sys.stdout, format)
 	elif cmd == 'parsefile':
-		file = open(sys.argv[2]).read()
-		print zypy_parser.parse(file)
+		file = lexer.open_source(sys.argv[2])
+		dumper.dump(zypy_parser.parse(file), sys.stdout, format)
+	elif cmd == 'parsestream':
+		# parsestream [FILE]; prints each top-level statement as soon as it is parsed
+		file = open(sys.argv[2], 'rb') if len(sys.argv) > 2 else sys.stdin
+		for statement in zypy_parser.iter_parse(file):
+			dumper.dump(statement, sys.stdout, format)
+	elif cmd == 'check':
+		# check FILE; reports every error in the file instead of stopping at the first
+		tree, diagnostics = recovery.parse_with_recovery(lexer.open_source(sys.argv[2]))
+		for diagnostic in diagnostics:
+			print "%s:%d:%d: %s error: %s" % ((sys.argv[2],) + diagnostic)
+		if diagnostics:
+			sys.exit(1)
+	elif cmd == 'sharefile':
+		# parse with equal subtrees shared, and report how much memory that saved
+		table = hash_consing.HashConser()
+		hash_consing.parse(lexer.open_source(sys.argv[2]), table)
+		print table.report()
 	elif cmd == 'lexfile':
-		file = open(sys.argv[2]).read()
+		file = lexer.open_source(sys.argv[2])
 		print lexer.print_tokens(file)
+	elif cmd == 'lexstream':
+		# lexstream [FILE]; reads standard input without a file, e.g. from a pipe
+		file = open(sys.argv[2], 'rb') if len(sys.argv) > 2 else sys.stdin
+		for tkn in lexer.tokenize_stream(file):
+			print tkn, repr(tkn)
+	elif cmd == 'benchlex':
+		file = lexer.open_source(sys.argv[2])
+		benchmark_lexer(file)
+	elif cmd == 'serve':
+		# serve SOCKET; parse server for the remote command, until remote SOCKET shutdown
+		daemon.serve(sys.argv[2])
+	elif cmd == 'remote':
+		# remote SOCKET parsefile|check FILE, or remote SOCKET stats|shutdown
+		with daemon.Client(sys.argv[2]) as client:
+			command = sys.argv[3]
+			if command == 'parsefile':
+				sys.stdout.write(client.request('parse', path=os.path.abspath(sys.argv[4]), format=format)['output'].encode('latin-1'))
+			elif command == 'check':
+				diagnostics = client.request('check', path=os.path.abspath(sys.argv[4]))['diagnostics']
+				for diagnostic in diagnostics:
+					print "%s:%d:%d: %s error: %s" % tuple([sys.argv[4]] + diagnostic)
+				if diagnostics:
+					sys.exit(1)
+			else:
+				print client.request(command)
+	elif cmd == 'parsedir':
+		# parsedir DIRECTORY [WORKERS [CACHE_DIRECTORY]]
+		workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+		cache_dir = sys.argv[4] if len(sys.argv) > 4 else None
+		start = time.time()
+		results = batch.parse_files(batch.find_files(sys.argv[2]), workers=workers, cache_dir=cache_dir)
+		failed = [result for result in results if result.error is not None]
+		for result in failed:
+			print "%s: %s: %s" % (result.path, result.error.__class__.__name__, result.error)
+		print "%d files, %d failed, %.2fs" % (len(results), len(failed), time.time() - start)
+
+if __name__ == '__main__':
+	# --profile anywhere on the command line prints the time spent per grammar rule
+	if '--profile' in sys.argv:
+		sys.argv.remove('--profile')
+		with profiler.Profiler() as prof:
+			try:
+				main()
+			finally:
+				print >>sys.stderr, prof.report()
+	else:
+		main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+
+from tokens import *
+import batch
+import lexer
+import zypy_parser
+
+SOURCES = [
+	('a.py', 'import a\n'),
+	('b.py', 'def foo(x):\n\tfor y in x:\n\t\tbreak\n' * 20),
+	('c.py', "import a\n'\n"),
+	('d.py', 'class foo(object):\n\tpass\n'),
+	('e.py', 'def (x):\n\tpass\n'),
+]
+
+def make_tree():
+	directory = tempfile.mkdtemp()
+	for name, source in SOURCES:
+		with open(os.path.join(directory, name), 'w') as f:
+			f.write(source)
+	return directory
+
+def test_parse_files():
+	directory = make_tree()
+	try:
+		paths = batch.find_files(directory)
+		assert [os.path.basename(path) for path in paths] == [name for name, _ in SOURCES]
+		for workers in (1, 2):
+			results = batch.parse_files(paths, workers=workers)
+			assert [result.path for result in results] == paths
+			assert results[0].tree == zypy_parser.parse(SOURCES[0][1])
+			assert results[1].tree == zypy_parser.parse(SOURCES[1][1])
+			assert results[3].tree.value[0].statements == [PassStatement]
+			assert isinstance(results[2].error, lexer.lexer_error) and results[2].tree is None
+			assert isinstance(results[4].error, zypy_parser.parse_error)
+	finally:
+		shutil.rmtree(directory)
+
+def test_balance():
+	directory = make_tree()
+	try:
+		paths = batch.find_files(directory)
+		chunks = batch.balance(paths, 2)
+		assert sorted(index for chunk in chunks for index, path in chunk) == range(len(paths))
+		# the big file gets a chunk of its own
+		assert chunks[0] == [(1, paths[1])]
+	finally:
+		shutil.rmtree(directory)
+
+def test_parse_files_cached():
+	directory = make_tree()
+	cache_dir = tempfile.mkdtemp()
+	try:
+		paths = batch.find_files(directory)
+		first = batch.parse_files(paths, workers=2, cache_dir=cache_dir)
+		second = batch.parse_files(paths, workers=1, cache_dir=cache_dir)
+		assert [result.tree for result in first] == [result.tree for result in second]
+		assert batch.caches[cache_dir].hits == 3
+		assert isinstance(second[2].error, lexer.lexer_error)
+	finally:
+		shutil.rmtree(directory)
+		shutil.rmtree(cache_dir)
+		batch.caches.pop(cache_dir, None)
+
+def test_results_sent_back():
+	# a tree too deep to pickle, and an error that can't be pickled, come back from the
+	# workers without taking the other files' results with them
+	deep = 'def f(x):\n\treturn ' + ' + '.join(['x'] * 1000) + '\n'
+	directory = tempfile.mkdtemp()
+	try:
+		for name, source in (('a.py', 'import a\n'), ('deep.py', deep)):
+			with open(os.path.join(directory, name), 'w') as f:
+				f.write(source)
+		paths = batch.find_files(directory)
+		results = batch.parse_files(paths, workers=2)
+		assert results[0].tree == zypy_parser.parse('import a\n')
+		assert results[1].error is None and results[1].tree == zypy_parser.parse(deep)
+
+		class local_error(Exception):
+			pass
+		def fail(source):
+			raise local_error('no')
+		parse = zypy_parser.parse
+		# the workers are forked after this, so they see it too
+		zypy_parser.parse = fail
+		try:
+			results = batch.parse_files(paths, workers=2)
+		finally:
+			zypy_parser.parse = parse
+		assert [result.path for result in results] == paths
+		for result in results:
+			assert isinstance(result.error, batch.result_error) and 'local_error' in str(result.error)
+	finally:
+		shutil.rmtree(directory)
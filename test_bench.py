@@ -0,0 +1,24 @@
+from bench import compare, corpus, run
+import zypy_parser
+
+def test_corpus():
+	source = corpus.generate(20, seed=1)
+	assert source == corpus.generate(20, seed=1)
+	assert source != corpus.generate(20, seed=2)
+	tree = zypy_parser.parse(source)
+	assert len(tree.value) == 20
+	assert zypy_parser.parse(source, engine='regex') == tree
+
+def test_run():
+	results = run.run(size=5, repeat=1)
+	assert results['corpus']['size'] == 5
+	tokenize, parse = results['phases']['tokenize'], results['phases']['parse']
+	assert tokenize['tokens'] > 0 and tokenize['peak_memory_kb'] > 0
+	assert parse['statements'] == run.count_statements(zypy_parser.parse(corpus.generate(5)))
+
+def test_compare():
+	before = {'phases': {'parse': {'seconds': 1.0, 'statements_per_second': 100.0}}}
+	after = {'phases': {'parse': {'seconds': 1.2, 'statements_per_second': 99.0}}}
+	rows = compare.compare(before, after, threshold=5.0)
+	assert [(metric, regressed) for phase, metric, old, new, change, regressed in rows] == [
+		('seconds', True), ('statements_per_second', False)]
@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+import StringIO
+import tempfile
+
+from samples import SOURCE
+from tokens import *
+import cooperative
+import lexer
+import zypy_parser
+
+def test_feed_parser():
+	expected = zypy_parser.parse(SOURCE).value
+	for chunk_size in (1, 2, 7, 100, len(SOURCE)):
+		parser = cooperative.FeedParser()
+		statements = []
+		for i in range(0, len(SOURCE), chunk_size):
+			statements.extend(parser.feed(SOURCE[i:i + chunk_size]))
+		# everything but the last statement is complete before the end
+		assert len(statements) == len(expected) - 1, chunk_size
+		statements.extend(parser.close())
+		assert statements == expected, chunk_size
+
+	parser = cooperative.FeedParser()
+	# the name after the last newline might go on, so b isn't known to be complete yet
+	assert parser.feed("import a\nimport b\nimp") == [ImportsList([ImportStatement('a')])]
+	assert parser.feed("ort c") == [ImportsList([ImportStatement('b')])]
+	assert parser.close() == [ImportsList([ImportStatement('c')])]
+	assert cooperative.FeedParser().close() == []
+
+	# a lexer error at the end is raised, not taken for the end of the source
+	parser = cooperative.FeedParser()
+	assert parser.feed("import a\nx = (b, c) $") == [ImportsList([ImportStatement("a")])]
+	try:
+		parser.close()
+	except lexer.lexer_error:
+		pass
+	else:
+		assert False, "$ should not lex"
+
+def test_steps():
+	source = SOURCE * 20
+	steps = list(cooperative.tokenize_steps(StringIO.StringIO(source), tokens_per_step=50, chunk_size=100))
+	assert all(len(step) <= 50 for step in steps)
+	assert sum(steps, []) == list(lexer.tokenize(source))
+
+	steps = cooperative.tokenize_steps(StringIO.StringIO("import a\n" * 100 + "e**$"), chunk_size=10)
+	try:
+		list(steps)
+	except lexer.lexer_error:
+		pass
+	else:
+		assert False, "$ should not lex"
+
+	steps = list(cooperative.parse_steps(StringIO.StringIO(source), statements_per_step=3, chunk_size=100))
+	assert all(len(step) <= 3 for step in steps)
+	# one step per chunk read, plus the ones for the statements
+	assert len(steps) >= len(source) // 100
+	assert sum(steps, []) == zypy_parser.parse(source).value
+
+def test_offload():
+	fd, path = tempfile.mkstemp(suffix='.py')
+	with os.fdopen(fd, 'w') as f:
+		f.write(SOURCE)
+	pool = multiprocessing.Pool(1)
+	try:
+		result = cooperative.offload(pool, path).get(10)
+		assert result.error is None and result.tree == zypy_parser.parse(SOURCE)
+
+		# a tree too deep to pickle comes back too, also through the callback
+		deep = 'def f(x):\n\treturn ' + ' + '.join(['x'] * 1000) + '\n'
+		with open(path, 'w') as f:
+			f.write(deep)
+		received = []
+		offloaded = cooperative.offload(pool, path, callback=received.append)
+		result = offloaded.get(10)
+		assert result.error is None and result.tree == zypy_parser.parse(deep)
+		assert offloaded.ready() and received[0].tree == result.tree
+	finally:
+		pool.close()
+		pool.join()
+		os.unlink(path)
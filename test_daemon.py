@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from samples import SOURCE
+import daemon
+import dumper
+import zypy_parser
+
+def start_server(directory, max_files=1000):
+	path = os.path.join(directory, 'zypy.sock')
+	server = daemon.ParseServer(path, max_files)
+	thread = threading.Thread(target=server.serve)
+	thread.daemon = True
+	thread.start()
+	return server, thread, path
+
+def test_requests():
+	directory = tempfile.mkdtemp()
+	try:
+		server, thread, path = start_server(directory)
+		source_path = os.path.join(directory, 'a.py')
+		with open(source_path, 'w') as f:
+			f.write(SOURCE)
+		with daemon.Client(path) as client:
+			output = client.request('parse', path=source_path)['output']
+			assert output.encode('latin-1') == dumper.dumps(zypy_parser.parse(SOURCE)) + '\n'
+			json_output = client.request('parse', path=source_path, format='json')['output']
+			assert json_output.count('\n') == len(zypy_parser.parse(SOURCE).value)
+			assert client.request('check', path=source_path) == {'diagnostics': []}
+			assert client.request('stats') == {'files': 1, 'parses': 1, 'hits': 2, 'requests': 4}
+
+			# touched without a change: not parsed again
+			os.utime(source_path, (time.time() + 10, time.time() + 10))
+			assert client.request('parse', path=source_path)['output'] == output
+			assert client.request('stats')['parses'] == 1
+			with open(source_path, 'w') as f:
+				f.write('import b\nfor\n')
+			os.utime(source_path, (time.time() + 20, time.time() + 20))
+			try:
+				client.request('parse', path=source_path)
+			except daemon.protocol_error as e:
+				assert 'parse_error' in str(e)
+			else:
+				assert False, 'expected an error'
+			assert client.request('check', path=source_path)['diagnostics'][0][:3] == [2, 4, 'parser']
+			assert client.request('stats')['parses'] == 2
+
+			for request in [{'command': 'parse', 'path': os.path.join(directory, 'missing.py')},
+					{'command': 'parse'}, {'command': 'frobnicate'}]:
+				try:
+					client.request(**request)
+				except daemon.protocol_error:
+					pass
+				else:
+					assert False, 'expected an error for %r' % request
+		# a second connection sees the same caches
+		with daemon.Client(path) as client:
+			# the missing file isn't kept
+			assert client.request('stats')['files'] == 1
+			client.request('shutdown')
+		thread.join()
+		assert not os.path.exists(path)
+	finally:
+		shutil.rmtree(directory)
+
+def test_bad_requests():
+	directory = tempfile.mkdtemp()
+	try:
+		server, thread, path = start_server(directory, max_files=2)
+		paths = []
+		for name in ('a.py', 'b.py'):
+			paths.append(os.path.join(directory, name))
+			with open(paths[-1], 'w') as f:
+				f.write('import %s\n' % name[0])
+		with daemon.Client(path) as client:
+			for source_path in paths:
+				client.request('parse', path=source_path)
+			# missing files don't push the cached trees out
+			for i in range(3):
+				try:
+					client.request('parse', path=os.path.join(directory, 'missing%d.py' % i))
+				except daemon.protocol_error:
+					pass
+				else:
+					assert False, 'expected an error'
+			for source_path in paths:
+				client.request('parse', path=source_path)
+			assert client.request('stats')['parses'] == 2
+
+			# requests that aren't objects get an error, and the connection stays usable
+			for request in ([1, 2], 'parse', None):
+				daemon.send_message(client.sock, request)
+				assert 'error' in daemon.recv_message(client.sock)
+			client.sock.sendall(daemon.HEADER.pack(3) + '{{{')
+			assert 'error' in daemon.recv_message(client.sock)
+			assert client.request('stats')['files'] == 2
+			client.request('shutdown')
+		thread.join()
+	finally:
+		shutil.rmtree(directory)
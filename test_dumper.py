@@ -0,0 +1,53 @@
+import json
+import StringIO
+
+from samples import SOURCE
+from tokens import *
+import dumper
+import zypy_parser
+
+def test_text():
+	tree = zypy_parser.parse(SOURCE)
+	out = StringIO.StringIO()
+	dumper.dump(tree, out)
+	assert out.getvalue() == str(tree) + '\n'
+	assert str(tree).startswith("StatementList(value=[ImportsList(value=[ImportStatement(module_name=os.path, from_list=[], level=-1, as_name=p)]), ")
+	assert "kwargs=[('key', StringToken(value=caf\xc3\xa9))]" in str(tree)
+	assert dumper.dumps(Call(Variable('f'), [], [], (Variable('x'),))) == "Call(function=Variable(value=f), args=[], kwargs=[], starargs=(Variable(value=x),), starkwargs=None)"
+	assert dumper.dumps({'a': ['b']}) == "{'a': ['b']}"
+
+def test_json():
+	tree = zypy_parser.parse(SOURCE)
+	out = StringIO.StringIO()
+	dumper.dump(tree, out, 'json')
+	lines = out.getvalue().splitlines()
+	assert len(lines) == len(tree.value)
+	imports = json.loads(lines[0])
+	assert imports == {'_type': 'ImportsList', 'value': [{'_type': 'ImportStatement', 'module_name': 'os.path',
+		'from_list': [], 'level': -1, 'as_name': 'p'}]}
+	foo = json.loads(lines[2])
+	assert foo['_type'] == 'DefStatement' and foo['kwargs'] == {'y': {'_type': 'IntegerToken', 'value': 3}}
+	assert foo['starargs'] == 'args'
+	ret = foo['statements'][0]['statements'][0]['value']
+	assert ret['operator'] == {'_type': 'Operator', 'value': '-'}
+	assert ret['right']['right'] == {'_type': 'ImaginaryToken', 'a': 0, 'b': 4}
+	# string literals are bytes, whatever their encoding
+	key, value = foo['statements'][0]['collection']['kwargs'][0]
+	assert key == 'key' and value['value'].encode('latin-1') == 'caf\xc3\xa9'
+	out = StringIO.StringIO()
+	dumper.dump(zypy_parser.parse('def f():\n\treturn "caf\xe9"\n'), out, 'json')
+	f = json.loads(out.getvalue())
+	assert f['statements'][0]['value']['value'].encode('latin-1') == 'caf\xe9'
+	out = StringIO.StringIO()
+	dumper.dump({'\xff': '\xe9'}, out, 'json')
+	assert json.loads(out.getvalue()) == {u'\xff': u'\xe9'}
+
+def test_deep_tree():
+	tree = Variable('x')
+	for i in range(20000):
+		tree = UnaryOperation(MinusOperator, tree)
+	text = dumper.dumps(tree)
+	assert text.startswith('UnaryOperation(operator=-, operand=UnaryOperation(') and text.endswith(')' * 20000)
+	out = StringIO.StringIO()
+	dumper.dump(tree, out, 'json')
+	assert out.getvalue().count('"UnaryOperation"') == 20000
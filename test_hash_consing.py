@@ -0,0 +1,42 @@
+from tokens import *
+import hash_consing
+import zypy_parser
+
+SOURCE = '''import os.path as p
+def foo(x):
+	return bar(x, 'abc') + 42
+def baz(x):
+	return bar(x, 'abc') + 42
+	return bar(x, 'abc') + 43
+import os.path as p
+'''
+
+def test_share():
+	table = hash_consing.HashConser()
+	tree = hash_consing.parse(SOURCE, table)
+	assert tree == zypy_parser.parse(SOURCE)
+	foo, baz = tree.value[1], tree.value[2]
+	# equal subtrees are one object, blocks are not
+	assert foo.statements[0] is baz.statements[0]
+	assert foo.statements[0].value.left is baz.statements[1].value.left
+	assert foo is not baz and foo.statements is not baz.statements
+	assert tree.value[0] is tree.value[3]
+	assert table.shared > 0 and table.bytes_saved > 0
+	assert '%d shared' % table.shared in table.report()
+
+	# a second tree shares with the first
+	again = hash_consing.parse("def foo(x):\n\treturn bar(x, 'abc') + 42\n", table)
+	assert again.value[0].statements[0] is foo.statements[0]
+
+def test_deep_tree():
+	source = 'def f():\n\treturn ' + ' + '.join(['a'] * 5000) + '\n'
+	tree = hash_consing.parse(source)
+	assert tree == zypy_parser.parse(source)
+	left = tree.value[0].statements[0].value.left
+	assert left.right is left.left.right
+
+def test_lazy_bodies_stay_lazy():
+	tree = zypy_parser.parse(SOURCE, lazy=True)
+	hash_consing.HashConser().share(tree)
+	assert not is_loaded(tree.value[1])
+	assert tree == zypy_parser.parse(SOURCE)
@@ -0,0 +1,168 @@
+import random
+
+from samples import SOURCE
+from tokens import *
+import incremental
+import lexer
+import zypy_parser
+
+def assert_relexes(source, offset, removed_length, inserted_text):
+	tokens = incremental.lex_positions(source)
+	new_source, new_tokens, first, old_stop, new_stop = incremental.relex(source, tokens, offset, removed_length, inserted_text)
+	assert new_source == source[:offset] + inserted_text + source[offset + removed_length:]
+	expected = list(lexer.scan(new_source))
+	assert list(new_tokens) == expected, "%s != %s" % (list(new_tokens), expected)
+	# the old tokens are left alone
+	assert list(tokens) == list(lexer.scan(source))
+	assert tokens[:first] == new_tokens[:first]
+	assert len(tokens) - old_stop == len(new_tokens) - new_stop
+	return first, old_stop, new_stop
+
+def test_edit_within_line():
+	offset = SOURCE.index('y=3') + 2
+	first, old_stop, new_stop = assert_relexes(SOURCE, offset, 1, '42')
+	# only the def line is lexed again
+	line = list(lexer.tokenize('\ndef foo(x, y=42, *args, **kwargs):', engine='regex'))
+	assert old_stop - first == new_stop - first == len(line) - 1
+
+def test_edit_inside_triple_quoted_string():
+	offset = SOURCE.index('with a line')
+	assert_relexes(SOURCE, offset, 0, 'text\n')
+	# closing the string early turns the rest of it into code
+	assert_relexes(SOURCE, offset, 0, '"""\n\tx = """')
+
+def test_edit_opens_string():
+	assert_relexes(SOURCE, SOURCE.index('docstring'), 0, '""" + """')
+
+def test_edit_changes_indentation():
+	offset = SOURCE.index('\n\t\tbreak') + 1
+	assert_relexes(SOURCE, offset, 1, '')
+	assert_relexes(SOURCE, offset, 2, '    ')
+	assert_relexes(SOURCE, SOURCE.index('class'), 0, '\t')
+
+def test_edit_at_ends():
+	assert_relexes(SOURCE, 0, 0, 'import a\n')
+	assert_relexes(SOURCE, len(SOURCE), 0, 'import a')
+	assert_relexes(SOURCE, 0, len(SOURCE), '')
+
+def test_positioned_tokens():
+	triples = list(lexer.scan(SOURCE))
+	run_size = incremental.RUN_SIZE
+	incremental.RUN_SIZE = 4
+	try:
+		tokens = incremental.PositionedTokens.from_triples(triples)
+		assert len(tokens.runs) > 1
+		assert list(tokens) == triples and len(tokens) == len(triples)
+		assert tokens[5] == triples[5] and tokens[-1] == triples[-1]
+		assert tokens[3:11] == triples[3:11]
+		assert tokens.tokens(2, 9) == [token for token, start, end in triples[2:9]]
+		for offset in range(len(SOURCE) + 1):
+			expected = max([i for i, triple in enumerate(triples) if triple[1] < offset] or [-1])
+			assert tokens.find_token(offset) == expected, offset
+		# runs after the replaced tokens are shared, only moved
+		replaced = tokens.replace(5, 7, [(NewlineToken, triples[5][1], triples[5][1] + 1)], 10)
+		assert list(replaced)[:6] == triples[:5] + [(NewlineToken, triples[5][1], triples[5][1] + 1)]
+		assert list(replaced)[6:] == [(token, start + 10, end + 10) for token, start, end in triples[7:]]
+		assert replaced.runs[-1] is tokens.runs[-1]
+	finally:
+		incremental.RUN_SIZE = run_size
+
+def test_random_edits():
+	run_size = incremental.RUN_SIZE
+	try:
+		for incremental.RUN_SIZE in (run_size, 3):
+			random_edits()
+	finally:
+		incremental.RUN_SIZE = run_size
+
+def random_edits():
+	rng = random.Random(42)
+	pieces = ['x', ' ', '\n', '\t', '"""', "'", '(', ')', '1.5', 'def ', '#', ':']
+	for i in range(300):
+		offset = rng.randint(0, len(SOURCE))
+		removed_length = rng.randint(0, min(5, len(SOURCE) - offset))
+		inserted_text = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 3)))
+		new_source = SOURCE[:offset] + inserted_text + SOURCE[offset + removed_length:]
+		try:
+			incremental.lex_positions(new_source)
+		except lexer.lexer_error:
+			continue
+		assert_relexes(SOURCE, offset, removed_length, inserted_text)
+
+def test_incremental_parser():
+	source = '''
+import a
+
+def foo(x):
+	pass
+
+class C(object):
+	pass
+
+for x in y:
+	break
+else:
+	pass
+'''
+	parser = incremental.IncrementalParser(source)
+	assert parser.tree == zypy_parser.parse(source)
+	foo, cls, loop = parser.tree.value[1:]
+
+	offset = source.index('(x)') + 2
+	tree = parser.edit(offset, 0, ', y')
+	assert tree == zypy_parser.parse(parser.source)
+	assert tree.value[1].args == ['x', 'y']
+	assert tree.value[2] is cls and tree.value[3] is loop
+	# everything but the def: the leading blank line, the import, the class and the loop
+	assert parser.reused == 4
+
+	tree = parser.edit(parser.source.index('\tbreak'), 0, '\timport b\n')
+	assert tree == zypy_parser.parse(parser.source)
+	assert len(tree.value[3].statements) == 2
+	assert tree.value[2] is cls
+
+def test_block_reuse():
+	source = '''
+class C(object):
+	def f(x):
+		pass
+	def g(y):
+		def inner(z):
+			return z
+		return y
+	def h():
+		break
+'''
+	parser = incremental.IncrementalParser(source)
+	f, g, h = parser.tree.value[0].statements
+	inner = g.statements[0]
+
+	# the class is parsed again, but of its methods only h
+	tree = parser.edit(parser.source.index('break'), 5, 'pass')
+	assert tree == zypy_parser.parse(parser.source)
+	methods = tree.value[0].statements
+	assert methods[0] is f and methods[1] is g and methods[2] is not h
+	assert parser.reused == 1 and parser.reused_blocks == 2
+
+	# within g, inner is kept
+	tree = parser.edit(parser.source.index('return y') + 7, 1, 'w')
+	assert tree == zypy_parser.parse(parser.source)
+	g2 = tree.value[0].statements[1]
+	assert g2 is not g and g2.statements[0] is inner and tree.value[0].statements[0] is f
+
+	# identical blocks don't end up sharing one node
+	tree = parser.edit(len(parser.source), 0, parser.source[1:])
+	assert tree == zypy_parser.parse(parser.source)
+	assert tree.value[0].statements[0] is not tree.value[1].statements[0]
+
+	# after an edit that doesn't parse, the next one still reuses the blocks
+	offset = parser.source.index('def f')
+	try:
+		parser.edit(offset, 0, 'while ')
+	except zypy_parser.parse_error:
+		pass
+	else:
+		assert False, "while def should not parse"
+	tree = parser.edit(offset, 6, '')
+	assert tree == zypy_parser.parse(parser.source)
+	assert tree.value[1].statements[1].statements[0] is inner
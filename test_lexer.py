@@ -1,8 +1,21 @@
 '''Ridiculously incomplete'''
 
+import StringIO
+import subprocess
+import sys
+import tempfile
+import timeit
+
 from tokens import *
 import lexer
 
+# how many times as long as importing tokens, which only defines the node classes,
+# importing the rest of the parser may take; it is about 3
+IMPORT_OVERHEAD = 8.0
+# how many times the cost of a line in a long source tokenizing a one-line snippet may take;
+# it is about 1.3, and building the lexer's tables on each call would make it over 2
+CALL_OVERHEAD = 2.0
+
 def lex_into_list(str):
 	return [token for token in lexer.tokenize(str)]
 
@@ -19,3 +32,166 @@ def test_lines():
 	assert_lexes("'hello'", [StringToken("hello")])
 
 	assert_lexes("a, _ = [1, 2]", [BarewordToken("a"), CommaOperator, UnderscoreKeyword, AssignmentOperator, OpeningSquareBracketOperator, IntegerToken(1), CommaOperator, IntegerToken(2), ClosingSquareBracketOperator])
+
+def lex_outcome(string, engine):
+	out = []
+	try:
+		for token in lexer.tokenize(string, engine=engine):
+			out.append(token)
+	except lexer.lexer_error as e:
+		out.append(str(e))
+	return out
+
+def test_engines_agree():
+	for str in ["import a", "a, _ = [1, 2]", "a != b", "x = 10 ** -3 >>= 2 //= 4",
+			"x = 'a\\'b' + r'c\\d' + '''tri\nple''' + \"\"\n", "''", "''x", "r''",
+			"1.5e10 3e2 0x1f 4j", "1.5\nfoo", "1.", "1abc", "'abc", "'a\nb'", "!x", "\\",
+			"while True:\n\tbreak\n", "\n  a\n\tb\n \t c", "  x", "# c\nfoo # bar\n", "", "x\r\ny",
+			u"caf\xe9 = 1"]:
+		assert lex_outcome(str, 'loop') == lex_outcome(str, 'regex'), repr(str)
+
+def test_spans():
+	str = "foo = 'bar' + 42 if a_long_name else \"\"\n"
+	spans = list(lexer.tokenize(str, spans=True))
+	assert spans == lex_into_list(str)
+	names = [token for token in spans if isinstance(token, SpanToken)]
+	assert [type(token) for token in names] == [BarewordSpan, StringSpan, IntegerSpan, BarewordSpan]
+	assert [token.text for token in names] == ["foo", "'bar'", "42", "a_long_name"]
+	assert names[1].value == "bar" and names[2].value == 42
+	assert str[names[3].start:names[3].end] == "a_long_name"
+	assert BarewordToken("foo") == names[0]
+
+def test_buffer_sources():
+	str = "def foo(x):\n\treturn 'a' + 42\n"
+	expected = lex_into_list(str)
+	f = tempfile.NamedTemporaryFile(suffix='.py')
+	f.write(str)
+	f.flush()
+	mapped = lexer.open_source(f.name)
+	for source in (mapped, bytearray(str), memoryview(str)):
+		for engine in lexer.ENGINES:
+			assert list(lexer.tokenize(source, engine=engine)) == expected
+	assert list(lexer.tokenize(mapped, spans=True)) == expected
+	f.close()
+
+def test_shared_tokens():
+	for engine in lexer.ENGINES:
+		tokens = list(lexer.tokenize("foo(self, 1, foo)\n\tfoo(1000)\n\tbar", engine=engine))
+		assert tokens[0] is tokens[6] is tokens[10]
+		assert tokens[2] is BarewordToken.of('self')
+		assert tokens[4] is IntegerToken.of(1)
+		assert tokens[9] is tokens[15] is IndentationToken.of(8)
+		assert tokens[12] == IntegerToken(1000)
+
+def test_stream():
+	str = ("def foo(a, b):\n\tx = a ** -b >>= 2 != 3\n\t\treturn '''tri\nple''' + r'raw\\d' + \"\"\n"
+		"\ty = 1.5e10 + 3e-2 + 0x1f + 4j # comment\n        if x <= 'abc':\n\t\t\tpass\n\n1.")
+	expected = lex_outcome(str, 'regex')
+	for chunk_size in range(1, len(str) + 1):
+		streamed = []
+		try:
+			for token in lexer.tokenize_stream(StringIO.StringIO(str), chunk_size):
+				streamed.append(token)
+		except lexer.lexer_error as e:
+			streamed.append(e.args[0])
+		assert streamed == expected, chunk_size
+
+	for bad in ["'abc", "x = '''abc", "1e", "  x", "x\n \ty"]:
+		for chunk_size in (1, 2, 100):
+			tokens = []
+			try:
+				for token in lexer.tokenize_stream(StringIO.StringIO(bad), chunk_size):
+					tokens.append(token)
+			except lexer.lexer_error as e:
+				tokens.append(e.args[0])
+			assert tokens == lex_outcome(bad, 'regex'), (bad, chunk_size)
+
+def test_stream_late_error():
+	# the error comes after tokens that have been handed out already, in a later chunk
+	for bad in ["e**$", "import a\nx = (b, c) $", "x = 'abc' + '" + "y" * 1000]:
+		for chunk_size in (1, 3, 7, 100):
+			tokens = []
+			try:
+				for token in lexer.tokenize_stream(StringIO.StringIO(bad), chunk_size):
+					tokens.append(token)
+			except lexer.lexer_error as e:
+				tokens.append(e.args[0])
+			assert tokens == lex_outcome(bad, 'regex'), (bad, chunk_size)
+
+	tokenizer = lexer.StreamTokenizer()
+	assert tokenizer.feed("x = 1 $") == [BarewordToken("x"), AssignmentOperator, IntegerToken(1)]
+	try:
+		tokenizer.feed("\n")
+	except lexer.lexer_error:
+		pass
+	else:
+		assert False, "the error should be raised by the next call"
+
+def test_stream_memory():
+	line = "x = foo(bar, 'baz') + 42\n"
+	tokenizer = lexer.StreamTokenizer()
+	count = 0
+	for i in range(1000):
+		count += len(tokenizer.feed(line[:10]))
+		count += len(tokenizer.feed(line[10:]))
+		assert len(tokenizer.buffer) <= 2 * len(line)
+	count += len(tokenizer.close())
+	assert count == len(lex_into_list(line * 1000))
+
+	# only the unfinished token is kept, not the rest of its line
+	tokenizer = lexer.StreamTokenizer()
+	count = 0
+	for i in range(1000):
+		count += len(tokenizer.feed("foo(bar, 12) + "))
+		assert len(tokenizer.buffer) < 20
+	count += len(tokenizer.feed("x\n")) + len(tokenizer.close())
+	assert count == 7 * 1000 + 4
+
+	# a long token fed a character at a time is not rescanned for every character
+	tokenizer = lexer.StreamTokenizer()
+	tokens = tokenizer.feed("x = '''")
+	scans = [0]
+	scan = tokenizer.scan
+	def counting_scan(partial):
+		scans[0] += 1
+		return scan(partial)
+	tokenizer.scan = counting_scan
+	for i in range(10000):
+		assert tokenizer.feed("a") == []
+	tokens += tokenizer.feed("'''\n") + tokenizer.close()
+	assert tokens == [BarewordToken("x"), AssignmentOperator, StringToken("a" * 10000), NewlineToken, IndentationToken.of(0), EOFToken]
+	assert scans[0] < 30
+
+def test_tables_built_once():
+	initialize_operators = lexer.initialize_operators
+	def fail():
+		assert False, 'operator tree rebuilt'
+	lexer.initialize_operators = fail
+	try:
+		for engine in lexer.ENGINES:
+			assert list(lexer.tokenize('a += b ** -1', engine=engine)) == [BarewordToken('a'),
+				PlusAssignOperator, BarewordToken('b'), ExponentOperator, MinusOperator,
+				IntegerToken(1), EOFToken]
+	finally:
+		lexer.initialize_operators = initialize_operators
+
+def test_startup_overhead():
+	# both measured in the same fresh interpreter, so a slow or busy machine slows both
+	code = ('import time; start = time.time(); import tokens; middle = time.time(); '
+		'import zypy_parser; print middle - start, time.time() - middle')
+	runs = [map(float, subprocess.check_output([sys.executable, '-c', code]).split()) for i in range(3)]
+	baseline = min(tokens for tokens, rest in runs)
+	elapsed = min(rest for tokens, rest in runs)
+	assert elapsed < IMPORT_OVERHEAD * baseline, 'importing the parser took %.1f ms, tokens %.1f ms' % (
+		elapsed * 1000, baseline * 1000)
+
+def test_call_overhead():
+	# measured against a long source in the same run, so a slow or busy machine slows both
+	line = 'x = y[1] + 2\n'
+	for engine in lexer.ENGINES:
+		one = timeit.Timer(lambda: list(lexer.tokenize(line, engine=engine)))
+		many = timeit.Timer(lambda: list(lexer.tokenize(line * 100, engine=engine)))
+		call = min(one.repeat(5, 200)) / 200
+		per_line = min(many.repeat(5, 2)) / 200
+		assert call < CALL_OVERHEAD * per_line, '%s engine took %.1f us per call, %.1f us per line' % (
+			engine, call * 1e6, per_line * 1e6)
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+from samples import SOURCE
+from tokens import *
+import parse_cache
+import zypy_parser
+
+def test_hit_and_miss():
+	directory = tempfile.mkdtemp()
+	try:
+		cache = parse_cache.ParseCache(directory)
+		assert cache.get(SOURCE) is None
+		tree = cache.parse(SOURCE)
+		assert tree == zypy_parser.parse(SOURCE)
+		assert cache.misses == 2 and cache.hits == 0
+		# a fresh cache on the same directory finds the entry
+		cache = parse_cache.ParseCache(directory)
+		cached = cache.get(SOURCE)
+		assert cached == tree and cache.hits == 1
+		assert cached.value[-1].statements[0] is PassStatement
+		assert cache.get(SOURCE + '\n') is None
+		# nothing but entries is left behind
+		assert os.listdir(directory) == [os.path.basename(cache.path(SOURCE))]
+	finally:
+		shutil.rmtree(directory)
+
+def test_corrupt_entry():
+	directory = tempfile.mkdtemp()
+	try:
+		cache = parse_cache.ParseCache(directory)
+		cache.parse(SOURCE)
+		with open(cache.path(SOURCE), 'wb') as f:
+			f.write('garbage')
+		assert cache.get(SOURCE) is None
+		assert not os.path.exists(cache.path(SOURCE))
+	finally:
+		shutil.rmtree(directory)
+
+def test_eviction():
+	directory = tempfile.mkdtemp()
+	try:
+		cache = parse_cache.ParseCache(directory, max_bytes=1000)
+		sources = ['import a%d\n' % i for i in range(100)]
+		for i, source in enumerate(sources):
+			cache.parse(source)
+			# file times are too coarse to order entries written this quickly
+			if os.path.exists(cache.path(source)):
+				os.utime(cache.path(source), (i, i))
+		assert cache.size <= 1000
+		assert sum(size for path, size, mtime in cache.entries()) == cache.size
+		assert cache.get(sources[-1]) is not None
+		assert cache.get(sources[0]) is None
+	finally:
+		shutil.rmtree(directory)
+
+def test_deep_tree():
+	source = 'def f():\n\treturn ' + ' + '.join(['a'] * 5000) + '\n'
+	directory = tempfile.mkdtemp()
+	try:
+		tree = parse_cache.ParseCache(directory).parse(source)
+		assert tree == zypy_parser.parse(source)
+		assert parse_cache.ParseCache(directory).parse(source) == tree
+	finally:
+		shutil.rmtree(directory)
+
+def test_fingerprint():
+	fingerprint = parse_cache.grammar_fingerprint()
+	assert fingerprint == parse_cache.grammar_fingerprint()
+	class NewStatement(Statement):
+		_fields = ('value',)
+	import tokens
+	tokens.NewStatement = NewStatement
+	try:
+		assert parse_cache.grammar_fingerprint() != fingerprint
+	finally:
+		del tokens.NewStatement
@@ -0,0 +1,44 @@
+import collections
+
+from samples import SOURCE
+from tokens import *
+import lexer
+import profiler
+import visitor
+import zypy_parser
+
+def test_profile():
+	original = zypy_parser.parse_expression
+	prof = profiler.Profiler()
+	with prof:
+		assert zypy_parser.parse_expression is not original
+		tree = zypy_parser.parse(SOURCE)
+	assert zypy_parser.parse_expression is original
+	assert zypy_parser.keyworded_statements[lexer.DefKeyword] is zypy_parser.parse_def_statement
+	assert tree == zypy_parser.parse(SOURCE)
+
+	stats = prof.stats
+	counts = collections.Counter(node.__class__ for node in visitor.walk(tree))
+	assert stats['parse_def_statement'].calls == counts[DefStatement]
+	assert stats['parse_class_statement'].calls == counts[ClassStatement]
+	assert stats['parse_for_statement'].calls == counts[ForStatement]
+	assert stats['consume_string'].calls == 2
+	# 11 numbers, and the exponents of 3e2, 1e3 and 1.5e10, which are scanned by a recursive call
+	assert stats['consume_number'].calls == 14
+	assert prof.tokens == len(list(lexer.tokenize(SOURCE)))
+	assert 'parse_while_statement' in prof.report()
+
+def test_nested_calls():
+	source = 'def f(x):\n\tdef g():\n\t\treturn x + 1 + 2\n\treturn g\n'
+	prof = profiler.Profiler()
+	with prof:
+		zypy_parser.parse(source)
+	defs = prof.stats['parse_def_statement']
+	assert defs.calls == 2
+	# nested calls of a recursive rule aren't counted twice: the def is everything but
+	# the def keyword itself and the end of file
+	assert defs.tokens == prof.tokens - 2
+	statements = prof.stats['parse_colon_and_statement_list']
+	assert statements.calls == 2
+	assert statements.cumulative <= defs.cumulative
+	assert statements.own <= statements.cumulative
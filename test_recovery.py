@@ -0,0 +1,56 @@
+import StringIO
+import sys
+
+from tokens import *
+import recovery
+import zypy_parser
+
+BROKEN = '''import a
+def foo(x):
+	while
+		pass
+	return 1abc
+	return x
+import $
+class C(:
+	pass
+for x in y:
+	return (
+return 'abc
+import b
+'''
+
+def test_recovery():
+	tree, diagnostics = recovery.parse_with_recovery(BROKEN)
+	assert [(d.line, d.kind) for d in diagnostics] == [(3, 'parser'), (5, 'lexer'), (7, 'lexer'), (8, 'parser'), (11, 'parser'), (12, 'lexer')]
+	assert diagnostics[1] == recovery.Diagnostic(5, 9, 'lexer', 'invalid character following numberic literal')
+	assert diagnostics[2].column == 8 and diagnostics[2].message == 'Unexpected character $'
+	# the statements around the errors are still there
+	assert [stmt.__class__ for stmt in tree.value] == [ImportsList, DefStatement, ForStatement, ImportsList]
+	assert tree.value[1].statements == [ReturnStatement(Variable('x'))]
+	assert tree.value[3] == ImportsList([ImportStatement('b')])
+
+def test_no_errors():
+	source = "def foo(x):\n\tfor a in x:\n\t\treturn a\nimport b\n"
+	tree, diagnostics = recovery.parse_with_recovery(source)
+	assert diagnostics == []
+	assert tree == zypy_parser.parse(source)
+
+def test_error_at_end():
+	tree, diagnostics = recovery.parse_with_recovery("import a\nimport 'b")
+	assert tree.value == [ImportsList([ImportStatement('a')])]
+	assert [(d.line, d.kind) for d in diagnostics] == [(2, 'lexer')]
+
+def test_expression_statements():
+	source = 'import a\nx = 1\n' * 50
+	stdout = sys.stdout
+	sys.stdout = StringIO.StringIO()
+	try:
+		tree, diagnostics = recovery.parse_with_recovery(source)
+		# nothing is printed along the way
+		assert sys.stdout.getvalue() == ''
+	finally:
+		sys.stdout = stdout
+	assert [d.line for d in diagnostics] == range(2, 101, 2)
+	assert diagnostics[0] == recovery.Diagnostic(2, 1, 'parser', 'expression statements are not supported: x')
+	assert len(tree.value) == 50
@@ -0,0 +1,77 @@
+import cPickle
+import os
+import tempfile
+
+from samples import SOURCE
+from tokens import *
+import serialize
+import zypy_parser
+
+def test_round_trip():
+	tree = zypy_parser.parse(SOURCE)
+	data = serialize.dumps(tree)
+	assert data.startswith(serialize.MAGIC)
+	for lazy in (True, False):
+		assert serialize.loads(data, lazy=lazy) == tree
+	assert str(serialize.loads(data)) == str(tree)
+
+def test_deep_tree():
+	tree = zypy_parser.parse('def f():\n\treturn ' + ' + '.join(['a'] * 5000) + '\n')
+	data = serialize.dumps(tree)
+	for lazy in (True, False):
+		assert serialize.loads(data, lazy=lazy) == tree
+
+def test_values():
+	values = [None, True, False, 0, -1, 300, -2 ** 70, 1.5, 'x', u'\xe9', [1, (2, 3)], {'a': 1},
+		PassStatement, EOFToken, ForKeyword, PlusOperator, ComprehensionClause(IfKeyword, condition=Variable('x')),
+		ImaginaryToken(1, 2)]
+	assert serialize.loads(serialize.dumps(values)) == values
+	decoded = serialize.loads(serialize.dumps([PassStatement, IntegerToken(3), BarewordToken('self')]))
+	assert decoded[0] is PassStatement
+	assert decoded[1] is IntegerToken.of(3)
+	assert decoded[2] is BarewordToken.of('self')
+
+def test_lazy():
+	tree = zypy_parser.parse(SOURCE)
+	loaded = serialize.loads(serialize.dumps(tree))
+	foo, cls = loaded.value[2], loaded.value[3]
+	assert foo.fn_name == 'foo' and foo.kwargs == {'y': IntegerToken(3)}
+	assert cls.bases == tree.value[3].bases
+	assert not is_loaded(foo) and not is_loaded(cls)
+	assert foo.statements == tree.value[2].statements
+	assert is_loaded(foo) and not is_loaded(cls)
+	method, other = cls.statements
+	assert not is_loaded(method) and not is_loaded(other)
+	assert other.statements == [PassStatement]
+	assert method.statements == tree.value[3].statements[0].statements
+	# pickling forces whatever is still lazy
+	loaded = serialize.loads(serialize.dumps(tree))
+	assert cPickle.loads(cPickle.dumps(loaded, 2)) == tree
+
+def test_file():
+	tree = zypy_parser.parse(SOURCE)
+	fd, path = tempfile.mkstemp()
+	os.close(fd)
+	try:
+		serialize.dump(tree, path)
+		assert serialize.load(path) == tree
+	finally:
+		os.unlink(path)
+
+def test_errors():
+	data = serialize.dumps(zypy_parser.parse(SOURCE))
+	for bad in ('', 'garbage', serialize.MAGIC + '\x7f'):
+		try:
+			serialize.loads(bad)
+		except serialize.format_error:
+			pass
+		else:
+			assert False, "loaded %r" % bad
+	# a file written before a node class gained a field
+	old = data.replace('starkwargs', 'starkwargz')
+	try:
+		serialize.loads(old)
+	except serialize.format_error:
+		pass
+	else:
+		assert False
@@ -0,0 +1,73 @@
+from tokens import *
+from peeking_iterator import peeking_iterator
+from samples import SOURCE
+from token_buffer import TokenBuffer
+import lexer
+import zypy_parser
+
+def test_round_trip():
+	buf = TokenBuffer.from_source(SOURCE)
+	tokens = list(lexer.tokenize(SOURCE))
+	assert list(buf) == tokens
+	assert len(buf) == len(tokens)
+	assert buf.offset(1) == len('import ') and buf.token(0) is ImportKeyword
+	# repeated names are stored once
+	assert len(buf.payloads) < len([t for t in tokens if isinstance(t, (BarewordToken, Literal))])
+
+def test_spans():
+	buf = TokenBuffer()
+	for token, start, end in lexer.scan(SOURCE, spans=True):
+		buf.append(token, start)
+	assert list(buf) == list(lexer.tokenize(SOURCE))
+
+def test_cursor():
+	cursor = TokenBuffer.from_source("import a").cursor()
+	assert cursor.peek() is ImportKeyword
+	assert cursor.next() is ImportKeyword
+	cursor.push_back(NewlineToken)
+	assert cursor.next() is NewlineToken
+	assert cursor.next() == BarewordToken("a")
+	assert cursor.next() is EOFToken
+	assert cursor.has_next()
+	assert cursor.next() is None
+	assert not cursor.has_next()
+
+def test_parse():
+	buf = TokenBuffer.from_source(SOURCE)
+	assert zypy_parser.parse_program(buf.cursor()) == zypy_parser.parse(SOURCE)
+
+def test_huge_offsets():
+	# sources mapped from files can be larger than 2 GB
+	buf = TokenBuffer()
+	for offset in (0, 2 ** 31 - 1, 2 ** 31, 2 ** 40):
+		buf.append(PassKeyword, offset)
+	assert [buf.offset(i) for i in range(len(buf))] == [0, 2 ** 31 - 1, 2 ** 31, 2 ** 40]
+
+def test_flyweight_overflow():
+	# values past the shared tokens come back as equal tokens of their own
+	deepest = len(IndentationToken.shared) - 1
+	tokens = [IndentationToken.of(deepest), IndentationToken.of(deepest + 1), IndentationToken.of(100000),
+		IntegerToken.of(256), IntegerToken.of(257), IntegerToken.of(-1), IntegerToken.of(2 ** 100),
+		BarewordToken.of('self'), BarewordToken.of('uncommon')]
+	buf = TokenBuffer()
+	for token in tokens:
+		buf.append(token)
+	assert list(buf) == tokens
+	assert buf.token(0) is tokens[0] and buf.token(3) is tokens[3] and buf.token(7) is tokens[7]
+
+	# indentation deeper than the shared tokens, from the lexer
+	source = ''.join('\t' * depth + 'for a in b:\n' for depth in range(25)) + '\t' * 25 + 'pass\n'
+	buf = TokenBuffer.from_source(source)
+	assert list(buf) == list(lexer.tokenize(source))
+	assert zypy_parser.parse_program(buf.cursor()) == zypy_parser.parse(source)
+
+def test_many_payloads():
+	# more distinct names than a 16-bit index could refer to
+	buf = TokenBuffer()
+	names = ['name%d' % i for i in range(70000)]
+	for name in names:
+		buf.append(BarewordToken(name))
+	buf.append(BarewordToken('name0'))
+	assert len(buf.payloads) == len(names)
+	assert buf.token(len(names) - 1) == BarewordToken(names[-1])
+	assert buf.token(len(names)) is buf.token(0)
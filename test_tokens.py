@@ -0,0 +1,73 @@
+import pickle
+
+from tokens import *
+
+def test_fields():
+	assert DefStatement._fields == ('fn_name', 'statements', 'args', 'kwargs', 'starargs', 'starkwargs')
+	assert ImaginaryToken._fields == ('value', 'a', 'b')
+	assert not hasattr(Variable('x'), '__dict__')
+	assert not hasattr(IntegerToken(1), '__dict__')
+
+def test_equality():
+	assert Variable('x') == Variable('x')
+	assert Variable('x') != Variable('y')
+	assert Variable('x') != BarewordToken('x')
+	assert ComprehensionClause(IfKeyword, condition=Variable('x')) == ComprehensionClause(IfKeyword, condition=Variable('x'))
+	assert ComprehensionClause(IfKeyword, condition=Variable('x')) != ComprehensionClause(ForKeyword, variable=Variable('x'), collection=Variable('y'))
+
+def test_str():
+	assert str(ImportStatement('a', as_name='b')) == "ImportStatement(module_name=a, from_list=[], level=-1, as_name=b)"
+	assert str(ComprehensionClause(IfKeyword, condition=Variable('x'))) == "ComprehensionClause(type=if, condition=Variable(value=x))"
+	assert list(WithStatement(Variable('x'), None, []).iter_fields()) == [('context_manager', Variable('x')), ('name', None), ('statements', [])]
+
+def test_hash():
+	def tree(name):
+		return DefStatement('foo', [ReturnStatement(Call(Variable(name), [IntegerToken(1)], [('key', StringToken('a'))]))], ['x'], {'y': IntegerToken(3)})
+	assert hash(tree('x')) == hash(tree('x'))
+	assert hash(tree('x')) != hash(tree('y'))
+	table = {tree('x'): 1, Variable('x'): 2}
+	assert table[tree('x')] == 1 and table[Variable('x')] == 2 and Variable('y') not in table
+	assert hash(BarewordSpan("a x", 2, 3)) == hash(BarewordToken('x'))
+	assert hash(IntegerSpan("42", 0, 2)) == hash(IntegerToken(42))
+	assert hash(DefKeyword) == hash(lookup_keyword('def'))
+
+	# the hash is kept, and not pickled along
+	a, b = tree('x'), tree('y')
+	assert a != b
+	assert a._hash == hash(a) and b.statements[0]._hash == hash(b.statements[0])
+	copy = pickle.loads(pickle.dumps(a, 2))
+	assert not hasattr(copy, '_hash')
+	assert copy == a and hash(copy) == hash(a)
+
+	# the flyweight tokens can't be changed, the others can
+	for token in (IndentationToken.of(8), IntegerToken.of(1), BarewordToken.of('self')):
+		try:
+			token.value = 2
+		except AttributeError:
+			pass
+		else:
+			assert False, 'changed a shared token'
+	assert IndentationToken.of(8).value == 8 and IntegerToken.of(1).value == 1
+	token = IntegerToken.of(1000)
+	token.value = 2
+	assert token == IntegerToken(2)
+
+	# assigning a field drops the kept hash
+	node = Variable('x')
+	assert node == Variable('x')
+	node.value = 'y'
+	assert not hasattr(node, '_hash')
+	assert node == Variable('y') and node != Variable('x') and hash(node) == hash(Variable('y'))
+
+def test_deep_trees():
+	# a + a + ... nests to the left, one level per term
+	def chain(last, terms=5000):
+		node = Variable(last)
+		for i in range(terms):
+			node = BinaryOperation(PlusOperator, node, Variable('a'))
+		return node
+	assert hash(chain('a')) == hash(chain('a'))
+	assert chain('a') == chain('a')
+	assert chain('a') != chain('b')
+	assert str(chain('a', 3)) == 'BinaryOperation(operator=+, left=' * 3 + 'Variable(value=a)' + ', right=Variable(value=a))' * 3
+	assert str(chain('a')) == 'BinaryOperation(operator=+, left=' * 5000 + 'Variable(value=a)' + ', right=Variable(value=a))' * 5000
@@ -0,0 +1,118 @@
+from tokens import *
+import visitor
+import zypy_parser
+
+SOURCE = '''def foo(x, y=bar):
+	for a in b(x, key=c):
+		return a.d + e[f]
+	while (g for h in i if j):
+		pass
+class C(object):
+	return k
+'''
+
+def names(tree):
+	return [node.value for node in visitor.walk(tree) if isinstance(node, Variable)]
+
+def test_walk():
+	tree = zypy_parser.parse(SOURCE)
+	assert names(tree) == ['bar', 'a', 'b', 'x', 'c', 'a', 'e', 'f', 'g', 'h', 'i', 'j', 'object', 'k']
+	nodes = list(visitor.walk(tree))
+	assert nodes[0] is tree and nodes[1] is tree.value[0]
+	assert visitor.children(tree.value[1]) == [Variable('object'), ReturnStatement(Variable('k'))]
+
+def test_deep_tree():
+	tree = Variable('x')
+	for i in range(20000):
+		tree = UnaryOperation(MinusOperator, tree)
+	assert len(list(visitor.walk(tree))) == 20001
+
+	class Counter(visitor.NodeVisitor):
+		count = 0
+		def visit_Expression(self, node):
+			self.count += 1
+	counter = Counter()
+	counter.visit(tree)
+	assert counter.count == 20001
+
+	class Unwrap(visitor.NodeTransformer):
+		def transform_UnaryOperation(self, node):
+			return node.operand
+	assert Unwrap().transform(tree) == Variable('x')
+
+def test_visitor():
+	class Visitor(visitor.NodeVisitor):
+		def __init__(self):
+			self.events = []
+
+		def visit_Statement(self, node):
+			self.events.append(node.__class__.__name__)
+
+		def leave_DefStatement(self, node):
+			self.events.append('leave ' + node.fn_name)
+
+		def visit_WhileStatement(self, node):
+			self.events.append('while')
+			return visitor.SKIP
+
+		def visit_Variable(self, node):
+			self.events.append(node.value)
+
+	v = Visitor()
+	v.visit(zypy_parser.parse(SOURCE))
+	assert v.events == ['DefStatement', 'bar', 'ForStatement', 'a', 'b', 'x', 'c', 'ReturnStatement', 'a', 'e', 'f',
+		'while', 'leave foo', 'ClassStatement', 'object', 'ReturnStatement', 'k']
+	# the methods were looked up once for each node class
+	assert Visitor._handlers[WhileStatement][0] == Visitor.visit_WhileStatement
+	assert Visitor._handlers[ForStatement] == (Visitor.visit_Statement, None)
+	assert '_handlers' not in visitor.NodeVisitor.__dict__
+
+def test_transformer():
+	class Rename(visitor.NodeTransformer):
+		def transform_Variable(self, node):
+			return Variable(node.value.upper())
+
+		def transform_PassStatement(self, node):
+			return visitor.REMOVE
+
+	tree = zypy_parser.parse(SOURCE)
+	hash(tree)
+	new = Rename().transform(tree)
+	assert new is tree
+	assert names(new) == ['BAR', 'A', 'B', 'X', 'C', 'A', 'E', 'F', 'G', 'H', 'I', 'J', 'OBJECT', 'K']
+	assert new.value[0].statements[1].statements == []
+	assert new.value[0].kwargs == {'y': Variable('BAR')}
+	# the changed nodes are hashed again
+	expected = zypy_parser.parse('''def foo(x, y=BAR):
+	for A in B(X, key=C):
+		return A.d + E[F]
+	while (G for H in I if J):
+		pass
+class C(OBJECT):
+	return K
+''')
+	expected.value[0].statements[1].statements = []
+	assert hash(new) == hash(expected) and new == expected
+
+def test_transform_shared_tokens():
+	# the small integers are shared by every tree, so they can't be changed in place
+	class Increment(visitor.NodeTransformer):
+		def transform_IntegerToken(self, node):
+			node.value += 1
+			return node
+
+	try:
+		Increment().transform(zypy_parser.parse('def f():\n\treturn 1\n'))
+	except AttributeError:
+		pass
+	else:
+		assert False, 'changed a shared token'
+	assert IntegerToken.of(1).value == 1
+
+	class Replace(visitor.NodeTransformer):
+		def transform_IntegerToken(self, node):
+			return IntegerToken.of(node.value + 1)
+
+	new = Replace().transform(zypy_parser.parse('def f():\n\treturn 1\n'))
+	assert new == zypy_parser.parse('def f():\n\treturn 2\n')
+	assert IntegerToken.of(1).value == 1
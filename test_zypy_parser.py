@@ -1,6 +1,9 @@
+import tempfile
+
 
 from tokens import *
 from peeking_iterator import peeking_iterator
+from samples import SOURCE
 import zypy_parser
 import lexer
 
@@ -147,3 +150,132 @@ class foo(object, 42):
 	assert_parses(str, StatementList([
 		ClassStatement('foo', [Variable('object'), IntegerToken(42)], [PassStatement])
 	]))
+
+def test_lazy():
+	tree = zypy_parser.parse(SOURCE)
+	for engine in (None, 'loop'):
+		lazy = zypy_parser.parse(SOURCE, engine=engine, lazy=True)
+		assert [stmt.__class__ for stmt in lazy.value] == [ImportsList, ImportsList, DefStatement, ClassStatement, ForStatement, DefStatement]
+		foo = lazy.value[2]
+		assert foo.fn_name == 'foo' and foo.args == ['x'] and not is_loaded(foo)
+		inner = foo.statements[1]
+		assert is_loaded(foo) and not is_loaded(inner)
+		assert inner.statements == tree.value[2].statements[1].statements
+		assert lazy == tree
+
+def test_lazy_errors():
+	str = '''
+def foo(x):
+	while
+'''
+	tree = zypy_parser.parse(str, lazy=True)
+	try:
+		tree.value[0].statements
+	except zypy_parser.parse_error:
+		pass
+	else:
+		assert False, "body should not parse"
+
+class reading_file(object):
+	'''File-like object that records how far it has been read'''
+	def __init__(self, str):
+		self.str = str
+		self.pos = 0
+
+	def read(self, size):
+		out = self.str[self.pos:self.pos + size]
+		self.pos += len(out)
+		return out
+
+def test_iter_parse():
+	tree = zypy_parser.parse(SOURCE)
+	assert list(zypy_parser.iter_parse(SOURCE)) == tree.value
+	assert list(zypy_parser.iter_parse(SOURCE, lazy=True)) == tree.value
+	assert list(zypy_parser.iter_parse(reading_file(SOURCE))) == tree.value
+
+	# statements come out before the rest of the source is read
+	str = "def foo(x):\n\treturn x\n\n" * 10000
+	file = reading_file(str)
+	statements = zypy_parser.iter_parse(file)
+	assert statements.next() == zypy_parser.parse("def foo(x):\n\treturn x\n").value[0]
+	assert file.pos < len(str) // 2
+
+	# and before a later syntax error is found
+	statements = zypy_parser.iter_parse("import a\nwhile\n")
+	assert statements.next() == ImportsList([ImportStatement("a")])
+	try:
+		statements.next()
+	except zypy_parser.parse_error:
+		pass
+	else:
+		assert False, "while should not parse"
+
+def test_parse_mmap():
+	with tempfile.NamedTemporaryFile() as f:
+		f.write(SOURCE)
+		f.flush()
+		source = lexer.open_source(f.name)
+		tree = zypy_parser.parse(SOURCE)
+		# lexed in place, not read like a file: the second parse sees the whole source too
+		assert zypy_parser.parse(source) == tree
+		assert zypy_parser.parse(source) == tree
+		assert zypy_parser.parse(source, engine='loop') == tree
+		assert zypy_parser.parse(source, lazy=True) == tree
+		assert list(zypy_parser.iter_parse(source)) == tree.value
+		assert source.tell() == 0
+
+def assert_expression(str, expression):
+	parsed = zypy_parser.parse_expression(peeking_iterator(lexer.tokenize(str)))
+	assert parsed == expression, "%s != %s" % (parsed, expression)
+
+def test_arithmetic():
+	a, b, c = Variable('a'), Variable('b'), Variable('c')
+	assert_expression('a + b * c', BinaryOperation(PlusOperator, a, BinaryOperation(MultiplyOperator, b, c)))
+	assert_expression('a - b - c', BinaryOperation(MinusOperator, BinaryOperation(MinusOperator, a, b), c))
+	assert_expression('(a + b) // c', BinaryOperation(FloorDivideOperator, BinaryOperation(PlusOperator, a, b), c))
+	assert_expression('a ** b ** c', BinaryOperation(ExponentOperator, a, BinaryOperation(ExponentOperator, b, c)))
+	assert_expression('-a ** -b', UnaryOperation(MinusOperator, BinaryOperation(ExponentOperator, a, UnaryOperation(MinusOperator, b))))
+	assert_expression('a | b ^ c & ~a << 2', BinaryOperation(OrOperator, a, BinaryOperation(XorOperator, b,
+		BinaryOperation(AndOperator, c, BinaryOperation(LeftShiftOperator, UnaryOperation(ComplementOperator, a), IntegerToken(2))))))
+
+def test_boolean():
+	a, b, c = Variable('a'), Variable('b'), Variable('c')
+	assert_expression('a or b and not c', BinaryOperation(OrKeyword, a, BinaryOperation(AndKeyword, b, UnaryOperation(NotKeyword, c))))
+	assert_expression('not a == b', UnaryOperation(NotKeyword, Comparison(a, [EqualsOperator], [b])))
+	assert_expression('a < b <= c', Comparison(a, [LessThanOperator, LTEOperator], [b, c]))
+	assert_expression('a > b >= c', Comparison(a, [GreaterThanOperator, GTEOperator], [b, c]))
+	assert_expression('a not in b is not c', Comparison(a, [(NotKeyword, InKeyword), (IsKeyword, NotKeyword)], [b, c]))
+	assert_expression('a in b + c', Comparison(a, [InKeyword], [BinaryOperation(PlusOperator, b, c)]))
+	try:
+		assert_expression('a == not b', None)
+	except zypy_parser.parse_error:
+		pass
+	else:
+		assert False, "not can't follow =="
+
+def test_postfix():
+	a, b, c = Variable('a'), Variable('b'), Variable('c')
+	assert_expression('a.b.c', Attribute(Attribute(a, 'b'), 'c'))
+	assert_expression('a(b, c=1, *a, **b)', Call(a, [b], [('c', IntegerToken(1))], a, b))
+	assert_expression('a()()', Call(Call(a, [], []), [], []))
+	assert_expression('a(b for b in c)', Call(a, [GeneratorExpression(b, [ComprehensionClause(ForKeyword, variable=b, collection=c)])], []))
+	assert_expression('a[b][1:2, ::c]', Subscript(Subscript(a, b),
+		TupleLiteral([Slice(IntegerToken(1), IntegerToken(2)), Slice(None, None, c)])))
+	assert_expression('-a.b(c)[0]', UnaryOperation(MinusOperator, Subscript(Call(Attribute(a, 'b'), [c], []), IntegerToken(0))))
+
+def test_long_chain():
+	# operators of one precedence are handled iteratively, so this doesn't hit the recursion limit
+	str = ' + '.join(['a'] * 5000)
+	parsed = zypy_parser.parse_expression(peeking_iterator(lexer.tokenize(str)))
+	depth = 0
+	while isinstance(parsed, BinaryOperation):
+		parsed = parsed.left
+		depth += 1
+	assert depth == 4999
+
+def test_for_with_expressions():
+	assert_parses('''
+for x in a.b(c):
+	return x * 2
+''', StatementList([ForStatement(Variable('x'), Call(Attribute(Variable('a'), 'b'), [Variable('c')], []),
+		[ReturnStatement(BinaryOperation(MultiplyOperator, Variable('x'), IntegerToken(2)))])]))
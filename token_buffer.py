@@ -0,0 +1,150 @@
+'''Compact storage for a token stream.
+
+Token kinds live in an array('B'), source offsets and values in parallel arrays, and the
+barewords and literals in a side table, so a long token stream costs a few bytes per token
+instead of one Python object per token. TokenBuffer.cursor() reads the tokens back with the
+peek()/next()/push_back() interface the parser uses, so zypy_parser.parse_program() can run
+straight off a buffer.'''
+
+from array import array
+
+from tokens import *
+import lexer
+
+EOF_KIND = 0
+NEWLINE_KIND = 1
+INDENTATION_KIND = 2
+BAREWORD_KIND = 3
+STRING_KIND = 4
+INTEGER_KIND = 5
+FLOAT_KIND = 6
+IMAGINARY_KIND = 7
+
+payload_kinds = {
+	BarewordToken: BAREWORD_KIND,
+	StringToken: STRING_KIND,
+	IntegerToken: INTEGER_KIND,
+	FloatToken: FLOAT_KIND,
+	ImaginaryToken: IMAGINARY_KIND,
+}
+
+# every keyword and operator gets a kind of its own
+kind_tokens = [EOFToken, NewlineToken, None, None, None, None, None, None]
+kind_tokens += [kwd for _, kwd in sorted(Keyword.keywords.items())]
+kind_tokens += [op for _, op in sorted(Operator.operators.items())]
+assert len(kind_tokens) <= 256, "too many token kinds for array('B')"
+singleton_kinds = dict((token, kind) for kind, token in enumerate(kind_tokens) if token is not None)
+
+def token_kind(token):
+	if token in singleton_kinds:
+		return singleton_kinds[token]
+	elif isinstance(token, IndentationToken):
+		return INDENTATION_KIND
+	elif isinstance(token, SpanToken):
+		return payload_kinds[token.kind]
+	else:
+		return payload_kinds[token.__class__]
+
+class TokenBuffer(object):
+	def __init__(self):
+		self.kinds = array('B')
+		self.offsets = array('l')
+		# indentation width, or index into payloads
+		self.values = array('i')
+		self.payloads = []
+		self.payload_indices = {}
+
+	@classmethod
+	def from_source(cls, source):
+		buf = cls()
+		for token, start, end in lexer.scan(source):
+			buf.append(token, start)
+		return buf
+
+	def append(self, token, offset=0):
+		kind = token_kind(token)
+		if kind == INDENTATION_KIND:
+			value = token.value
+		elif kind >= BAREWORD_KIND and kind <= IMAGINARY_KIND:
+			if isinstance(token, SpanToken):
+				token = token.kind(token.value)
+			# identical literals share one entry
+			key = (kind, token.a, token.b) if kind == IMAGINARY_KIND else (kind, token.value)
+			value = self.payload_indices.get(key)
+			if value is None:
+				value = self.payload_indices[key] = len(self.payloads)
+				self.payloads.append(token)
+		else:
+			value = 0
+		self.kinds.append(kind)
+		self.offsets.append(offset)
+		self.values.append(value)
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def kind(self, i):
+		return self.kinds[i]
+
+	def offset(self, i):
+		return self.offsets[i]
+
+	def token(self, i):
+		kind = self.kinds[i]
+		if kind == INDENTATION_KIND:
+			return IndentationToken.of(self.values[i])
+		elif kind >= BAREWORD_KIND and kind <= IMAGINARY_KIND:
+			return self.payloads[self.values[i]]
+		else:
+			return kind_tokens[kind]
+
+	def __iter__(self):
+		for i in xrange(len(self.kinds)):
+			yield self.token(i)
+
+	def cursor(self, pos=0):
+		return TokenCursor(self, pos)
+
+	def nbytes(self):
+		'''Size of the arrays, not counting the side table'''
+		return sum(a.itemsize * len(a) for a in (self.kinds, self.offsets, self.values))
+
+class TokenCursor(object):
+	'''Reads tokens out of a TokenBuffer, behaving like a peeking_iterator over them'''
+	def __init__(self, buffer, pos=0):
+		self.buffer = buffer
+		self.pos = pos
+		self.end = len(buffer)
+		self.pushed = []
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		if self.pushed:
+			return self.pushed.pop()
+		pos = self.pos
+		if pos < self.end:
+			self.pos = pos + 1
+			return self.buffer.token(pos)
+		elif pos == self.end:
+			self.pos = pos + 1
+			return None
+		else:
+			raise StopIteration()
+
+	def peek(self):
+		if self.pushed:
+			return self.pushed[-1]
+		elif self.pos < self.end:
+			return self.buffer.token(self.pos)
+		elif self.pos == self.end:
+			return None
+		else:
+			raise StopIteration()
+
+	def has_next(self):
+		return bool(self.pushed) or self.pos <= self.end
+
+	def push_back(self, item):
+		self.pushed.append(item)
@@ -1,12 +1,125 @@
 
 def singleton(cls):
 	cls.__init__ = lambda self: None
+	# pickle by name, so unpickling gives back the one instance
+	cls.__reduce__ = lambda self: cls.__name__
 	return cls()
 
+class NodeType(type):
+	'''Metaclass for nodes. Each class lists the fields it adds in _fields; these become its
+	__slots__, and _fields is replaced by the full list of fields, inherited ones first.
+	A field that the class implements as a property does not get a slot.'''
+	def __new__(mcs, name, bases, namespace):
+		fields = []
+		for base in bases:
+			for field in getattr(base, '_fields', ()):
+				if field not in fields:
+					fields.append(field)
+		slots = list(namespace.get('__slots__', ()))
+		for field in namespace.get('_fields', ()):
+			if field not in fields:
+				fields.append(field)
+				if field not in namespace:
+					slots.append(field)
+		namespace['__slots__'] = tuple(slots)
+		namespace['_fields'] = tuple(fields)
+		return type.__new__(mcs, name, bases, namespace)
+
+# marks fields that were never set, e.g. the unused half of a ComprehensionClause
+missing = object()
+
+def structural_hash(value):
+	'''Hash of a field value that agrees with ==, also for lists, tuples and dicts'''
+	if isinstance(value, (list, tuple)):
+		return hash(tuple([structural_hash(item) for item in value]))
+	elif isinstance(value, dict):
+		return hash(frozenset([(key, structural_hash(item)) for key, item in value.iteritems()]))
+	return hash(value)
+
+# (class, method name) -> whether the class uses Node's own method of that name
+node_methods = {}
+
+def uses_node_method(cls, name):
+	try:
+		return node_methods[cls, name]
+	except KeyError:
+		result = node_methods[cls, name] = getattr(getattr(cls, name), 'im_func', None) is Node.__dict__[name]
+		return result
+
+def unhashed_nodes(node):
+	'''node and the nodes in its fields whose hashes haven't been computed yet, each after
+	the nodes inside it, so their hashes can be computed in this order without recursing'''
+	order = []
+	stack = [node]
+	while stack:
+		value = stack.pop()
+		if isinstance(value, (list, tuple)):
+			stack.extend(value)
+		elif isinstance(value, dict):
+			stack.extend(value.itervalues())
+		elif isinstance(value, Node) and uses_node_method(value.__class__, '__hash__') and not hasattr(value, '_hash'):
+			order.append(value)
+			for field in value._fields:
+				stack.append(getattr(value, field, missing))
+	order.reverse()
+	return order
+
+def fields_equal(left, right):
+	'''Whether nodes left and right have equal fields. Nodes inside them are compared
+	with an explicit stack, so long chains of operations don't run out of recursion.'''
+	pairs = [(getattr(left, field, missing), getattr(right, field, missing)) for field in left._fields]
+	while pairs:
+		a, b = pairs.pop()
+		if a is b:
+			continue
+		cls = a.__class__
+		if cls is not b.__class__:
+			if a != b:
+				return False
+		elif isinstance(a, Node) and uses_node_method(cls, '__eq__'):
+			if hash(a) != hash(b):
+				return False
+			pairs.extend([(getattr(a, field, missing), getattr(b, field, missing)) for field in cls._fields])
+		elif cls is list or cls is tuple:
+			if len(a) != len(b):
+				return False
+			pairs.extend(zip(a, b))
+		elif cls is dict:
+			if len(a) != len(b):
+				return False
+			for key, item in a.iteritems():
+				if key not in b:
+					return False
+				pairs.append((item, b[key]))
+		elif a != b:
+			return False
+	return True
+
+# ids of the flyweight tokens from the of() constructors; every tree has them, so changing
+# one would change all of them
+shared_tokens = set()
+
+# class -> names of the slots its instances are pickled with
+pickled_slots = {}
+
 class Node(object):
+	'''Nodes compare and hash by their class and fields. The hash is computed the first
+	time it is needed and then kept; equality checks it first, so nodes that differ are told
+	apart at once. Assigning a field drops the node's own hash, but the nodes that contain it
+	keep theirs, so a tree must not be changed below a node that has been hashed or compared.'''
+	__metaclass__ = NodeType
+	__slots__ = ('_hash',)
+
 	def __init__(self, value):
 		self.value = value
 
+	def iter_fields(self):
+		'''Generate (name, value) for each field that is set'''
+		for field in self._fields:
+			value = getattr(self, field, missing)
+			if value is not missing:
+				yield field, value
+
 	def __str__(self):
 		return str(self.value)
 
@@ -17,23 +130,49 @@ class Node(object):
 		return not (self == other)
 
 	def __eq__(self, other):
+		if self is other:
+			return True
 		if not isinstance(other, self.__class__):
 			return False
+		if hash(self) != hash(other):
+			return False
+		return fields_equal(self, other)
+
+	def __setattr__(self, name, value):
+		if name != '_hash':
+			if id(self) in shared_tokens:
+				raise AttributeError("%s is shared by every tree and can't be changed" % self.__class__.__name__)
+			if hasattr(self, '_hash'):
+				# the hash was computed from the old value
+				object.__delattr__(self, '_hash')
+		object.__setattr__(self, name, value)
+
+	def __hash__(self):
 		try:
-			for key in self.__dict__:
-				if not hasattr(key, '__call__'):
-					if getattr(self, key) != getattr(other, key):
-						return False
-			return True
+			return self._hash
 		except AttributeError:
-			return False
+			# hash the nodes inside first, so structural_hash() finds their hashes ready
+			for node in unhashed_nodes(self):
+				node._hash = node.structural_hash()
+			return self._hash
+
+	def structural_hash(self):
+		return hash((self.__class__,) + tuple([structural_hash(getattr(self, field, missing)) for field in self._fields]))
+
+	def __getstate__(self):
+		# leave out the hash: it depends on the ids of the classes, which differ between processes
+		cls = self.__class__
+		slots = pickled_slots.get(cls)
+		if slots is None:
+			slots = pickled_slots[cls] = [slot for klass in cls.__mro__ for slot in klass.__dict__.get('__slots__', ()) if slot != '_hash']
+		return None, dict((slot, getattr(self, slot)) for slot in slots if hasattr(self, slot))
 
 #
 # Lexer
 #
 
 class LexerToken(Node):
-	pass
+	_fields = ('value',)
 
 class Keyword(LexerToken):
 	keywords = {}
@@ -49,6 +188,17 @@ class Keyword(LexerToken):
 		except KeyError:
 			return None
 
+	def __reduce__(self):
+		return lookup_keyword, (self.value,)
+
+	# there is one of each keyword, so hashing by identity agrees with ==, and it is faster
+	# for the parser's tables
+	__hash__ = object.__hash__
+
+def lookup_keyword(value):
+	'''Look up the keyword singleton; used when unpickling keywords'''
+	return Keyword.keywords[value]
+
 DefKeyword = Keyword("def")
 ClassKeyword = Keyword("class")
 LambdaKeyword = Keyword("lambda")
@@ -96,6 +246,16 @@ class Operator(LexerToken):
 		except KeyError:
 			return None
 
+	def __reduce__(self):
+		return lookup_operator, (self.value,)
+
+	# one of each operator, like keywords
+	__hash__ = object.__hash__
+
+def lookup_operator(value):
+	'''Look up the operator singleton; used when unpickling operators'''
+	return Operator.operators[value]
+
 PlusOperator = Operator("+")
 MinusOperator = Operator("-")
 MultiplyOperator = Operator("*")
@@ -105,7 +265,7 @@ AndOperator = Operator("&")
 OrOperator = Operator("|")
 XorOperator = Operator("^")
 ExponentOperator = Operator("**")
-FloorDivideOperato = Operator("//")
+FloorDivideOperator = Operator("//")
 LeftShiftOperator = Operator("<<")
 RightShiftOperator = Operator(">>")
 PlusAssignOperator = Operator("+=")
@@ -127,7 +287,7 @@ NotEqualsOperator = Operator("!=")
 LessThanOperator = Operator("<")
 GreaterThanOperator = Operator(">")
 LTEOperator = Operator("<=")
-GreaterThanOperator = Operator(">=")
+GTEOperator = Operator(">=")
 AtOperator = Operator("@")
 OpeningParenOperator = Operator("(")
 ClosingParenOperator = Operator(")")
@@ -141,7 +301,23 @@ ColonOperator = Operator(":")
 SemicolonOperator = Operator(";")
 
 class BarewordToken(LexerToken):
-	pass
+	# identifiers common enough to share one token between all files
+	common = {}
+
+	@classmethod
+	def of(cls, name):
+		'''Token for name, shared if it is a common identifier'''
+		try:
+			return cls.common[name]
+		except KeyError:
+			if type(name) is str:
+				name = intern(name)
+			return cls(name)
+
+for name in ('self', 'cls', 'args', 'kwargs', 'i', 'j', 'k', 'n', 'x', 'y', 'a', 'b', 'f',
+		'None', 'True', 'False', 'object', 'len', 'range', 'os', 'sys'):
+	BarewordToken.common[name] = BarewordToken(intern(name))
+shared_tokens.update(id(token) for token in BarewordToken.common.itervalues())
 
 @singleton
 class EOFToken(LexerToken):
@@ -170,28 +346,48 @@ class NewlineToken(LexerToken):
 		return "<newline>"
 
 class IndentationToken(LexerToken):
+	# one shared token for every width up to 20 levels of tabs
+	shared = []
+
+	@classmethod
+	def of(cls, width):
+		'''Token for an indentation of width columns, shared for all but the deepest ones'''
+		try:
+			return cls.shared[width]
+		except IndexError:
+			return cls(width)
+
 	def __str__(self):
 		return "<indentation:%d>" % self.value
 
+IndentationToken.shared = [IndentationToken(width) for width in range(20 * 8 + 1)]
+shared_tokens.update(id(token) for token in IndentationToken.shared)
+
 #
 # Parser
 #
 
+# how deep str() of nested ASTNodes goes before it hands the rest of the tree to
+# dumper.dumps, which gives the same text without recursing
+STR_DEPTH = 100
+str_depth = [0]
+
 class ASTNode(Node):
 	def __str__(self):
-		# hackish but useful dumping method
-		out = self.__class__.__name__ + '('
-
-		props = []
-		for k, v in self.__dict__.iteritems():
-			# exclude methods
-			if not hasattr(v, '__call__'):
-				props.append("%s=%s" % (k, str(v)))
-
-		out += ', '.join(props)
-		return out + ')'
+		if str_depth[0] >= STR_DEPTH:
+			import dumper
+			return dumper.dumps(self)
+		str_depth[0] += 1
+		try:
+			# hackish but useful dumping method
+			props = ["%s=%s" % (k, str(v)) for k, v in self.iter_fields()]
+			return self.__class__.__name__ + '(' + ', '.join(props) + ')'
+		finally:
+			str_depth[0] -= 1
 
 class StatementList(ASTNode):
+	_fields = ('value',)
+
 	def __init__(self, statements=None):
 		if not statements:
 			statements = []
@@ -202,12 +398,16 @@ class Statement(ASTNode):
 
 class ImportsList(Statement):
 	'''Set of imports given in a single statement. List members should be ImportStatement instances.'''
+	_fields = ('value',)
+
 	def __init__(self, statements=None):
 		if not statements:
 			statements = []
 		self.value = statements
 
 class ImportStatement(ASTNode):
+	_fields = ('module_name', 'from_list', 'level', 'as_name')
+
 	def __init__(self, module_name, from_list=[], level=-1, as_name=None):
 		self.module_name = module_name
 		self.from_list = from_list
@@ -215,19 +415,58 @@ class ImportStatement(ASTNode):
 		self.as_name = as_name
 
 class WhileStatement(Statement):
+	_fields = ('condition', 'statements', 'else_block')
+
 	def __init__(self, condition, statements, else_block=None):
 		self.condition = condition
 		self.statements = statements
 		self.else_block = else_block
 
 class ForStatement(Statement):
+	_fields = ('lvalue', 'collection', 'statements', 'else_block')
+
 	def __init__(self, lvalue, collection, statements, else_block=None):
 		self.lvalue = lvalue
 		self.collection = collection
 		self.statements = statements
 		self.else_block = else_block
 
+class LazyBody(object):
+	'''Placeholder for a list of statements that is only built when it is first used'''
+	__slots__ = ('thunk',)
+
+	def __init__(self, thunk):
+		self.thunk = thunk
+
+	def force(self):
+		return self.thunk()
+
+	def __reduce__(self):
+		# the thunk can't be pickled, so pickle the statements themselves
+		return list, (self.force(),)
+
+def lazy_statements():
+	'''Property for a statements field that may hold a LazyBody until it is accessed'''
+	def get(self):
+		statements = self._statements
+		if type(statements) is LazyBody:
+			statements = self._statements = statements.force()
+		return statements
+
+	def set(self, statements):
+		self._statements = statements
+
+	return property(get, set)
+
+def is_loaded(node):
+	'''Whether the body of a def or class has been built yet'''
+	return type(node._statements) is not LazyBody
+
 class DefStatement(Statement):
+	__slots__ = ('_statements',)
+	_fields = ('fn_name', 'statements', 'args', 'kwargs', 'starargs', 'starkwargs')
+	statements = lazy_statements()
+
 	def __init__(self, fn_name, statements, args, kwargs, starargs=None, starkwargs=None):
 		self.fn_name = fn_name
 		self.statements = statements
@@ -237,19 +476,25 @@ class DefStatement(Statement):
 		self.starkwargs = starkwargs
 
 class WithStatement(Statement):
+	_fields = ('context_manager', 'name', 'statements')
+
 	def __init__(self, context_manager, name, statements):
 		self.context_manager = context_manager
 		self.name = name
 		self.statements = statements
 
 class ClassStatement(Statement):
+	__slots__ = ('_statements',)
+	_fields = ('class_name', 'bases', 'statements')
+	statements = lazy_statements()
+
 	def __init__(self, class_name, bases, statements):
 		self.class_name = class_name
 		self.bases = bases
 		self.statements = statements
 
 class ReturnStatement(Statement):
-	pass
+	_fields = ('value',)
 
 @singleton
 class NullStatement(Statement):
@@ -275,17 +520,22 @@ class Expression(ASTNode):
 	pass
 
 class Variable(Expression):
-	pass
+	_fields = ('value',)
 
 class TupleLiteral(Expression):
-	pass
+	_fields = ('value',)
 
 class GeneratorExpression(Expression):
+	_fields = ('code', 'clauses')
+
 	def __init__(self, code, clauses):
 		self.code = code
 		self.clauses = clauses
 
 class ComprehensionClause(ASTNode):
+	# only the fields that apply to the clause's type are set
+	_fields = ('type', 'condition', 'variable', 'collection')
+
 	def __init__(self, type, condition=None, variable=None, collection=None):
 		self.type = type
 		if type is ForKeyword:
@@ -299,6 +549,67 @@ class ComprehensionClause(ASTNode):
 		else:
 			assert False, "invalid comprehension clause type"
 
+class BinaryOperation(Expression):
+	'''left operator right; operator is an Operator, or AndKeyword or OrKeyword'''
+	_fields = ('operator', 'left', 'right')
+
+	def __init__(self, operator, left, right):
+		self.operator = operator
+		self.left = left
+		self.right = right
+
+class UnaryOperation(Expression):
+	'''operator is PlusOperator, MinusOperator, ComplementOperator or NotKeyword'''
+	_fields = ('operator', 'operand')
+
+	def __init__(self, operator, operand):
+		self.operator = operator
+		self.operand = operand
+
+class Comparison(Expression):
+	'''Chain of comparisons: left operators[0] operands[0] operators[1] operands[1] ...
+	"not in" and "is not" appear as the tuples (NotKeyword, InKeyword) and (IsKeyword, NotKeyword).'''
+	_fields = ('left', 'operators', 'operands')
+
+	def __init__(self, left, operators, operands):
+		self.left = left
+		self.operators = operators
+		self.operands = operands
+
+class Attribute(Expression):
+	_fields = ('value', 'attribute')
+
+	def __init__(self, value, attribute):
+		self.value = value
+		self.attribute = attribute
+
+class Subscript(Expression):
+	_fields = ('value', 'index')
+
+	def __init__(self, value, index):
+		self.value = value
+		self.index = index
+
+class Slice(Expression):
+	'''lower:upper:step inside a subscript; the parts that are left out are None'''
+	_fields = ('lower', 'upper', 'step')
+
+	def __init__(self, lower=None, upper=None, step=None):
+		self.lower = lower
+		self.upper = upper
+		self.step = step
+
+class Call(Expression):
+	'''kwargs is a list of (name, value) pairs, in the order they were given'''
+	_fields = ('function', 'args', 'kwargs', 'starargs', 'starkwargs')
+
+	def __init__(self, function, args, kwargs, starargs=None, starkwargs=None):
+		self.function = function
+		self.args = args
+		self.kwargs = kwargs
+		self.starargs = starargs
+		self.starkwargs = starkwargs
+
 #
 # Literals
 #
@@ -311,12 +622,24 @@ class StringToken(Literal):
 	pass
 
 class IntegerToken(Literal):
-	pass
+	shared = []
+
+	@classmethod
+	def of(cls, n):
+		'''Token for the integer n, shared if it is small'''
+		if 0 <= n < len(cls.shared):
+			return cls.shared[n]
+		return cls(n)
+
+IntegerToken.shared = [IntegerToken(n) for n in range(257)]
+shared_tokens.update(id(token) for token in IntegerToken.shared)
 
 class FloatToken(Literal):
 	pass
 
 class ImaginaryToken(Literal):
+	_fields = ('a', 'b')
+
 	def __init__(self, a=0, b=0):
 		self.a = a
 		self.b = b
@@ -329,3 +652,53 @@ class ImaginaryToken(Literal):
 		else:
 			return str(self.b) + 'j'
 
+#
+# Spans
+#
+
+class SpanToken(LexerToken):
+	'''Token that refers to its text by offsets into the source instead of copying it.
+	The text and value are only built when they are asked for.'''
+	_fields = ('source', 'start', 'end')
+	kind = None
+
+	def __init__(self, source, start, end):
+		self.source = source
+		self.start = start
+		self.end = end
+
+	@property
+	def text(self):
+		return self.source[self.start:self.end]
+
+	@property
+	def value(self):
+		return self.text
+
+	def __str__(self):
+		return str(self.kind(self.value))
+
+	def __eq__(self, other):
+		return isinstance(other, self.kind) and self.value == other.value
+
+	def structural_hash(self):
+		# the same as the token it stands for
+		return hash((self.kind, structural_hash(self.value)))
+
+class BarewordSpan(SpanToken, BarewordToken):
+	kind = BarewordToken
+
+class StringSpan(SpanToken, StringToken):
+	'''Span of a quoted string without escapes; the value is the text between the quotes'''
+	kind = StringToken
+
+	@property
+	def value(self):
+		return self.source[self.start + 1:self.end - 1]
+
+class IntegerSpan(SpanToken, IntegerToken):
+	kind = IntegerToken
+
+	@property
+	def value(self):
+		return int(self.text)
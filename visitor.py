@@ -0,0 +1,248 @@
+'''Walking, visiting and transforming trees without recursion
+
+	for node in visitor.walk(tree):
+		...
+
+	class Names(visitor.NodeVisitor):
+		def __init__(self):
+			self.names = set()
+
+		def visit_Variable(self, node):
+			self.names.add(node.value)
+
+Everything here keeps its own stack, so a tree of any depth can be handled. The fields a
+node's children are in come from CHILD_FIELDS, and the method for each node class is
+looked up once per visitor class and then kept in a table. Walking into a lazy def or
+class body parses it.'''
+
+from tokens import *
+
+# fields that hold nodes, or lists, tuples or dicts of them, for each class; the other
+# fields hold names, strings and numbers, or operator tokens
+CHILD_FIELDS = {
+	StatementList: ('value',),
+	ImportsList: ('value',),
+	ImportStatement: (),
+	WhileStatement: ('condition', 'statements', 'else_block'),
+	ForStatement: ('lvalue', 'collection', 'statements', 'else_block'),
+	DefStatement: ('kwargs', 'statements'),
+	WithStatement: ('context_manager', 'statements'),
+	ClassStatement: ('bases', 'statements'),
+	ReturnStatement: ('value',),
+	Variable: (),
+	TupleLiteral: ('value',),
+	GeneratorExpression: ('code', 'clauses'),
+	ComprehensionClause: ('condition', 'variable', 'collection'),
+	BinaryOperation: ('left', 'right'),
+	UnaryOperation: ('operand',),
+	Comparison: ('left', 'operands'),
+	Attribute: ('value',),
+	Subscript: ('value', 'index'),
+	Slice: ('lower', 'upper', 'step'),
+	Call: ('function', 'args', 'kwargs', 'starargs', 'starkwargs'),
+	# tokens, including literals, have no children
+	LexerToken: (),
+}
+
+# CHILD_FIELDS for every class seen so far, including subclasses of the classes in it
+child_fields_cache = {}
+
+def child_fields(cls):
+	'''Names of the fields of node class cls that can hold child nodes'''
+	try:
+		return child_fields_cache[cls]
+	except KeyError:
+		pass
+	for klass in cls.__mro__:
+		if klass in CHILD_FIELDS:
+			fields = CHILD_FIELDS[klass]
+			break
+	else:
+		# a node class nobody told us about; any field might hold nodes
+		fields = cls._fields
+	child_fields_cache[cls] = fields
+	return fields
+
+def push_children(stack, value):
+	'''Push the nodes in value (a field value: a node, a list, tuple or dict, or anything
+	else) onto stack, so that they are popped in order'''
+	if isinstance(value, Node):
+		stack.append(value)
+	elif isinstance(value, (list, tuple)):
+		for item in reversed(value):
+			push_children(stack, item)
+	elif isinstance(value, dict):
+		for key in sorted(value, reverse=True):
+			push_children(stack, value[key])
+
+def children(node):
+	'''The child nodes of node, in order'''
+	stack = []
+	for field in reversed(child_fields(node.__class__)):
+		push_children(stack, getattr(node, field, None))
+	stack.reverse()
+	return stack
+
+def walk(tree):
+	'''Generate every node in tree, parents before their children, in source order'''
+	stack = []
+	push_children(stack, tree)
+	while stack:
+		node = stack.pop()
+		yield node
+		for field in reversed(child_fields(node.__class__)):
+			push_children(stack, getattr(node, field, None))
+
+# returned by a visit_ method to keep the walk out of the node's children
+SKIP = object()
+
+class NodeVisitor(object):
+	'''Calls visit_<class name>(node) for each node in a tree, parents first, and after a
+	node's children leave_<class name>(node) if there is one. When a class has no method,
+	the one for its nearest base class is used (visit_Statement, visit_Expression, ...),
+	and otherwise generic_visit() or generic_leave(). visit() returns nothing.'''
+
+	def generic_visit(self, node):
+		pass
+
+	generic_leave = None
+
+	def handlers(self, cls):
+		'''(visit method, leave method or None) for node class cls, as unbound methods'''
+		visitor_class = self.__class__
+		# one table per visitor class, filled in as node classes come up
+		table = visitor_class.__dict__.get('_handlers')
+		if table is None:
+			table = {}
+			setattr(visitor_class, '_handlers', table)
+		try:
+			return table[cls]
+		except KeyError:
+			pass
+		visit = leave = None
+		for klass in cls.__mro__:
+			if visit is None:
+				visit = getattr(visitor_class, 'visit_' + klass.__name__, None)
+			if leave is None:
+				leave = getattr(visitor_class, 'leave_' + klass.__name__, None)
+		if visit is None:
+			visit = visitor_class.generic_visit
+		if leave is None:
+			leave = visitor_class.generic_leave
+		table[cls] = visit, leave
+		return visit, leave
+
+	def visit(self, tree):
+		stack = []
+		push_children(stack, tree)
+		handlers = self.handlers
+		while stack:
+			node = stack.pop()
+			if type(node) is tuple:
+				# (leave method, node) after the node's children
+				node[0](self, node[1])
+				continue
+			visit, leave = handlers(node.__class__)
+			if visit(self, node) is SKIP:
+				continue
+			if leave is not None:
+				stack.append((leave, node))
+			for field in reversed(child_fields(node.__class__)):
+				push_children(stack, getattr(node, field, None))
+
+# returned by a transform_ method to take a node out of the list it is in
+REMOVE = object()
+
+class NodeTransformer(NodeVisitor):
+	'''Rebuilds a tree from the bottom up. For each node, its children are transformed
+	first and put back in place, then transform_<class name>(node) (or the method for its
+	nearest base class, or generic_transform()) returns what replaces it: the node itself,
+	a different node, or REMOVE to drop it from the list it is in. Nodes are changed in
+	place; transform() returns the new tree. The tokens from the of() constructors are
+	shared by every tree and raise AttributeError when assigned to, so a transform_ method
+	for tokens returns a new one instead.'''
+
+	def generic_transform(self, node):
+		return node
+
+	def transformer(self, cls):
+		visitor_class = self.__class__
+		table = visitor_class.__dict__.get('_transformers')
+		if table is None:
+			table = {}
+			setattr(visitor_class, '_transformers', table)
+		try:
+			return table[cls]
+		except KeyError:
+			pass
+		for klass in cls.__mro__:
+			method = getattr(visitor_class, 'transform_' + klass.__name__, None)
+			if method is not None:
+				break
+		else:
+			method = visitor_class.generic_transform
+		table[cls] = method
+		return method
+
+	def transform(self, tree):
+		# entries are (value, None) for a value still to be transformed, and (value, keys)
+		# once its parts are on the stack; keys are the fields, indices or dict keys of the parts
+		stack = [(tree, None)]
+		# (transformed value, whether it is different from before) for each finished value
+		results = []
+		while stack:
+			value, keys = stack.pop()
+			if keys is None:
+				if isinstance(value, Node):
+					keys = child_fields(value.__class__)
+					parts = [getattr(value, field, None) for field in keys]
+				elif isinstance(value, (list, tuple)):
+					keys = range(len(value))
+					parts = value
+				elif isinstance(value, dict):
+					keys = sorted(value)
+					parts = [value[key] for key in keys]
+				else:
+					results.append((value, False))
+					continue
+				stack.append((value, keys))
+				for part in reversed(parts):
+					stack.append((part, None))
+				continue
+
+			start = len(results) - len(keys)
+			parts = results[start:]
+			del results[start:]
+			changed = any(part_changed for part, part_changed in parts)
+			if isinstance(value, Node):
+				if changed:
+					for field, (part, part_changed) in zip(keys, parts):
+						if part_changed:
+							setattr(value, field, None if part is REMOVE else part)
+					forget_hash(value)
+				new = self.transformer(value.__class__)(self, value)
+				results.append((new, changed or new is not value))
+			elif isinstance(value, list):
+				if changed:
+					value[:] = [part for part, part_changed in parts if part is not REMOVE]
+				results.append((value, changed))
+			elif isinstance(value, tuple):
+				if changed:
+					value = tuple([part for part, part_changed in parts if part is not REMOVE])
+				results.append((value, changed))
+			else:
+				if changed:
+					for key, (part, part_changed) in zip(keys, parts):
+						if part is REMOVE:
+							del value[key]
+						elif part_changed:
+							value[key] = part
+				results.append((value, changed))
+		return results[0][0]
+
+def forget_hash(node):
+	'''Drop the hash node has cached, after it has been changed'''
+	try:
+		del node._hash
+	except AttributeError:
+		pass
@@ -2,6 +2,7 @@
 
 from lexer import *
 from tokens import *
+from functools import partial
 from peeking_iterator import peeking_iterator
 
 
@@ -22,9 +23,166 @@ def ensure_follows(it, token, msg=None):
 	if next is not token:
 		raise parse_error("%s: expected %s, got %s" % (msg, token, next))
 
-def parse_expression(it):
-	# TODO I suppose we need operators
-	return parse_base_expression(it)
+# How tightly each kind of operator binds, loosest first
+(OR_PRECEDENCE, AND_PRECEDENCE, NOT_PRECEDENCE, COMPARISON_PRECEDENCE, BITWISE_OR_PRECEDENCE,
+	XOR_PRECEDENCE, BITWISE_AND_PRECEDENCE, SHIFT_PRECEDENCE, ARITHMETIC_PRECEDENCE,
+	TERM_PRECEDENCE, UNARY_PRECEDENCE, POWER_PRECEDENCE, POSTFIX_PRECEDENCE) = range(1, 14)
+
+def parse_expression(it, precedence=0):
+	'''Parse an expression made of operators binding at least as tightly as precedence.
+
+	This is precedence climbing: operands are parsed by recursing with a higher precedence,
+	and the operators following them are handled in a loop that looks each one up in
+	infix_operators, so a long chain like a + b + c doesn't recurse any deeper.'''
+	token = it.peek()
+	if token in prefix_operators:
+		it.next()
+		if token is NotKeyword and precedence > NOT_PRECEDENCE:
+			raise parse_error("Unexpected not")
+		left = UnaryOperation(token, parse_expression(it, prefix_operators[token]))
+	else:
+		left = parse_base_expression(it)
+
+	while True:
+		try:
+			operator_precedence, parse_infix = infix_operators[it.peek()]
+		except KeyError:
+			return left
+		if operator_precedence < precedence:
+			return left
+		left = parse_infix(it, left, it.next(), operator_precedence)
+
+def parse_binary_operation(it, left, operator, precedence):
+	# left associative: the right operand can't contain operators of the same precedence
+	return BinaryOperation(operator, left, parse_expression(it, precedence + 1))
+
+def parse_power(it, left, operator, precedence):
+	# right associative, and the exponent may be negated: 2 ** -x ** y is 2 ** (-(x ** y))
+	return BinaryOperation(operator, left, parse_expression(it, UNARY_PRECEDENCE))
+
+def parse_comparison(it, left, operator, precedence):
+	operators = []
+	operands = []
+	while True:
+		if operator is NotKeyword:
+			ensure_follows(it, InKeyword, "not in")
+			operator = (NotKeyword, InKeyword)
+		elif operator is IsKeyword and it.peek() is NotKeyword:
+			it.next()
+			operator = (IsKeyword, NotKeyword)
+		operators.append(operator)
+		operands.append(parse_expression(it, precedence + 1))
+		if infix_operators.get(it.peek(), (None,))[0] != COMPARISON_PRECEDENCE:
+			return Comparison(left, operators, operands)
+		operator = it.next()
+
+def parse_attribute(it, left, operator, precedence):
+	name = it.next()
+	if not isinstance(name, BarewordToken):
+		raise parse_error("Expected attribute name, got %s" % name)
+	return Attribute(left, name.value)
+
+def parse_call(it, left, operator, precedence):
+	args = []
+	kwargs = []
+	starargs = None
+	starkwargs = None
+	while True:
+		token = it.next()
+		if token is ClosingParenOperator:
+			break
+		elif token is MultiplyOperator:
+			if starargs is not None or starkwargs is not None:
+				raise parse_error("Unexpected *args")
+			starargs = parse_expression(it)
+		elif token is ExponentOperator:
+			if starkwargs is not None:
+				raise parse_error("Unexpected **kwargs")
+			starkwargs = parse_expression(it)
+		elif isinstance(token, BarewordToken) and it.peek() is AssignmentOperator:
+			if starkwargs is not None:
+				raise parse_error("Keyword argument after **kwargs")
+			it.next()
+			kwargs.append((token.value, parse_expression(it)))
+		else:
+			if kwargs or starargs is not None or starkwargs is not None:
+				raise parse_error("Positional argument after keyword arguments")
+			it.push_back(token)
+			arg = parse_expression(it)
+			if not args and it.peek() is ForKeyword:
+				# f(x for x in y)
+				it.next()
+				args.append(GeneratorExpression(arg, parse_comprehension(it, closing=ClosingParenOperator, name="generator")))
+				break
+			args.append(arg)
+
+		token = it.next()
+		if token is ClosingParenOperator:
+			break
+		elif token is not CommaOperator:
+			raise parse_error("Unexpected %s in argument list" % token)
+	return Call(left, args, kwargs, starargs, starkwargs)
+
+def parse_subscript_part(it):
+	'''An index or slice inside square brackets'''
+	parts = []
+	while True:
+		if it.peek() in (ColonOperator, ClosingSquareBracketOperator, CommaOperator):
+			parts.append(None)
+		else:
+			parts.append(parse_expression(it))
+		if it.peek() is not ColonOperator or len(parts) == 3:
+			break
+		it.next()
+	if len(parts) == 1:
+		if parts[0] is None:
+			raise parse_error("Expected an index")
+		return parts[0]
+	return Slice(*parts)
+
+def parse_subscript(it, left, operator, precedence):
+	index = parse_subscript_part(it)
+	if it.peek() is CommaOperator:
+		index = TupleLiteral([index])
+		while it.peek() is CommaOperator:
+			it.next()
+			if it.peek() is ClosingSquareBracketOperator:
+				break
+			index.value.append(parse_subscript_part(it))
+	ensure_follows(it, ClosingSquareBracketOperator, "subscript")
+	return Subscript(left, index)
+
+# operators that can start an expression, with the precedence of their operand
+prefix_operators = {
+	NotKeyword: NOT_PRECEDENCE,
+	PlusOperator: UNARY_PRECEDENCE,
+	MinusOperator: UNARY_PRECEDENCE,
+	ComplementOperator: UNARY_PRECEDENCE,
+}
+
+# operators that follow an operand: (precedence, function that parses the rest)
+infix_operators = {
+	OrKeyword: (OR_PRECEDENCE, parse_binary_operation),
+	AndKeyword: (AND_PRECEDENCE, parse_binary_operation),
+	OrOperator: (BITWISE_OR_PRECEDENCE, parse_binary_operation),
+	XorOperator: (XOR_PRECEDENCE, parse_binary_operation),
+	AndOperator: (BITWISE_AND_PRECEDENCE, parse_binary_operation),
+	LeftShiftOperator: (SHIFT_PRECEDENCE, parse_binary_operation),
+	RightShiftOperator: (SHIFT_PRECEDENCE, parse_binary_operation),
+	PlusOperator: (ARITHMETIC_PRECEDENCE, parse_binary_operation),
+	MinusOperator: (ARITHMETIC_PRECEDENCE, parse_binary_operation),
+	MultiplyOperator: (TERM_PRECEDENCE, parse_binary_operation),
+	DivideOperator: (TERM_PRECEDENCE, parse_binary_operation),
+	FloorDivideOperator: (TERM_PRECEDENCE, parse_binary_operation),
+	ModuloOperator: (TERM_PRECEDENCE, parse_binary_operation),
+	ExponentOperator: (POWER_PRECEDENCE, parse_power),
+	DotOperator: (POSTFIX_PRECEDENCE, parse_attribute),
+	OpeningParenOperator: (POSTFIX_PRECEDENCE, parse_call),
+	OpeningSquareBracketOperator: (POSTFIX_PRECEDENCE, parse_subscript),
+}
+for operator in (EqualsOperator, NotEqualsOperator, LessThanOperator, GreaterThanOperator,
+		LTEOperator, GTEOperator, InKeyword, NotKeyword, IsKeyword):
+	infix_operators[operator] = (COMPARISON_PRECEDENCE, parse_comparison)
 
 def parse_base_expression(it):
 	next = it.next()
@@ -76,7 +234,7 @@ def parse_comprehension(it, closing=None, name="comprehension"):
 		if next is closing:
 			break
 		elif next is ForKeyword:
-			variable = parse_expression(it)
+			variable = parse_lvalue(it)
 			ensure_follows(it, InKeyword, msg=name)
 			collection = parse_expression(it)
 			clauses.append(ComprehensionClause(ForKeyword, variable=variable, collection=collection))
@@ -91,10 +249,11 @@ def parse_comprehension(it, closing=None, name="comprehension"):
 def parse_lvalue(it):
 	'''Parse an lvalue (e.g., "a, _", "a, (b, c)")'''
 	# This is also what CPython does. A later stage in the implementation
-	# will have to confirm it's a real lvalue.
-	return parse_expression(it)
+	# will have to confirm it's a real lvalue. Comparisons are left out, so
+	# that the "in" of a for loop ends it.
+	return parse_expression(it, BITWISE_OR_PRECEDENCE)
 
-def parse_colon_and_statement_list(it, level=0):
+def parse_colon_and_statement_list(it, level=0, lazy=False):
 	next = it.next()
 	if next is not ColonOperator:
 		raise parse_error("Expected colon, got %s" % next)
@@ -121,7 +280,7 @@ def parse_colon_and_statement_list(it, level=0):
 			raise parse_error("Continuation line must be indented at least as much as starting line")
 
 		indented_level = next.value
-		append_parse_statement(statements, it, level=indented_level)
+		append_parse_statement(statements, it, level=indented_level, lazy=lazy)
 
 		while True:
 			next = it.peek()
@@ -158,10 +317,66 @@ def parse_colon_and_statement_list(it, level=0):
 					it.next()
 			else:
 				raise parse_error(str(next))
-			append_parse_statement(statements, it, level=indented_level)
+			append_parse_statement(statements, it, level=indented_level, lazy=lazy)
 
 	return statements
 
+def skip_statement_list(it, level=0):
+	'''Consume the tokens that parse_colon_and_statement_list would after the colon, without
+	parsing them, and return them. Only newlines and indentation are looked at.'''
+	tokens = []
+	if it.peek() is not NewlineToken:
+		# one line; parse_colon_and_statement_list stops in front of the newline
+		while it.peek() not in (NewlineToken, EOFToken, None):
+			tokens.append(it.next())
+		return tokens
+
+	tokens.append(it.next())
+	while True:
+		next = it.peek()
+		if next is EOFToken or next is None:
+			break
+		elif next is NewlineToken:
+			it.next()
+			indentation = it.peek()
+			if isinstance(indentation, IndentationToken) and indentation.value > level:
+				tokens.append(NewlineToken)
+			else:
+				# the block ends; like parse_colon_and_statement_list, leave the indentation
+				break
+		else:
+			tokens.append(it.next())
+	return tokens
+
+def parse_lazy_block(string, start, stop, level):
+	cursor = scan_cursor(string, scan_block(string, start, stop), stop)
+	cursor.push_back(ColonOperator)
+	return parse_colon_and_statement_list(cursor, level=level, lazy=True)
+
+def parse_lazy_tokens(tokens, level):
+	return parse_colon_and_statement_list(peeking_iterator(tokens), level=level, lazy=True)
+
+def parse_body(it, level=0, lazy=False):
+	'''Parse the body of a def or class. With lazy, the body is skipped and only parsed (lazily
+	again) when its statements are first needed; errors inside it are not noticed until then.'''
+	if not lazy:
+		return parse_colon_and_statement_list(it, level=level)
+
+	next = it.next()
+	if next is not ColonOperator:
+		raise parse_error("Expected colon, got %s" % next)
+	if it.peek() is NewlineToken and isinstance(it, scan_cursor):
+		# step over the block's text instead of lexing it
+		block = it.skip_block(level)
+		if block is not None:
+			start, stop = block
+			return LazyBody(partial(parse_lazy_block, it.string, start, stop, level))
+
+	tokens = [ColonOperator] + skip_statement_list(it, level=level)
+	# end the block the way the source did, so a trailing while or for finds its indentation
+	tokens += [NewlineToken, IndentationToken.of(level), EOFToken]
+	return LazyBody(partial(parse_lazy_tokens, tokens, level))
+
 def parse_closing_else_block(it, level=0):
 	indentation = it.next()
 	assert isinstance(indentation, IndentationToken), "expected indentation: %s" % indentation
@@ -302,7 +517,7 @@ def parse_while_statement(it, level=0):
 	else_block = parse_closing_else_block(it, level=level)
 	return WhileStatement(condition, statements, else_block)
 
-def parse_class_statement(it, level=0):
+def parse_class_statement(it, level=0, lazy=False):
 	cls_name = it.next()
 	if not isinstance(cls_name, BarewordToken):
 		raise parse_error('Expected a function name (not %r)' % func_name)
@@ -326,11 +541,11 @@ def parse_class_statement(it, level=0):
 		else:
 			raise parse_error('Unexpected %r' % token)
 
-	statements = parse_colon_and_statement_list(it, level=level)
+	statements = parse_body(it, level=level, lazy=lazy)
 	return ClassStatement(cls_name.value, bases, statements)
 
 
-def parse_def_statement(it, level=0):
+def parse_def_statement(it, level=0, lazy=False):
 	func_name = it.next()
 	if not isinstance(func_name, BarewordToken):
 		raise parse_error('Expected a function name (not %r)' % func_name)
@@ -391,7 +606,7 @@ def parse_def_statement(it, level=0):
 		elif next_token is not CommaOperator:
 			raise parse_error('Unexpected %r' % next_token)
 
-	statements = parse_colon_and_statement_list(it, level=level)
+	statements = parse_body(it, level=level, lazy=lazy)
 	return DefStatement(func_name.value, statements, args, kwargs, starargs, starkwargs)
 
 def parse_try_statement(it, level=0):
@@ -443,8 +658,10 @@ keyworded_statements = {
 }
 multiline_keywords = set(keyworded_statements)
 keyworded_statements.update(one_line_keyworded_statements)
+# statements whose bodies can be parsed lazily
+lazy_keywords = set([DefKeyword, ClassKeyword])
 
-def parse_statement(it, level=0, one_line=False):
+def parse_statement(it, level=0, one_line=False, lazy=False):
 	token = it.peek()
 	if isinstance(token, IndentationToken):
 		it.next()
@@ -453,7 +670,10 @@ def parse_statement(it, level=0, one_line=False):
 	statement_dict = one_line_keyworded_statements if one_line else keyworded_statements
 	if token in statement_dict:
 		it.next()
-		statement = statement_dict[token](it, level=level)
+		if lazy and token in lazy_keywords:
+			statement = statement_dict[token](it, level=level, lazy=True)
+		else:
+			statement = statement_dict[token](it, level=level)
 		if token in multiline_keywords:
 			# these will consume the newline
 			it.push_back(NewlineToken)
@@ -468,26 +688,88 @@ def parse_statement(it, level=0, one_line=False):
 		return None
 	else:
 		# assignment, or just an expression
-		# ???
-		print token, repr(token)
-		raise NotImplementedError()
+		raise parse_error("expression statements are not supported: %s" % token)
+
+# errors a recovering cursor records instead of ending the parse; the parser's assertions
+# fail for some constructs it doesn't handle yet
+RECOVERABLE_ERRORS = (parse_error, AssertionError)
+
+def try_parse_statement(it, level=0, one_line=False, **kwargs):
+	'''parse_statement(), except that with a cursor that collects diagnostics (see recovery.py)
+	an error is recorded and the rest of the statement skipped, and None is returned. A
+	cursor that keeps the blocks of an earlier parse (see incremental.py) gets to hand out
+	the statement instead.'''
+	if getattr(it, 'reuse_statement', None) is not None and not one_line:
+		return it.reuse_statement(level, partial(parse_statement, it, level=level, **kwargs))
+	if getattr(it, 'diagnostics', None) is None:
+		return parse_statement(it, level=level, one_line=one_line, **kwargs)
+	try:
+		return parse_statement(it, level=level, one_line=one_line, **kwargs)
+	except RECOVERABLE_ERRORS as e:
+		it.record(e)
+		skip_statement(it, level, one_line)
+		return None
+
+def skip_statement(it, level=0, one_line=False):
+	'''Skip what is left of a statement that failed to parse: up to the newline that ends it
+	and, unless it was a one-line statement, the lines after it that are indented more than
+	level, which would be its block'''
+	if it.last is NewlineToken:
+		# the error was at the end of the line
+		it.push_back(NewlineToken)
+	while True:
+		token = it.peek()
+		if token is EOFToken or token is None:
+			return
+		elif token is NewlineToken:
+			if one_line:
+				return
+			it.next()
+			indentation = it.peek()
+			if not isinstance(indentation, IndentationToken) or indentation.value <= level:
+				it.push_back(NewlineToken)
+				return
+		it.next()
 
 def append_parse_statement(list, it, **kwargs):
-	stmt = parse_statement(it, **kwargs)
+	stmt = try_parse_statement(it, **kwargs)
 	if stmt is not None:
 		list.append(stmt)
 
-def parse_program(it):
+def iter_statements(it, lazy=False):
+	'''Generate the top-level statements of the program read from it, each as soon as it is complete'''
 	# TODO: detect encoding. Anything else weird in global scope?
-	out = StatementList()
 	while it.peek() not in (EOFToken, None):
-		append_parse_statement(out.value, it)
+		stmt = try_parse_statement(it, lazy=lazy)
+		if stmt is not None:
+			yield stmt
 
+def parse_program(it, lazy=False):
+	out = StatementList()
+	out.value.extend(iter_statements(it, lazy=lazy))
 	return out
 
-def parse(str):
-	tokenizer = tokenize(str)
-	pi = peeking_iterator(tokenizer)
-	program = parse_program(pi)
-	return program
-
+def source_cursor(source, engine=None, lazy=False):
+	'''The token cursor parse() and iter_parse() read source through. A file-like source is
+	read in chunks by tokenize_stream(), whatever the engine; an mmap is lexed in place, like
+	a string.'''
+	if is_stream(source):
+		return peeking_iterator(tokenize_stream(source))
+	elif lazy and engine in (None, 'regex'):
+		# a cursor that can skip over the bodies
+		return scan_cursor(source_buffer(source))
+	else:
+		return peeking_iterator(tokenize(source, engine=engine))
+
+def parse(str, engine=None, lazy=False):
+	'''Parse str into a StatementList. With lazy, the bodies of defs and classes are only
+	parsed when their statements are first accessed, and errors in them surface then.'''
+	return parse_program(source_cursor(str, engine, lazy), lazy=lazy)
+
+def iter_parse(source, engine=None, lazy=False):
+	'''Generate the top-level statements of source one at a time, like the elements of
+	parse(source).value. Nothing refers to a statement once it has been handed out, and
+	source can be a file-like object, which is read as the statements are needed; so
+	memory doesn't grow with the size of the program. A syntax error is raised when the
+	statement it is in is reached.'''
+	return iter_statements(source_cursor(source, engine, lazy), lazy=lazy)